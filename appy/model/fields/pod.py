@@ -9,6 +9,7 @@ from appy.model.fields.file import FileInfo
 from appy.model.utils import Object
 from appy.pod import PodError, styles_manager
 from appy.pod.renderer import Renderer
+from appy.pod.cache import ResultCache
 from appy.utils.path import resolvePath, getOsTempFolder
 
 # Error messages ---------------------------------------------------------------
@@ -88,6 +89,9 @@ class Pod(Field):
     # machinery for this.
     customGetValue = True
 
+    # The default cache for the results of pod fields defining a "cacheKey"
+    resultCache = ResultCache()
+
     # Icon allowing to generate a given template in a given format
     pxIcon = Px('''
      <img var="iconSuffix=frozen and 'Frozen' or '';
@@ -193,7 +197,7 @@ class Pod(Field):
       mailingName=None, showMailing=None, mailingInfo=None, view=None,
       cell=None, xml=None, downloadName=None, downloadDisposition='attachment',
       forceOoCall=False, script=None, confirm=False, raiseOnError=False,
-      action=None, beforeAction=None):
+      action=None, beforeAction=None, cacheKey=None, resultCache=None):
         # Param "template" stores the path to the pod template(s). If there is
         # a single template, a string is expected. Else, a list or tuple of
         # strings is expected. Every such path must be relative to your
@@ -382,6 +386,23 @@ class Pod(Field):
         # generated, set a method in parameter "beforeAction". This method's
         # signature must be the same as for parameter "action" hereabove.
         self.beforeAction = beforeAction
+        # If the result of this pod field only depends on a few object fields,
+        # set, in "cacheKey", a method accepting parameters "template" and
+        # "format" (as for parameter "action" hereabove) and returning a string
+        # computed from these fields. Results are then cached on disk and
+        # reused, without calling pod and LibreOffice, as long as the template
+        # content, the cache key and the object's modification date are
+        # unchanged. If the method returns None, the result is not cached.
+        # Query-related pods, requests defining a custom context and results
+        # containing errors are never cached. Note that "action" and
+        # "beforeAction" are not executed when a result comes from the cache.
+        # Every time the object is modified, call m_invalidateCache (ie, from
+        # its "onEdit" method) to remove its cached results.
+        self.cacheKey = cacheKey
+        # The cache is an instance of class ResultCache hereabove. If
+        # "resultCache" is None, the default cache, in Pod.resultCache, is
+        # used.
+        if resultCache: self.resultCache = resultCache
         # Call the base constructor
         Field.__init__(self, None, (0,1), default, show, page, group, layouts,
           move, False, True, None, False, specificReadPermission,
@@ -619,6 +640,17 @@ class Pod(Field):
         if not result:
             result = '%s/%s_%f.%s' % (getOsTempFolder(), obj.id, time.time(),
                                       format)
+        # Get the result from the cache when possible
+        cached = None
+        if self.cacheKey and not queryData and not customContext:
+            key = self.cacheKey(obj, template, format)
+            if key is not None:
+                cached = self.resultCache.getPath(obj, self, templatePath,
+                                                  format, key)
+                if self.resultCache.get(cached, result):
+                    fileName = self.getDownloadName(obj, template, format,
+                                                    False)
+                    return FileInfo(result, inDb=False, uploadName=fileName)
         # Define parameters to give to the appy.pod renderer
         podContext = {'tool': tool, 'user': obj.user, 'self': obj, 'field':self,
                       'now': ztool.getProductConfig().DateTime(),
@@ -669,6 +701,9 @@ class Pod(Field):
         try:
             renderer = Renderer(**rendererParams)
             renderer.run()
+            # Cache the result when relevant
+            if cached:
+                self.resultCache.put(cached, result, renderer.getErrors())
         except PodError as pe:
             if not os.path.exists(result):
                 # In some (most?) cases, when OO returns an error, the result is
@@ -683,6 +718,11 @@ class Pod(Field):
         # Get a FileInfo instance to manipulate the file on the filesystem
         return FileInfo(result, inDb=False, uploadName=fileName)
 
+    def invalidateCache(self, obj):
+        '''Removes, from the result cache, the results cached for p_obj. Call
+           this method every time p_obj is modified.'''
+        self.resultCache.invalidate(obj)
+
     def getBaseName(self, template=None):
         '''Gets the "base name" of p_template (or self.template[0] if not
            given). The base name is the name of the template, without path
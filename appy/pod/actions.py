@@ -1,5 +1,6 @@
 # ~license~
 # ------------------------------------------------------------------------------
+import re
 from appy.pod import PodError
 from appy.model.utils import Object
 from appy.utils import Traceback, commercial, CommercialError
@@ -33,6 +34,8 @@ class Action:
         # The Python expression to evaluate (may be None in the case of a
         # Null or Else action, for example).
         self.expr = expr
+        # The compiled form of p_expr, as a tuple (code, errorCode)
+        self.code = expr and compileExprs(expr) or None
         # The element within the buffer that is the action's target
         self.elem = elem
         # If "minus" is True, the main elem(s) must not be dumped
@@ -51,6 +54,7 @@ class Action:
         self.source = 'from'
         self.fromPlus = plus
         self.fromExpr = expr
+        self.fromCode = compileExpr(expr)
 
     def getExceptionLine(self, e):
         '''Gets the line describing exception p_e, containing the exception
@@ -63,13 +67,16 @@ class Action:
         if self.buffer.env.raiseOnError:
             if not self.buffer.pod:
                 # Add in the error message the line nb where the errors occurs
-                # within the PX.
-                locator = self.buffer.env.parser.locator
-                # The column number may not be given
-                col = locator.getColumnNumber()
-                if col == None: col = ''
-                else: col = ', column %d' % col
-                errorMessage += ' (line %s%s)' % (locator.getLineNumber(), col)
+                # within the PX. There is no locator if the AST was loaded from
+                # a cache (see appy.px.cache).
+                locator = getattr(self.buffer.env.parser, 'locator', None)
+                if locator:
+                    # The column number may not be given
+                    col = locator.getColumnNumber()
+                    if col == None: col = ''
+                    else: col = ', column %d' % col
+                    errorMessage += ' (line %s%s)' % \
+                                    (locator.getLineNumber(), col)
                 # Integrate the traceback (at least, its last lines)
                 errorMessage += '\n' + Traceback.get(6).decode('utf-8')
             if originalError:
@@ -80,29 +87,31 @@ class Action:
         # for loop, this buffer will contain the error message and not the
         # content to repeat anymore. It means that this error will also show up
         # for every subsequent iteration.
+        if self.buffer.pod: self.buffer.env.errors += 1
         tempBuffer = self.buffer.clone()
         PodError.dump(tempBuffer, errorMessage, withinElement=self.elem)
         tempBuffer.evaluate(result, context)
 
-    def _evalExpr(self, expr, context):
-        '''Evaluates p_expr with p_context. p_expr can contain an error expr,
-           in the form "someExpr|errorExpr". If it is the case, if the "normal"
-           expr raises an error, the "error" expr is evaluated instead.'''
-        if '|' not in expr:
-            res = eval(expr, context)
+    def _evalExpr(self, code, context):
+        '''Evaluates p_code with p_context. p_code is a tuple (code, errorCode)
+           as produced by function appy.pod.elements.compileExprs. If the
+           "normal" code raises an error and an "error" code is there, the
+           latter is evaluated instead.'''
+        code, errorCode = code
+        if errorCode is None:
+            res = eval(code, context)
         else:
-            expr, errorExpr = expr.rsplit('|', 1)
             try:
-                res = eval(expr, context)
+                res = eval(code, context)
             except Exception:
-                res = eval(errorExpr, context)
+                res = eval(errorCode, context)
         return res
 
-    def evaluateExpression(self, result, context, expr):
-        '''Evaluates expression p_expr with the current p_context. Returns a
-           tuple (result, errorOccurred).'''
+    def evaluateExpression(self, result, context, expr, code):
+        '''Evaluates expression p_expr, whose compiled form is p_code, with the
+           current p_context. Returns a tuple (result, errorOccurred).'''
         try:
-            res = self._evalExpr(expr, context)
+            res = self._evalExpr(code, context)
             error = False
         except Exception as e:
             # Hack for MessageException instances: always re-raise it as is
@@ -125,7 +134,8 @@ class Action:
             # Evaluate self.expr in eRes
             eRes = None
             if self.expr:
-                eRes,error = self.evaluateExpression(result, context, self.expr)
+                eRes, error = self.evaluateExpression(result, context,
+                                                      self.expr, self.code)
             if not error:
                 # Trigger action-specific behaviour
                 self.do(result, context, eRes)
@@ -146,7 +156,7 @@ class Action:
             fromRes = None
             error = False
             try:
-                fromRes = eval(self.fromExpr, context)
+                fromRes = eval(self.fromCode, context)
             except Exception as e:
                 msg = FROM_EVAL_ERROR % (self.fromExpr,self.getExceptionLine(e))
                 self.manageError(result, context, msg, e)
@@ -206,7 +216,8 @@ class Else(If):
     def do(self, result, context, exprRes):
         # This action is executed if the tied "if" action is not executed
         ifAction = self.ifAction
-        iRes, error = ifAction.evaluateExpression(result,context,ifAction.expr)
+        iRes, error = ifAction.evaluateExpression(result, context,
+                                                  ifAction.expr, ifAction.code)
         If.do(self, result, context, not iRes)
 
 class For(Action):
@@ -319,6 +330,7 @@ class For(Action):
                 result.dumpElement(Cell.OD.elem)
         # Enter the "for" loop
         loop, outerLoop = self.initialiseLoop(context, elems)
+        profiler = self.buffer.env.profiler
         i = -1
         for item in elems:
             i += 1
@@ -342,6 +354,7 @@ class For(Action):
             # Cell: increment the current column index
             if isCell:
                 currentColIndex += 1
+        if profiler: profiler.iterations(i + 1)
         # Cell: leave the last row with the correct number of cells, excepted
         # if the user has specified himself "columnsRepeated": it is his
         # responsibility to produce the correct number of cells.
@@ -423,6 +436,9 @@ class MetaIf(Action):
         Action.__init__(self, '', buff, subExpr, elem, minus)
         # The list of statements containing in the original note
         self.statements = statements
+        # The note, reified once for all the first time the meta-condition is
+        # False.
+        self.note = None
 
     def reifyNote(self):
         '''Recreate the note as close to the original as possible'''
@@ -431,7 +447,7 @@ class MetaIf(Action):
         r = self.StringBuffer()
         PodError.dump(r, '</text:p>\n<text:p>'.join(self.statements),
                       dumpTb=False)
-        return r
+        return r.content
 
     def do(self, result, context, exprRes):
         if exprRes:
@@ -443,13 +459,33 @@ class MetaIf(Action):
                 self.evaluateBuffer(result, context)
         else:
             # The note must be dumped unevaluated in the result; the potential
-            # "from" expression must not be evaluated as well.
-            note = self.reifyNote()
-            # Inject the note in the buffer, after the first 'text:p' tag: else,
-            # it might not be rendered. self.minus must not be interpreted.
-            self.buffer.insertSubBuffer(note, after='text:p')
-            self.evaluateBuffer(result, context,
+            # "from" expression must not be evaluated as well. self.minus must
+            # not be interpreted.
+            if self.note is None: self.note = self.reifyNote()
+            # The note is not injected into self.buffer, that may be evaluated
+            # again (ie, by another rendering of a compiled template), but into
+            # the result of its evaluation, after the first 'text:p' tag: else,
+            # it might not be rendered.
+            r = self.buffer.clone()
+            self.evaluateBuffer(r, context,
                                 forceSource='buffer', ignoreMinus=True)
+            content = r.content
+            i = self.getNoteIndex(content)
+            result.write(content[:i])
+            result.write(self.note)
+            result.write(content[i:])
+
+    # Start tag of a paragraph that is not empty ("<text:p/>")
+    paraStart = re.compile(r'<text:p(?:\s[^>]*)?(?<!/)>')
+
+    @classmethod
+    def getNoteIndex(klass, content):
+        '''Returns the index, within evaluated buffer p_content, where to
+           insert the note: after the first paragraph start tag or, if there is
+           no paragraph, after the main element start tag.'''
+        match = klass.paraStart.search(content)
+        if match: return match.end()
+        return content.find('>') + 1
 
 class Variables(Action):
     '''Action that allows to define a set of variables somewhere in the
@@ -459,8 +495,9 @@ class Variables(Action):
         # expression, because here we will have several expressions, one for
         # every defined variable.
         Action.__init__(self,name, buff, None, elem, minus)
-        # Definitions of variables: ~[(s_name, s_expr)]~
-        self.variables = variables
+        # Definitions of variables: ~[(s_name, s_expr, t_code)]~
+        self.variables = [(name, expr, compileExprs(expr)) \
+                          for name, expr in variables]
 
     def do(self, result, context, exprRes):
         '''Evaluate the variables' expressions: because there are several
@@ -472,9 +509,9 @@ class Variables(Action):
            values.
         '''
         hidden = None
-        for name, expr in self.variables:
+        for name, expr, code in self.variables:
             # Evaluate variable expression in vRes
-            vRes, error = self.evaluateExpression(result, context, expr)
+            vRes, error = self.evaluateExpression(result, context, expr, code)
             if error: return
             # Replace the value of global variables
             if name.startswith('@'):
@@ -497,7 +534,7 @@ class Variables(Action):
         # Restore hidden variables if any
         if hidden: context.update(hidden)
         # Delete not-hidden variables
-        for name, expr in self.variables:
+        for name, expr, code in self.variables:
             if name.startswith('@'): continue
             if hidden and (name in hidden): continue
             del context[name]
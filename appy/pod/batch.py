@@ -0,0 +1,82 @@
+'''Renders many documents from a single POD template ("mail-merge")'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import os, multiprocessing
+from appy.utils import Traceback
+from appy.model.utils import Object as O
+from appy.pod.template import CompiledTemplate
+
+# ------------------------------------------------------------------------------
+# Within a worker process, the compiled template and the parameters to pass to
+# every renderer.
+worker = O(template=None, params=None)
+
+def initWorker(template, params, ooPorts, counter):
+    '''Initialises a worker process: the template is compiled once for all the
+       documents rendered by this worker. If several LibreOffice ports are
+       given in p_ooPorts, every worker gets its own one, so every LibreOffice
+       server handles the conversions of a single worker.'''
+    worker.template = CompiledTemplate.fromFile(template,
+                                         raiseOnError=params.get('raiseOnError'))
+    worker.params = params
+    if ooPorts:
+        with counter.get_lock():
+            i = counter.value
+            counter.value += 1
+        worker.params = params.copy()
+        worker.params['ooPort'] = ooPorts[i % len(ooPorts)]
+
+def renderOne(info):
+    '''Renders, within the current worker, a single document. p_info is a
+       tuple (i_index, context, s_result). Returns an object (see
+       m_renderMany).'''
+    index, context, result = info
+    try:
+        worker.template.render(context, result, **worker.params)
+        error = None
+    except Exception:
+        error = Traceback.get()
+    return O(index=index, result=result, error=error)
+
+def renderMany(template, contexts, resultPattern, workers=1, ooPorts=None,
+               chunkSize=16, **params):
+    '''Renders, from the POD template whose path is p_template, one document per
+       context from p_contexts. Every document is written in the file whose
+       path is p_resultPattern % i, i being the index of the context within
+       p_contexts (ie: p_resultPattern="/tmp/letter%05d.pdf").
+
+       Documents are rendered by p_workers processes. Every worker compiles
+       the template once (see appy.pod.template.CompiledTemplate) and renders
+       p_chunkSize documents at a time. p_contexts must thus be dicts whose
+       values can be pickled. If p_workers is 1, everything is done within the
+       current process.
+
+       If conversions via LibreOffice are required (ie, p_resultPattern ends
+       with ".pdf"), you may give, in p_ooPorts, the ports of several
+       LibreOffice servers: worker #i will use the server listening on
+       p_ooPorts[i % len(p_ooPorts)].
+
+       p_params are any other parameter to pass to every Renderer.
+
+       A list of objects is returned, one per document, in the order of
+       p_contexts. Every object has these attributes:
+       * index   the index of the context within p_contexts;
+       * result  the path to the generated document;
+       * error   None if the document was successfully rendered, or the
+                 traceback of the error that prevented it.'''
+    template = os.path.abspath(template)
+    infos = ((i, context, resultPattern % i) \
+             for i, context in enumerate(contexts))
+    counter = multiprocessing.Value('i', 0)
+    args = (template, params, ooPorts, counter)
+    if workers == 1:
+        initWorker(*args)
+        return [renderOne(info) for info in infos]
+    pool = multiprocessing.Pool(workers, initWorker, args)
+    try:
+        return list(pool.imap(renderOne, infos, chunkSize))
+    finally:
+        pool.close()
+        pool.join()
+# ------------------------------------------------------------------------------
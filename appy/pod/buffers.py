@@ -1,6 +1,6 @@
 # ~license~
 # ------------------------------------------------------------------------------
-import re, sys
+import re, sys, copy
 from xml.sax.saxutils import quoteattr
 from appy.pod import PodError
 from appy.pod.elements import *
@@ -55,43 +55,6 @@ EVAL_EXPR_ERROR = 'Error while evaluating expression "%s". %s'
 BAD_META_CONDITION = 'Wrong meta-condition "%s". A meta-condition must be a ' \
   'Python expression surrounded by single or double quotes.'
 
-# ------------------------------------------------------------------------------
-class BufferIterator:
-    def __init__(self, buffer):
-        self.buffer = buffer
-        self.remainingSubBufferIndexes = list(buffer.subBuffers.keys())
-        self.remainingElemIndexes = list(buffer.elements.keys())
-        self.remainingSubBufferIndexes.sort()
-        self.remainingElemIndexes.sort()
-
-    def __iter__(self): return self
-    def __next__(self):
-        # Stop if there is no more elem nor sub-buffer
-        if not self.remainingSubBufferIndexes and not self.remainingElemIndexes:
-            raise StopIteration
-        nextSubBufferIndex = None
-        if self.remainingSubBufferIndexes:
-            nextSubBufferIndex = self.remainingSubBufferIndexes[0]
-        nextExprIndex = None
-        if self.remainingElemIndexes:
-            nextExprIndex = self.remainingElemIndexes[0]
-        # Compute min between nextSubBufferIndex and nextExprIndex
-        if (nextSubBufferIndex != None) and (nextExprIndex != None):
-            res = min(nextSubBufferIndex, nextExprIndex)
-        elif (nextSubBufferIndex == None) and (nextExprIndex != None):
-            res = nextExprIndex
-        elif (nextSubBufferIndex != None) and (nextExprIndex == None):
-            res = nextSubBufferIndex
-        # Update "remaining" lists
-        if res == nextSubBufferIndex:
-            self.remainingSubBufferIndexes = self.remainingSubBufferIndexes[1:]
-            resDict = self.buffer.subBuffers
-        elif res == nextExprIndex:
-            self.remainingElemIndexes = self.remainingElemIndexes[1:]
-            resDict = self.buffer.elements
-        return res, resDict[res]
-    next = __next__ # Python2-3 compliance
-
 # ------------------------------------------------------------------------------
 class Buffer:
     '''Abstract class representing any buffer used during rendering'''
@@ -199,11 +162,23 @@ class Buffer:
         self.write(content)
 
 # ------------------------------------------------------------------------------
+class MemoryFile:
+    '''File-like object into which a FileBuffer may dump its content, when the
+       result must not be written on disk.'''
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s): self.chunks.append(s)
+    def close(self): pass
+    def getvalue(self): return ''.join(self.chunks)
+
 class FileBuffer(Buffer):
     def __init__(self, env, result):
         Buffer.__init__(self, env, None)
+        # If p_result is None, the content is kept in memory, within a
+        # MemoryFile instance.
         self.result = result
-        self.content = open(result, 'w')
+        self.content = result and open(result, 'w') or MemoryFile()
         self.content.write(xmlPrologue)
 
     # getLength is used to manage insertions into sub-buffers. But in the case
@@ -221,11 +196,15 @@ class FileBuffer(Buffer):
         try:
             expr = Expression(expression, self.pod)
             if tiedHook: tiedHook.tiedExpression = expr
+            profiler = self.env.profiler
+            if profiler: start = profiler.clock()
             res, escape = expr.evaluate(self.env.context)
             if escape: self.dumpContent(res)
             else: self.write(res)
+            if profiler: profiler.expression(expression, profiler.clock()-start)
         except Exception as e:
             if not self.env.raiseOnError:
+                self.env.errors += 1
                 PodError.dump(self, EVAL_EXPR_ERROR % (expression, e),
                               dumpTb=False)
             else:
@@ -238,6 +217,64 @@ class FileBuffer(Buffer):
         # should not be a severe problem.
         pass
 
+    def addBuffer(self, buffer):
+        '''Dumps, into this buffer, the result of evaluating p_buffer, a
+           complete sub-buffer: its action if it has one, its content else.'''
+        if buffer.action:
+            buffer.action.execute(self, self.env.context)
+        else:
+            buffer.evaluate(self, self.env.context)
+
+class DeferredBuffer(FileBuffer):
+    '''Root buffer behaving, while parsing, like a FileBuffer, but recording
+       the calls made to it instead of producing a result. These calls are
+       replayed, with any context, on a real FileBuffer by m_evaluate: the
+       result is the same as if the document was parsed into this FileBuffer.
+       Used by appy.pod.template.CompiledTemplate.'''
+
+    def __init__(self, env):
+        Buffer.__init__(self, env, None)
+        self.result = None
+        # The recorded calls: ~[(s_methodName, arg)]~
+        self.calls = []
+
+    def write(self, something):
+        if something: self.calls.append(('write', something))
+
+    def addExpression(self, expression, elem=None, tiedHook=None):
+        # No hook can be tied to an expression dumped into a FileBuffer (see
+        # m_addAttributes).
+        self.calls.append(('addExpression', expression))
+
+    def addBuffer(self, buffer):
+        if not buffer.action:
+            # p_buffer will be emptied and reused by the parser: record a copy
+            buffer = copy.copy(buffer)
+            buffer.freeze()
+        self.calls.append(('addBuffer', buffer))
+
+    def freeze(self):
+        '''Called at the end of parsing: merges consecutive written
+           chunks.'''
+        calls = []
+        chunks = []
+        for name, arg in self.calls:
+            if name == 'write':
+                chunks.append(arg)
+                continue
+            if chunks:
+                calls.append(('write', ''.join(chunks)))
+                chunks = []
+            calls.append((name, arg))
+        if chunks: calls.append(('write', ''.join(chunks)))
+        self.calls = tuple(calls)
+
+    def evaluate(self, result, context):
+        '''Replays the recorded calls on p_result, a FileBuffer whose
+           environment holds p_context.'''
+        for name, arg in self.calls:
+            getattr(result, name)(arg)
+
 # ------------------------------------------------------------------------------
 class MemoryBuffer(Buffer):
     class Rex:
@@ -251,9 +288,34 @@ class MemoryBuffer(Buffer):
 
     def __init__(self, env, parent):
         Buffer.__init__(self, env, parent)
-        self.content = u''
+        # The buffer content is stored as a list of chunks, joined only when
+        # the whole content is needed (see m_getContent). Appending content to
+        # the buffer is thus cheap, whatever its size.
+        self.chunks = []
+        # The total length of the chunks
+        self.length = 0
         self.elements = {}
         self.action = None
+        # Once the buffer is complete, m_freeze computes, in the following
+        # tuple, the sub-buffers and elements, sorted by index.
+        self.entries = None # ~((i_index, Buffer|PodElement),)~
+
+    def getContent(self):
+        '''Returns the buffer content as a single string'''
+        chunks = self.chunks
+        if len(chunks) > 1:
+            # Join the chunks and keep the result, for subsequent calls
+            r = ''.join(chunks)
+            self.chunks = [r]
+            return r
+        return chunks and chunks[0] or u''
+
+    def setContent(self, content):
+        '''Replaces the buffer content with p_content'''
+        self.chunks = content and [content] or []
+        self.length = len(content)
+
+    content = property(getContent, setContent)
 
     def clone(self):
         '''Produces an empty buffer that is a clone of this one'''
@@ -263,54 +325,39 @@ class MemoryBuffer(Buffer):
         sub = Buffer.addSubBuffer(self, subBuffer)
         # Dump a whitespace to avoid having several subbuffers referenced at the
         # same place within this buffer.
-        self.content += ' '
+        self.write(' ')
         return sub
 
-    def insertSubBuffer(self, subBuffer, after=None):
-        '''Inserts p_subBuffer just after the main opening tag (or after the
-           first encountered p_after tag if given), in p_self that is already
-           complete.'''
-        # Find the first p_after opening tag in this buffer
-        if after:
-            afterIndex = self.content.find('<%s' % after)
-            afterFound = afterIndex != -1
-            # If not found, search among the sub-buffers
-            if not afterFound:
-                subs = self.subBuffers.items()
-                subs.sort()
-                for bi, sub in subs:
-                    if 'text:p' in sub.content:
-                        sub.insertSubBuffer(subBuffer)
-                        return
-        if not after or not afterFound:
-            # Insert p_subBuffer after the main element
-            i = self.content.index('>') + 1
-        else:
-            i = self.content.index('>', afterIndex) + 1
-            # Skip potentially already inserted sub-buffers
-            while self.content[i] == ' ': i += 1
-        # Insert a whitespace in self.content
-        self.content = self.content[:i] + ' ' + self.content[i:]
-        # Increment by 1 all subsequent elements
-        indexes = list(self.elements.keys())
-        indexes.sort(reverse=True)
-        for j in indexes:
-            if j >= i:
-                elem = self.elements[j]
-                del self.elements[j]
-                self.elements[j+1] = elem
-        # Insert the sub-buffer in self.elements
-        self.elements[i] = subBuffer
-
     def getRootBuffer(self):
         '''Returns the root buffer. For POD it is always a FileBuffer. For PX,
            it is a MemoryBuffer.'''
         if self.parent: return self.parent.getRootBuffer()
         return self
 
-    def getLength(self): return len(self.content)
+    def getLength(self): return self.length
+
+    def getEntries(self):
+        '''Returns the sub-buffers and elements of this buffer, as a sequence
+           of (index, entry) pairs sorted by index.'''
+        if self.entries is not None: return self.entries
+        r = list(self.subBuffers.items())
+        r += self.elements.items()
+        r.sort(key=lambda entry: entry[0])
+        return r
 
-    def write(self, thing): self.content += thing
+    def freeze(self):
+        '''Called when this buffer is complete: it will not be modified
+           anymore, but can be evaluated many times. Its (index, entry) pairs
+           are computed once for all, for this buffer and its sub-buffers.'''
+        self.entries = None
+        self.entries = tuple(self.getEntries())
+        for sub in self.subBuffers.values():
+            sub.freeze()
+
+    def write(self, thing):
+        if not thing: return
+        self.chunks.append(thing)
+        self.length += len(thing)
 
     def getIndex(self, podElemName):
         res = -1
@@ -373,7 +420,7 @@ class MemoryBuffer(Buffer):
             # in the parent (if it is a temp buffer generated from a cut)
             del self.subBuffers[subIndex]
             self.subBuffers[self.getLength()] = subBuffer
-            self.content += u' '
+            self.write(' ')
 
     def transferAllContent(self):
         '''Transfer all content to parent'''
@@ -381,7 +428,7 @@ class MemoryBuffer(Buffer):
             # First unreference all elements
             for index in self.getElementIndexes(expressions=False):
                 del self.elements[index]
-            self.evaluate(self.parent, self.env.context)
+            self.parent.addBuffer(self)
         else:
             # Transfer content in itself
             oldParentLength = self.parent.getLength()
@@ -408,7 +455,7 @@ class MemoryBuffer(Buffer):
                 elem.colIndex = elem.tableInfo.curColIndex
         if elem == 'x':
             # See comment on similar statement in the method below.
-            self.content += u' '
+            self.write(' ')
 
     def addExpression(self, expression, elem=None, tiedHook=None):
         '''Creates an Expression instance and add it in the buffer'''
@@ -423,26 +470,25 @@ class MemoryBuffer(Buffer):
                 if (metaWrap != metaCondition[-1]) or \
                    (metaWrap not in expr.metaWraps):
                     raise ParsingError(BAD_META_CONDITION % metaCondition)
-                expr.metaWrap = metaWrap
-                expr.metaCondition = metaCondition.strip('"\'"')
+                expr.setMetaCondition(metaCondition.strip('"\'"'), metaWrap)
         if tiedHook: tiedHook.tiedExpression = expr
         self.elements[self.getLength()] = expr
         # To be sure that an expr and an elem can't be found at the same index
         # in the buffer.
-        self.content += u' '
+        self.write(' ')
 
     def addAttributes(self):
         '''pod-only: adds an Attributes instance into this buffer'''
         attrs = Attributes(self.env)
         self.elements[self.getLength()] = attrs
-        self.content += u' '
+        self.write(' ')
         return attrs
 
     def addAttribute(self, name, expr):
         '''px-only: adds an Attribute instance into this buffer'''
         attr = Attribute(name, expr)
         self.elements[self.getLength()] = attr
-        self.content += u' '
+        self.write(' ')
         return attr
 
     def _getVariables(self, expr):
@@ -569,6 +615,7 @@ class MemoryBuffer(Buffer):
             if not success: raise ParsingError(msg)
             r = i
         except ParsingError as ppe:
+            self.env.errors += 1
             PodError.dump(self, ppe, removeFirstLine=True)
         return r
 
@@ -607,7 +654,7 @@ class MemoryBuffer(Buffer):
         subBuffersToDelete = []
         elementsToDelete = []
         mustShift = False
-        for itemIndex, item in BufferIterator(self):
+        for itemIndex, item in self.getEntries():
             if keepFirstPart:
                 if itemIndex >= index:
                     newIndex = itemIndex-index
@@ -643,12 +690,13 @@ class MemoryBuffer(Buffer):
                 subBuffers[subIndex-index] = buf
             self.subBuffers = subBuffers
         # Manage content
+        content = self.content
         if keepFirstPart:
-            res.write(self.content[index:])
-            self.content = self.content[:index]
+            res.write(content[index:])
+            self.content = content[:index]
         else:
-            res.write(self.content[:index])
-            self.content = self.content[index:]
+            res.write(content[:index])
+            self.content = content[index:]
         return res
 
     def getElementIndexes(self, expressions=True):
@@ -694,7 +742,8 @@ class MemoryBuffer(Buffer):
         if not removeMainElems: return 0
         # Find the start position of the deepest element to remove
         deepestElem = self.action.elem.DEEPEST_TO_REMOVE
-        pos = self.content.find('<%s' % deepestElem.elem)
+        content = self.content
+        pos = content.find('<%s' % deepestElem.elem)
         pos = pos + len(deepestElem.elem)
         # Now we must find the position of the end of this start tag,
         # skipping potential attributes.
@@ -702,7 +751,7 @@ class MemoryBuffer(Buffer):
         endTagFound = False # Have we found the end of this tag ?
         while not endTagFound:
             pos += 1
-            nextChar = self.content[pos]
+            nextChar = content[pos]
             if (nextChar == '>') and not inAttrValue:
                 # Yes we have it
                 endTagFound = True
@@ -729,8 +778,13 @@ class MemoryBuffer(Buffer):
         # Find the start position of the deepest element to remove
         deepestElem = self.action.elem.DEEPEST_TO_REMOVE
         pos = self.content.find('<%s' % deepestElem.elem)
-        for index in self.elements.keys():
-            if index < pos: del self.elements[index]
+        elements = self.elements
+        for index in [i for i in elements if i < pos]:
+            del elements[index]
+        if self.entries is not None:
+            subs = self.subBuffers
+            self.entries = tuple([e for e in self.entries \
+                                  if (e[0] >= pos) or (subs.get(e[0]) is e[1])])
 
     reTagContent = re.compile('<(?P<p>[\w-]+):(?P<f>[\w-]+)(.*?)>.*</(?P=p):' \
                               '(?P=f)>', re.S)
@@ -749,20 +803,27 @@ class MemoryBuffer(Buffer):
         else:
             if removeMainElems: self.removeAutomaticExpressions()
             currentIndex = self.getStartIndex(removeMainElems)
-            for index, evalEntry in BufferIterator(self):
-                result.write(self.content[currentIndex:index])
+            content = self.content
+            profiler = self.env.profiler
+            for index, evalEntry in self.getEntries():
+                result.write(content[currentIndex:index])
                 currentIndex = index + 1
                 if isinstance(evalEntry, Expression):
                     try:
+                        if profiler: start = profiler.clock()
                         res, escape = evalEntry.evaluate(context)
                         if escape: result.dumpContent(res)
                         else: result.write(res)
+                        if profiler:
+                            profiler.expression(evalEntry.expr,
+                                                profiler.clock() - start)
                     except actions.EvaluationError as e:
                         # This exception has already been treated (see the 
                         # "except" block below). Simply re-raise it when needed.
                         if self.env.raiseOnError: raise e
                     except Exception as e:
                         if not self.env.raiseOnError:
+                            if self.pod: self.env.errors += 1
                             PodError.dump(result, EVAL_EXPR_ERROR % (
                                           evalEntry.expr, e))
                         else:
@@ -778,7 +839,7 @@ class MemoryBuffer(Buffer):
                         result.write(evalEntry.content)
             stopIndex = self.getStopIndex(removeMainElems)
             if currentIndex < (stopIndex-1):
-                result.write(self.content[currentIndex:stopIndex])
+                result.write(content[currentIndex:stopIndex])
 
     def clean(self):
         '''Cleans the buffer content'''
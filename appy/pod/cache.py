@@ -0,0 +1,116 @@
+'''Disk cache for the documents produced by pod fields'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import time, os, os.path, shutil, hashlib, threading
+from appy.utils.path import getOsTempFolder, FolderDeleter
+
+# ------------------------------------------------------------------------------
+class ResultCache:
+    '''Disk cache for the results of pod fields defining a "cacheKey" (see
+       class appy.model.fields.pod.Pod). Every result is stored in a file whose
+       name is a hash of the field name, the template content, the output
+       format, the cache key and the object's last modification date, within
+       a sub-folder per object. When the total size of the cached files
+       exceeds p_maxSize bytes, the least recently used ones are removed.'''
+
+    def __init__(self, folder=None, maxSize=200*1024*1024):
+        self.folder = folder or os.path.join(getOsTempFolder(), 'appyPodCache')
+        self.maxSize = maxSize
+        # The total size of the cached files, computed on first use
+        self.size = None
+        # Hashes of template files ~{s_path: (f_mtime, i_size, s_hash)}~
+        self.templateHashes = {}
+        self.lock = threading.Lock()
+
+    def getTemplateHash(self, path):
+        '''Gets a hash of the content of the template file at p_path'''
+        stat = os.stat(path)
+        info = self.templateHashes.get(path)
+        if info and (info[0] == stat.st_mtime) and (info[1] == stat.st_size):
+            return info[2]
+        f = open(path, 'rb')
+        res = hashlib.sha1(f.read()).hexdigest()
+        f.close()
+        self.templateHashes[path] = (stat.st_mtime, stat.st_size, res)
+        return res
+
+    def getPath(self, obj, field, templatePath, format, key):
+        '''Gets the path to the cached result for this p_obj, p_field,
+           template, p_format and cache p_key. The last modification date of
+           p_obj is part of the key: a result produced before p_obj was
+           modified is not reused, even if the cache was not invalidated.'''
+        parts = (field.name, self.getTemplateHash(templatePath), format,
+                 str(key), str(getattr(obj, 'modified', None)))
+        name = hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, str(obj.id), '%s.%s' % (name, format))
+
+    def get(self, path, result):
+        '''Copies the cached result at p_path, if it exists, to p_result.
+           Returns True if it was the case.'''
+        try:
+            shutil.copyfile(path, result)
+            # Mark this entry as being recently used
+            os.utime(path)
+            return True
+        except (OSError, IOError):
+            return False
+
+    def put(self, path, result, errors=0):
+        '''Stores, at p_path, a copy of the p_result file, excepted if the
+           rendering of p_result produced p_errors, dumped as notes: such a
+           result must be produced again next time. Returns True if p_result
+           was stored.'''
+        if errors: return False
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+        # Write a temp file first: a concurrent reader must never get a partial
+        # file.
+        temp = '%s.%f' % (path, time.time())
+        shutil.copyfile(result, temp)
+        size = os.path.getsize(temp)
+        if os.path.exists(path): size -= os.path.getsize(path)
+        os.replace(temp, path)
+        with self.lock:
+            if self.size is None:
+                self.evict()
+            else:
+                self.size += size
+                if self.size > self.maxSize: self.evict()
+        return True
+
+    def evict(self):
+        '''Computes the total size of the cache and removes the least recently
+           used entries until this size is below self.maxSize.'''
+        entries = []
+        size = 0
+        for dir, dirnames, filenames in os.walk(self.folder):
+            for name in filenames:
+                path = os.path.join(dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                size += stat.st_size
+        if size > self.maxSize:
+            entries.sort()
+            for mtime, fileSize, path in entries:
+                if size <= self.maxSize: break
+                try:
+                    os.remove(path)
+                    size -= fileSize
+                except OSError:
+                    pass
+        self.size = size
+
+    def invalidate(self, obj):
+        '''Removes all the cached results for p_obj'''
+        folder = os.path.join(self.folder, str(obj.id))
+        if not os.path.exists(folder): return
+        FolderDeleter.delete(folder)
+        with self.lock:
+            # The size will be recomputed on next use
+            self.size = None
+
+# ------------------------------------------------------------------------------
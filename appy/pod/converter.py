@@ -64,6 +64,90 @@ HELP_SCRIPT = 'You can specify here (the absolute path to) a Python script ' \
   'process, just before saving the result.'
 HELP_VERBOSE = 'Writes more information on stdout.'
 
+# ------------------------------------------------------------------------------
+def getProps(properties):
+    '''Create a UNO-compliant tuple of properties, from tuple p_properties
+       containing sub-tuples (s_propertyName, value).'''
+    from com.sun.star.beans import PropertyValue
+    res = []
+    for name, value in properties:
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        res.append(prop)
+    return tuple(res)
+
+# ------------------------------------------------------------------------------
+class LoConnection:
+    '''A UNO connection to a LibreOffice server running on some port. A
+       connection can be reused by several converters (see
+       appy.pod.lo_pool).'''
+    def __init__(self, port=DEFAULT_PORT, log=None):
+        self.port = port
+        self.log = log or (lambda msg, cr=True: None)
+        self.context = None # The local UNO component context
+        self.oo = None # The LibreOffice application object
+        self.version = None # The LibreOffice version
+        # The number of conversions performed via this connection
+        self.conversions = 0
+
+    def getVersion(self, serviceManager):
+        '''Returns the LO version'''
+        name = 'com.sun.star.configuration.ConfigurationProvider'
+        configProvider = serviceManager.createInstance(name)
+        prop = getProps([('nodepath', '/org.openoffice.Setup/Product')])
+        nodeName = 'com.sun.star.configuration.ConfigurationAccess'
+        try:
+            node = configProvider.createInstanceWithArguments(nodeName, prop)
+            return node.getByName('ooSetupVersion')
+        except Exception:
+            # LibreOffice 3 raises an exception here
+            return '3.0'
+
+    def connect(self):
+        '''Connects to LibreOffice'''
+        if os.name == 'nt':
+            import socket
+        import uno
+        from com.sun.star.connection import NoConnectException
+        try:
+            # Get the uno component context from the PyUNO runtime
+            context = self.context = uno.getComponentContext()
+            create = context.ServiceManager.createInstanceWithContext
+            # Get the LO version
+            self.version = self.getVersion(context.ServiceManager)
+            # Create the UnoUrlResolver
+            resolver = create('com.sun.star.bridge.UnoUrlResolver', context)
+            # Connect to LO running on self.port
+            docContext = resolver.resolve(
+                'uno:socket,host=localhost,port=%d;urp;StarOffice.' \
+                'ComponentContext' % self.port)
+            # Is seems that we can't define a timeout for this method. This
+            # would be useful because when a non-LO server already listens
+            # to self.port, this method blocks.
+            self.log('Getting the UNO-LO instance...', cr=False)
+            self.oo = docContext.ServiceManager.createInstanceWithContext(
+                'com.sun.star.frame.Desktop', docContext)
+            self.log(' done.')
+        except NoConnectException:
+            e = sys.exc_info()[1]
+            raise ConverterError(CONNECT_ERROR % (self.port, e))
+
+    def getDispatchHelper(self):
+        '''Creates a dispatch helper, required for optimizing table column
+           widths.'''
+        return self.context.ServiceManager.createInstanceWithContext(
+          'com.sun.star.frame.DispatchHelper', self.context)
+
+    def isAlive(self):
+        '''Is the connection still usable ?'''
+        if not self.oo: return
+        try:
+            self.oo.getComponents()
+            return True
+        except Exception:
+            return
+
 # ------------------------------------------------------------------------------
 class LoIter:
     '''Iterates over a collection of LibreOffice-UNO objects'''
@@ -101,18 +185,30 @@ class Converter:
     '''Converts a document readable by LibreOffice into pdf, doc, txt, rtf...'''
     def __init__(self, docPath, resultType, port=DEFAULT_PORT,
                  templatePath=None, optimalColumnWidths=None, script=None,
-                 verbose=False):
+                 verbose=False, connection=None):
         self.port = port
+        # An already established LoConnection instance may be given
+        self.connection = connection
         # The path to the document to convert
         self.docUrl, self.docPath = self.getFilePath(docPath)
         self.inputType = self.getInputType(docPath)
         # "resultType" determines the type of the converted file (=a file
-        # extension among FILE_TYPES keys). "resultMultiple" is True if several
-        # result files will be produced (like when producing one CSV file for
-        # every sheet from an Excel file).
-        self.resultType, self.resultMultiple = self.getResultType(resultType)
-        self.resultFilter = self.getResultFilter()
-        self.resultUrl = self.getResultUrl()
+        # extension among FILE_TYPES keys). It can also be a list or tuple of
+        # such types (or, from the command line, a comma-separated string of
+        # types): the document is then loaded and updated once, and stored once
+        # per type. "results" is the list of tuples
+        #         (resultType, resultMultiple, resultFilter, resultUrl),
+        # one per result type. "resultMultiple" is True if several result files
+        # will be produced (like when producing one CSV file for every sheet
+        # from an Excel file).
+        self.results = []
+        for type in self.getResultTypes(resultType):
+            type, multiple = self.getResultType(type)
+            self.results.append((type, multiple, self.getResultFilter(type),
+                                 self.getResultUrl(type)))
+        # The attributes of the first result, for custom scripts
+        self.resultType, self.resultMultiple, self.resultFilter, \
+          self.resultUrl = self.results[0]
         self.oo = None # The LibreOffice application object
         self.doc = None # The LibreOffice loaded document
         self.version = None # The LibreOffice version
@@ -147,6 +243,14 @@ class Converter:
         if res not in FILE_TYPES: raise ConverterError(INPUT_TYPE_ERROR % res)
         return res
 
+    def getResultTypes(self, resultType):
+        '''Returns the list of result types corresponding to p_resultType, that
+           can be a single type, a comma-separated string of types or a list or
+           tuple of types.'''
+        if isinstance(resultType, str):
+            return [type.strip() for type in resultType.split(',')]
+        return list(resultType)
+
     def getResultType(self, resultType):
         '''If result type ends with char '*', it means that several output files
            will be produced, ie for getting a CSV file from every Excel or Calc
@@ -175,19 +279,19 @@ class Converter:
         # Return one path for OO, one path for me
         return unohelper.systemPathToFileUrl(docAbsPath), docAbsPath
 
-    def getResultFilter(self):
-        '''Based on the result type, identifies which OO filter to use for the
+    def getResultFilter(self, resultType):
+        '''Based on the p_resultType, identifies which OO filter to use for the
            document conversion.'''
-        if self.resultType in FILE_TYPES:
-            res = FILE_TYPES[self.resultType]
+        if resultType in FILE_TYPES:
+            res = FILE_TYPES[resultType]
             if isinstance(res, dict):
                 res = res[self.inputType]
         else:
-            raise ConverterError(BAD_RESULT_TYPE % (self.resultType,
+            raise ConverterError(BAD_RESULT_TYPE % (resultType,
                                                     FILE_TYPES.keys()))
         return res
 
-    def getResultUrl(self):
+    def getResultUrl(self, resultType):
         '''Returns the path of the result file in the format needed by LO. If
            the result type and the input type are the same (ie the user wants to
            refresh indexes or some other action and not perform a real
@@ -200,10 +304,10 @@ class Converter:
         '''
         import unohelper
         baseName = os.path.splitext(self.docPath)[0]
-        if self.resultType != self.inputType:
-            res = '%s.%s' % (baseName, self.resultType)
+        if resultType != self.inputType:
+            res = '%s.%s' % (baseName, resultType)
         else:
-            res = '%s.res.%s' % (baseName, self.resultType)
+            res = '%s.res.%s' % (baseName, resultType)
         try:
             f = open(res, 'w')
             f.write('Hello')
@@ -214,63 +318,21 @@ class Converter:
             e = sys.exc_info()[1]
             raise ConverterError(CANNOT_WRITE_RESULT % (res, e))
 
-    def props(self, properties):
-        '''Create a UNO-compliant tuple of properties, from tuple p_properties
-           containing sub-tuples (s_propertyName, value).'''
-        from com.sun.star.beans import PropertyValue
-        res = []
-        for name, value in properties:
-            prop = PropertyValue()
-            prop.Name = name
-            prop.Value = value
-            res.append(prop)
-        return tuple(res)
-
-    def getVersion(self, serviceManager):
-        '''Returns the LO version'''
-        name = 'com.sun.star.configuration.ConfigurationProvider'
-        configProvider = serviceManager.createInstance(name)
-        prop = self.props([('nodepath', '/org.openoffice.Setup/Product')])
-        nodeName = 'com.sun.star.configuration.ConfigurationAccess'
-        try:
-            node = configProvider.createInstanceWithArguments(nodeName, prop)
-            return node.getByName('ooSetupVersion')
-        except Exception:
-            # LibreOffice 3 raises an exception here
-            return '3.0'
+    def props(self, properties): return getProps(properties)
 
     def connect(self):
-        '''Connects to LibreOffice'''
-        if os.name == 'nt':
-            import socket
-        import uno
-        from com.sun.star.connection import NoConnectException
-        try:
-            # Get the uno component context from the PyUNO runtime
-            context = uno.getComponentContext()
-            create = context.ServiceManager.createInstanceWithContext
-            # Get the LO version
-            self.version = self.getVersion(context.ServiceManager)
-            # Create the UnoUrlResolver
-            resolver = create('com.sun.star.bridge.UnoUrlResolver', context)
-            # Connect to LO running on self.port
-            docContext = resolver.resolve(
-                'uno:socket,host=localhost,port=%d;urp;StarOffice.' \
-                'ComponentContext' % self.port)
-            # Is seems that we can't define a timeout for this method. This
-            # would be useful because when a non-LO server already listens
-            # to self.port, this method blocks.
-            self.log('Getting the UNO-LO instance...', cr=False)
-            self.oo = docContext.ServiceManager.createInstanceWithContext(
-                'com.sun.star.frame.Desktop', docContext)
-            # If we must optimize table column widths, create a dispatch helper
-            if self.optimalColumnWidths:
-                helper = create('com.sun.star.frame.DispatchHelper', context)
-                self.dispatchHelper = helper
-            self.log(' done.')
-        except NoConnectException:
-            e = sys.exc_info()[1]
-            raise ConverterError(CONNECT_ERROR % (self.port, e))
+        '''Connects to LibreOffice, or reuses the connection given to the
+           constructor.'''
+        connection = self.connection
+        if not connection:
+            connection = LoConnection(self.port, self.log)
+            connection.connect()
+            self.connection = connection
+        self.oo = connection.oo
+        self.version = connection.version
+        # If we must optimize table column widths, create a dispatch helper
+        if self.optimalColumnWidths:
+            self.dispatchHelper = connection.getDispatchHelper()
 
     def optimizeTableColumnWidths(self, table, viewCursor, frame):
         '''Optimize column widths for this p_table'''
@@ -390,17 +452,23 @@ class Converter:
             raise ConverterError(URL_NOT_FOUND % (self.docPath, e))
 
     def convertDocument(self):
-        '''Calls LO to perform a document conversion. Note that the conversion
-           is not really done if the source and target documents have the same
-           type.'''
-        self.log('Saving the result in %s...' % self.resultUrl, cr=False)
-        props = [('FilterName', self.resultFilter)]
-        if self.resultType == 'csv': # Add options for CSV export
+        '''Calls LO to perform the document conversion(s), one per result type,
+           from the already loaded document.'''
+        for resultType, multiple, filter, url in self.results:
+            self.storeDocument(resultType, multiple, filter, url)
+
+    def storeDocument(self, resultType, multiple, filter, resultUrl):
+        '''Stores the loaded document at p_resultUrl, in p_resultType, via this
+           LO p_filter. Note that the conversion is not really done if the
+           source and target documents have the same type.'''
+        self.log('Saving the result in %s...' % resultUrl, cr=False)
+        props = [('FilterName', filter)]
+        if resultType == 'csv': # Add options for CSV export
             props.append(('FilterOptions', '59,34,76,1')) # 59=; 34=" 
-        elif self.resultType == 'pdf':
+        elif resultType == 'pdf':
             props.append(('ExportNotes', True))
-        if not self.resultMultiple:
-            self.doc.storeToURL(self.resultUrl, self.props(props))
+        if not multiple:
+            self.doc.storeToURL(resultUrl, self.props(props))
             self.log(' done.')
         else:
             # Dump one CSV file for every sheet in the input document
@@ -414,22 +482,26 @@ class Converter:
                 sheet = sheets.getByIndex(i)
                 # Compute the csv output file name
                 name = unicodedata.normalize('NFKD', sheet.getName())
-                splitted = os.path.splitext(self.resultUrl)
-                resultUrl = '%s.%s%s' % (splitted[0], name, splitted[1])
+                splitted = os.path.splitext(resultUrl)
+                sheetUrl = '%s.%s%s' % (splitted[0], name, splitted[1])
                 controller.setActiveSheet(sheet)
-                doc.storeToURL(resultUrl, props)
+                doc.storeToURL(sheetUrl, props)
 
     def run(self):
         '''Connects to LO, does the job and disconnects'''
         if self.verbose: start = time.time()
         self.connect()
-        self.loadDocument()
-        # Call custom code to modify the document when relevant
-        fun = self.functions.get('finalize')
-        if fun: fun(self)
-        # Store the (converted) result
-        self.convertDocument()
-        self.doc.close(True)
+        try:
+            self.loadDocument()
+            # Call custom code to modify the document when relevant
+            fun = self.functions.get('finalize')
+            if fun: fun(self)
+            # Store the (converted) result
+            self.convertDocument()
+        finally:
+            # Do not leave the document open in LO, that may be long-lived
+            if self.doc: self.doc.close(True)
+        self.connection.conversions += 1
         if self.verbose:
             self.log('Done in %.2f second(s).' % (time.time() - start))
 
@@ -443,6 +515,8 @@ usage = '''usage: python converter.py fileToConvert outputType [options]
    
    "outputType" is the output format, that must be one of:
    %s
+   Several output formats, separated by commas, may be given (ie "pdf,docx"):
+   the file is then loaded once and converted into every format.
 
    "python" should be a UNO-enabled Python interpreter (ie the one which is
    included in the LibreOffice distribution).''' % str(FILE_TYPES.keys())
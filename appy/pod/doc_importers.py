@@ -1,6 +1,7 @@
 # ~license~
 # ------------------------------------------------------------------------------
 import os,os.path,stat,time,shutil,struct,random,urllib.parse,imghdr,uuid
+from concurrent.futures import ThreadPoolExecutor
 import appy.pod
 from appy import utils
 from appy.pod import PodError
@@ -30,6 +31,48 @@ def getUuid(removeDots=False):
     if removeDots: r = r.replace('.', '')
     return r
 
+def getHttpImage(url):
+    '''Performs a HTTP GET for retrieving the image at p_url. Returns the HTTP
+       response, or None if the server could not be reached.'''
+    try:
+        return Resource(url).get(followRedirect=False)
+    except Resource.Error:
+        pass
+
+# ------------------------------------------------------------------------------
+class ImagePrefetcher:
+    '''Downloads, in parallel, images to import into a POD result, before the
+       renderer reaches the corresponding calls to POD function "document" (or
+       "img" tags in XHTML content). The ImageImporter then gets the prefetched
+       HTTP responses instead of downloading the images one by one.'''
+
+    def __init__(self, workers=8):
+        self.executor = ThreadPoolExecutor(workers)
+        # The downloads, as concurrent.futures.Future instances, keyed by URL
+        self.downloads = {}
+
+    def add(self, urls):
+        '''Starts downloading the images at p_urls. Non-HTTP URLs are
+           ignored.'''
+        for url in urls:
+            if not url or not url.startswith('http') or \
+               (url in self.downloads): continue
+            self.downloads[url] = self.executor.submit(getHttpImage, url)
+
+    def get(self, url):
+        '''Returns the HTTP response for the image at p_url, waiting for its
+           download to complete if needed. If this image was not prefetched, it
+           is downloaded now.'''
+        download = self.downloads.get(url)
+        if download is None: return getHttpImage(url)
+        return download.result()
+
+    def shutdown(self):
+        '''Cancels the downloads not started yet and releases the threads'''
+        for download in self.downloads.values(): download.cancel()
+        self.executor.shutdown(wait=False)
+        self.downloads = {}
+
 # ------------------------------------------------------------------------------
 class DocImporter:
     '''Base class used for importing external content into a pod template (an
@@ -50,7 +93,7 @@ class DocImporter:
         self.linkNs = self.ns[OdfEnvironment.NS_XLINK]
         self.drawNs = self.ns[OdfEnvironment.NS_DRAW]
         self.svgNs = self.ns[OdfEnvironment.NS_SVG]
-        self.tempFolder = renderer.tempFolder
+        self.tempFolder = renderer.getTempFolder()
         self.importFolder = self.getImportFolder()
         # Create the import folder if it does not exist
         if not os.path.exists(self.importFolder): os.mkdir(self.importFolder)
@@ -380,11 +423,12 @@ class ImageImporter(DocImporter):
            existing file. We will dump a replacement image instead.'''
         at = DocImporter.checkAt(self, at, raiseOnError=False)
         if at.startswith('http'):
-            # Try to get the image
-            try:
-                response = Resource(at).get(followRedirect=False)
-            except Resource.Error:
-                response = None # Can't get the distant image
+            # Try to get the image, possibly prefetched by the renderer
+            prefetcher = self.renderer.imagePrefetcher
+            if prefetcher:
+                response = prefetcher.get(at)
+            else:
+                response = getHttpImage(at)
             if response and (response.code == 200):
                 # Remember the response
                 self.httpResponse = response
@@ -1,11 +1,44 @@
 # ~license~
 # ------------------------------------------------------------------------------
 from builtins import str
+from functools import lru_cache
 from xml.sax.saxutils import quoteattr
 from appy.xml import XmlElement
 from appy.pod.odf_parser import OdfEnvironment as ns
 from appy.pod import PodError
 
+# ------------------------------------------------------------------------------
+# Max number of compiled Python expressions kept in the process-wide cache
+CODE_CACHE_SIZE = 10000
+
+@lru_cache(maxsize=CODE_CACHE_SIZE)
+def _compile(source): return compile(source, '<string>', 'eval')
+
+def compileExpr(source):
+    '''Compiles Python expression p_source into a code object that can be
+       evaluated via eval(). Compiled code objects are kept in a process-wide
+       LRU cache keyed by p_source, so an expression used at several places, or
+       within several templates, is compiled only once.
+
+       If p_source can't be compiled (it is syntactically wrong or, depending
+       on the Python version, contains null bytes), it is returned as is: the
+       error will then be raised when eval'ing it, like it was the case before
+       expressions were precompiled.'''
+    # Like eval(), ignore leading and trailing whitespace
+    source = source.strip()
+    try:
+        return _compile(source)
+    except (SyntaxError, ValueError):
+        return source
+
+def compileExprs(expr):
+    '''Compiles p_expr, that may be of the form "someExpr|errorExpr", into a
+       tuple (c_code, c_errorCode). c_errorCode is None if p_expr does not
+       define any error expression.'''
+    if '|' not in expr: return compileExpr(expr), None
+    expr, errorExpr = expr.rsplit('|', 1)
+    return compileExpr(expr), compileExpr(errorExpr)
+
 # ------------------------------------------------------------------------------
 class PodElement:
     OD_TO_POD = {'p': 'Text', 'h': 'Title', 'section': 'Section',
@@ -87,6 +120,9 @@ class Expression(PodElement):
     def __init__(self, py, pod):
         # Extract parts from expression p_py
         self.escapeXml, self.expr, self.errorExpr = self.extractInfo(py.strip())
+        # Compile the expressions once for all
+        self.code = compileExpr(self.expr)
+        self.errorCode = self.errorExpr and compileExpr(self.errorExpr) or None
         self.pod = pod # True if I work for pod, False if I work for px
         if self.pod:
             # pod-only: store here the expression's true result (before being
@@ -105,9 +141,16 @@ class Expression(PodElement):
         # in the result. Else, the expression will be left untouched and go
         # unevaluated in the result.
         self.metaCondition = None
+        self.metaCode = None # The compiled meta-condition
         # Te meta-condition is "wrapped" around single or double quotes
         self.metaWrap = None
 
+    def setMetaCondition(self, condition, wrap):
+        '''Defines a meta-condition for this expression'''
+        self.metaCondition = condition
+        self.metaCode = compileExpr(condition)
+        self.metaWrap = wrap
+
     def getUnevaluatedExpression(self):
         '''Gets the expression in its unevaluated form'''
         if not self.pod: return '' # Works just for pod
@@ -121,22 +164,22 @@ class Expression(PodElement):
     def _eval(self, context):
         '''Evaluates self.expr with p_context. If self.errorExpr is defined,
            evaluate it if self.expr raises an error.'''
-        if self.errorExpr:
+        if self.errorCode:
             try:
-                res = eval(self.expr, context)
+                res = eval(self.code, context)
             except Exception:
-                res = eval(self.errorExpr, context)
+                res = eval(self.errorCode, context)
         else:
-            res = eval(self.expr, context)
+            res = eval(self.code, context)
         return res
 
     def _evalMetaCondition(self, context):
         '''Checks whether the expression really needs to be evaluated'''
         # If no meta-condition is present, the expression must be evaluated
-        expr = self.metaCondition
-        if expr == None: return True
+        code = self.metaCode
+        if code == None: return True
         # Evaluate the meta-condition
-        return eval(expr, context)
+        return eval(code, context)
 
     def evaluate(self, context):
         '''Evaluates the Python expression (self.expr) with a given
@@ -251,9 +294,10 @@ class Attribute(PodElement):
         self.name = name
         # The expression that will compute the attribute value
         self.expr = expr.strip()
+        self.code = compileExpr(self.expr)
 
     def evaluate(self, context):
         # If the expr evaluates to False, we do not dump the attribute at all.
-        if eval(self.expr, context): return ' %s="%s"' % (self.name, self.name)
+        if eval(self.code, context): return ' %s="%s"' % (self.name, self.name)
         return ''
 # ------------------------------------------------------------------------------
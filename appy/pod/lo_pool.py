@@ -0,0 +1,193 @@
+'''Pool of long-lived LibreOffice servers and connections, for converting many
+   documents without paying, for every document, the cost of connecting to
+   LibreOffice.'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import os, os.path, time, queue, subprocess, pathlib
+from concurrent.futures import ThreadPoolExecutor
+from appy.utils.path import getOsTempFolder
+from appy.pod.converter import Converter, ConverterError, LoConnection, \
+                               DEFAULT_PORT
+
+# ------------------------------------------------------------------------------
+NO_SERVER = 'No LibreOffice server was available within %s second(s).'
+START_ERROR = 'LibreOffice on port %d could not be started within %d ' \
+              'second(s). %s'
+
+# ------------------------------------------------------------------------------
+class LoServer:
+    '''A LibreOffice server listening on some port. If the path to the
+       "soffice" executable is given, the server is started, and restarted when
+       required, by the pool. Else, it is supposed to be managed outside the
+       pool and only the connection to it is reestablished when required.'''
+
+    # The options for starting a LibreOffice server in server mode
+    startOptions = ('--headless', '--invisible', '--nologo', '--norestore',
+                    '--nodefault')
+
+    def __init__(self, port, soffice=None, startTimeout=30, log=None):
+        self.port = port
+        self.soffice = soffice
+        # The max number of seconds to wait for the server to accept
+        # connections after having (re)started it.
+        self.startTimeout = startTimeout
+        self.log = log
+        # The subprocess.Popen object, if the server is managed by the pool
+        self.process = None
+        # The LoConnection instance, established and checked when a converter
+        # borrows this server.
+        self.connection = None
+
+    def getProfileFolder(self):
+        '''Every server managed by the pool must use its own LibreOffice user
+           profile: else, only one server could run at a time.'''
+        return os.path.join(getOsTempFolder(), 'appyLo%d' % self.port)
+
+    def getCommand(self):
+        '''Returns the command for starting the server, as a list of arguments.
+           Paths are never split, even if they contain spaces.'''
+        profile = pathlib.Path(self.getProfileFolder()).as_uri()
+        return [self.soffice] + list(self.startOptions) + \
+          ['--accept=socket,host=localhost,port=%d;urp;' % self.port,
+           '-env:UserInstallation=%s' % profile]
+
+    def start(self):
+        '''Starts the server if it is managed by the pool'''
+        if not self.soffice: return
+        self.process = subprocess.Popen(self.getCommand(),
+          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop(self):
+        '''Stops the server if it is managed by the pool'''
+        self.connection = None
+        if not self.process: return
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process = None
+
+    def restart(self):
+        '''Restarts the server (or only reconnects to it if it is not managed
+           by the pool).'''
+        self.stop()
+        self.start()
+
+    def connect(self):
+        '''Connects to the server, retrying until it accepts connections'''
+        end = time.time() + self.startTimeout
+        while True:
+            connection = LoConnection(self.port, self.log)
+            try:
+                connection.connect()
+                self.connection = connection
+                return
+            except ConverterError as e:
+                if time.time() > end:
+                    raise ConverterError(START_ERROR % (self.port,
+                                         self.startTimeout, str(e)))
+                time.sleep(0.5)
+
+    def check(self):
+        '''Health check, performed before the server is used for a conversion:
+           ensures it is running and that the connection to it is alive.'''
+        if self.connection and self.connection.isAlive(): return
+        if self.process and (self.process.poll() is not None):
+            # The managed process died
+            self.process = None
+        if self.soffice and not self.process: self.start()
+        self.connect()
+
+# ------------------------------------------------------------------------------
+class ConverterPool:
+    '''Manages a set of LibreOffice servers, each one listening to one of the
+       p_ports. Every conversion borrows a server from the pool: a server
+       performs a single conversion at a time, and conversions wait in a queue
+       until a server is available.
+
+       After p_maxConversions conversions, a server is restarted, in order to
+       prevent LibreOffice from leaking memory. If no "soffice" executable is
+       given in p_soffice, servers are not started or restarted by the pool;
+       connections to them are reestablished instead.
+
+       A ConverterPool may be shared by several threads, or given to several
+       renderers (see parameter "converterPool" of the Renderer). Conversions
+       can also be run in the background, by the pool's executor (see
+       m_submit).'''
+
+    def __init__(self, ports=(DEFAULT_PORT,), soffice=None, maxConversions=200,
+                 startTimeout=30, timeout=None, verbose=False):
+        self.maxConversions = maxConversions
+        # The max number of seconds to wait for an available server. If None,
+        # a conversion waits until a server is available.
+        self.timeout = timeout
+        self.verbose = verbose
+        self.servers = [LoServer(port, soffice, startTimeout, self.log) \
+                        for port in ports]
+        # The servers being available for a conversion
+        self.available = queue.Queue()
+        for server in self.servers: self.available.put(server)
+        # The executor running background conversions, with one thread per
+        # server.
+        self.executor = ThreadPoolExecutor(len(self.servers))
+
+    def log(self, msg, cr=True):
+        '''Logs some p_msg if we are in verbose mode'''
+        if self.verbose: print(msg)
+
+    def start(self):
+        '''Starts all the servers managed by the pool. Calling this method is
+           not mandatory: servers are started on first use.'''
+        for server in self.servers: server.start()
+
+    def stop(self):
+        '''Stops all the servers managed by the pool, once background
+           conversions are complete.'''
+        self.executor.shutdown()
+        for server in self.servers: server.stop()
+
+    def submit(self, fun, *args):
+        '''Runs p_fun(*p_args), that performs a conversion via this pool, in
+           the background. Returns a concurrent.futures.Future instance.'''
+        return self.executor.submit(fun, *args)
+
+    def borrow(self):
+        '''Borrows, from the pool, an available and healthy server'''
+        try:
+            server = self.available.get(timeout=self.timeout)
+        except queue.Empty:
+            raise ConverterError(NO_SERVER % self.timeout)
+        try:
+            server.check()
+        except Exception as e:
+            self.available.put(server)
+            raise e
+        return server
+
+    def giveBack(self, server):
+        '''Gives back the p_server to the pool, after having restarted it if
+           it performed too many conversions.'''
+        connection = server.connection
+        if connection and (connection.conversions >= self.maxConversions):
+            self.log('Restarting LibreOffice on port %d...' % server.port)
+            server.restart()
+        self.available.put(server)
+
+    def convert(self, docPath, resultType, templatePath=None,
+                optimalColumnWidths=None, script=None):
+        '''Converts the document at p_docPath into p_resultType. Parameters are
+           those from the Converter.'''
+        server = self.borrow()
+        try:
+            Converter(docPath, resultType, server.port, templatePath,
+                      optimalColumnWidths, script, self.verbose,
+                      connection=server.connection).run()
+        except Exception as e:
+            # The connection may be broken: force a health check on next use
+            if not server.connection.isAlive(): server.connection = None
+            raise e
+        finally:
+            self.giveBack(server)
+# ------------------------------------------------------------------------------
@@ -0,0 +1,79 @@
+'''Instrumentation of the POD renderer, telling where the time goes when
+   rendering a document.'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import time, json
+
+# ------------------------------------------------------------------------------
+class Metrics(dict):
+    '''Timings and counters collected while rendering a POD result (see
+       parameter "metrics" of appy.pod.renderer.Renderer). It is a dict of
+       this form:
+
+       {'phases': {s_name: {'count': i_count, 'time': f_seconds}},
+        'expressions': i_count, 'expressionsTime': f_seconds,
+        'iterations': i_count, 'bytes': {s_name: i_size}}
+
+       Phases are:
+       - "unzip"         reading the template, unzipped on disk, or in memory
+                         in streaming mode;
+       - "stylesManager" parsing the template styles and the styles mapping;
+       - "content"       parsing and evaluating content.xml. Both happen in a
+                         single pass: as soon as a part of the template is
+                         parsed, it is evaluated. If the template is compiled
+                         (see appy.pod.template.CompiledTemplate), it is only
+                         evaluated;
+       - "styles"        idem for styles.xml;
+       - "xhtml"         calls to POD function "xhtml";
+       - "document"      calls to POD function "document";
+       - "pod"           calls to POD function "pod";
+       - "manifest"      patching META-INF/manifest.xml;
+       - "patch"         patching the rendered content.xml and styles.xml
+                         (dynamic styles injection, page styles renaming);
+       - "zip"           producing the ODT/S result, finalize function
+                         excepted;
+       - "finalize"      calling the finalize function;
+       - "libreoffice"   calling LibreOffice.
+
+       Times of phases "xhtml", "document" and "pod" are included in the times
+       of the "content" or "styles" phases.
+
+       "expressions" is the number of evaluated expressions, and
+       "expressionsTime", the time spent evaluating them. "iterations" is the
+       total number of iterations performed by "for" statements. "bytes" gives
+       the sizes of the produced content.xml, styles.xml and, if available,
+       the result.'''
+
+    def __init__(self, logger=None, clock=time.perf_counter):
+        dict.__init__(self, phases={}, expressions=0, expressionsTime=0.0,
+                      iterations=0, bytes={})
+        # If a logger is given, metrics are logged by m_log
+        self.logger = logger
+        # The function returning the current time, in seconds
+        self.clock = clock
+
+    def add(self, name, start):
+        '''Phase p_name, started at p_start, is over'''
+        elapsed = self.clock() - start
+        phases = self['phases']
+        phase = phases.get(name)
+        if phase is None:
+            phases[name] = {'count': 1, 'time': elapsed}
+        else:
+            phase['count'] += 1
+            phase['time'] += elapsed
+
+    def expression(self, expr, elapsed):
+        '''Expression p_expr has been evaluated in p_elapsed seconds'''
+        self['expressions'] += 1
+        self['expressionsTime'] += elapsed
+
+    def iterations(self, count):
+        '''A "for" statement has performed p_count iterations'''
+        self['iterations'] += count
+
+    def log(self):
+        '''Logs the metrics, as JSON, if a logger is defined'''
+        if self.logger: self.logger.info(json.dumps(self, sort_keys=True))
+# ------------------------------------------------------------------------------
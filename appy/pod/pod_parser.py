@@ -2,7 +2,7 @@
 # ------------------------------------------------------------------------------
 import re
 from appy.xml import XmlElement
-from appy.pod.buffers import FileBuffer, MemoryBuffer
+from appy.pod.buffers import FileBuffer, MemoryBuffer, DeferredBuffer
 from appy.pod.odf_parser import OdfEnvironment, OdfParser
 from appy.pod.elements import *
 
@@ -34,6 +34,9 @@ class OdInsert:
 class PodEnvironment(OdfEnvironment):
     '''Contains all elements representing the current parser state during
        parsing.'''
+    # An object collecting metrics about evaluated expressions and "for"
+    # statements, like appy.pod.metrics.Metrics, if any.
+    profiler = None
     # Possibles modes
     # ADD_IN_BUFFER: when encountering an impactable element, we must
     #                continue to dump it in the current buffer
@@ -90,6 +93,9 @@ class PodEnvironment(OdfEnvironment):
         # When an error occurs, must we raise it or write it into he current
         # buffer?
         self.raiseOnError = None # Will be initialized by PodParser.__init__
+        # The number of errors dumped into the result, if p_raiseOnError is
+        # False.
+        self.errors = 0
 
     def getTable(self):
         '''Gets the currently parsed table.'''
@@ -213,7 +219,13 @@ class PodParser(OdfParser):
         env.raiseOnError = caller.raiseOnError
 
     def endDocument(self):
-        self.env.currentBuffer.content.close()
+        buffer = self.env.currentBuffer
+        if isinstance(buffer, DeferredBuffer):
+            # The document was parsed into a tree of buffers, to be evaluated
+            # later (see appy.pod.template.CompiledTemplate).
+            buffer.freeze()
+        else:
+            buffer.content.close()
 
     def startElement(self, elem, attrs):
         e = OdfParser.startElement(self, elem, attrs)
@@ -323,8 +335,8 @@ class PodParser(OdfParser):
                                 if isinstance(parent, FileBuffer):
                                     # Execute buffer action and delete the
                                     # buffer.
-                                    e.currentBuffer.action.execute(parent,
-                                                                   e.context)
+                                    e.currentBuffer.freeze()
+                                    parent.addBuffer(e.currentBuffer)
                                     parent.removeLastSubBuffer()
                                 e.currentBuffer = parent
                             e.mode = e.ADD_IN_SUBBUFFER
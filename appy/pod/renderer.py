@@ -1,19 +1,23 @@
 # ~license~
 # ------------------------------------------------------------------------------
-import zipfile, shutil, xml.sax, os, os.path, re, mimetypes, time
-from collections import UserDict
+import zipfile, shutil, xml.sax, os, os.path, re, mimetypes, time, \
+       threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import UserDict, OrderedDict
 from io import open
 from appy import utils
 import appy.pod
 from appy.pod import PodError
-from appy.xml import XmlElement
-from appy.utils.zip import unzip, zip
-from appy.utils.path import FolderDeleter
-from appy.pod.pod_parser import PodParser, PodEnvironment, OdInsert
+from appy.utils.zip import unzip, zip, readOdf, copyZipped
+from appy.utils.path import FolderDeleter, getOsTempFolder
+from appy.pod.pod_parser import PodParser, PodEnvironment
 from appy.pod.converter import FILE_TYPES
 from appy.pod.buffers import FileBuffer
-from appy.pod.xhtml2odt import Xhtml2OdtConverter
-from appy.pod.doc_importers import getUuid, \
+from appy.pod.metrics import Metrics
+from appy.pod.template import templates, getInserts, Template, \
+     CompiledTemplate
+from appy.pod.xhtml2odt import XhtmlConverter
+from appy.pod.doc_importers import getUuid, ImagePrefetcher, \
      OdtImporter, ImageImporter, PdfImporter, ConvertImporter, PodImporter
 from appy.pod.styles_manager import \
      StylesManager, TableProperties, NumberedProperties, BulletedProperties
@@ -37,6 +41,8 @@ PY_PATH_NOT_FILE = '"%s" is not a file. You must here specify the absolute ' \
                    '.../python.exe, .../python.bat...).'
 BAD_RESULT_TYPE = 'Result "%s" has a wrong extension. Allowed extensions ' \
                   'are: "%s".'
+DUPLICATE_RESULT_TYPE = 'Several results have extension "%s". Every ' \
+                        'result must be of a distinct type.'
 CONVERT_ERROR = 'An error occurred during the conversion. %s'
 BAD_OO_PORT = 'Bad LibreOffice port "%s". Make sure it is an integer.'
 XHTML_ERROR = 'An error occurred while rendering XHTML content.'
@@ -52,31 +58,31 @@ DOC_FORMAT_ERROR = 'POD was unable to deduce the document format. Please ' \
 DOC_WRONG_FORMAT = 'Format "%s" is not supported.'
 WARNING_FINALIZE_ERROR = 'Warning: error while calling finalize function. %s'
 
-# Default font added by pod in content.xml and styles.xml
-POD_FONTS = '<style:font-face style:name="PodStarSymbol" ' \
-            'svg:font-family="StarSymbol"/>'
-
-# Default styles added by pod in content.xml and styles.xml
-POD_STYLES = {}
-podFolder = os.path.dirname(appy.pod.__file__)
-for name in ('content', 'styles'):
-    f = open('%s/%s.xmlt' % (podFolder, name))
-    POD_STYLES[name] = f.read()
-    f.close()
-
 # Parts of styles.xml and content.xml to patch when using unique page styles
 PAGE_STYLES_PARTS = {'styles': '<style:master-page style:name="%s"',
                      'content': 'style:master-page-name="%s"'}
 
+# Chars removed from XHTML chunks, producing SAX parsing errors
+XHTML_BLANKS = str.maketrans('', '', '\f\v')
+
 # ------------------------------------------------------------------------------
 class Renderer:
     templateTypes = ('odt', 'ods') # Types of POD templates
 
+    # The executor running background conversions for asynchronous renderers
+    # not using a converter pool. It is created on first use, with
+    # "converterThreads" threads. By default, conversions are serialized,
+    # because they are all performed by the same LibreOffice server.
+    converterExecutor = None
+    converterThreads = 1
+    converterLock = threading.Lock()
+
     def __init__(self, template, context, result, pythonWithUnoPath=None,
       ooPort=2002, stylesMapping={}, forceOoCall=False, finalizeFunction=None,
       overwriteExisting=False, raiseOnError=False, imageResolver=None,
       stylesTemplate=None, optimalColumnWidths=False, script=None,
-      renamePageStyles=False):
+      renamePageStyles=False, streaming=False, cacheTemplate=False,
+      converterPool=None, asynchronous=False, metrics=False, xhtmlCache=0):
         '''This Python Open Document Renderer (PodRenderer) loads a document
            template (p_template) which is an ODT or ODS file with some elements
            written in Python. Based on this template and some Python objects
@@ -92,6 +98,11 @@ class Renderer:
            files (which is the case, for example, if you use the default
            function "document").
 
+         - p_result may also be a list of paths to results of different types
+           (ie, ["/tmp/doc.pdf", "/tmp/doc.docx", "/tmp/doc.odt"]). LibreOffice
+           is then called once: the document is loaded and updated once, and
+           converted into every type.
+
          - If the Python interpreter which runs the current script is not
            UNO-enabled, this script will run, in another process, a UNO-enabled
            Python interpreter (whose path is p_pythonWithUnoPath) which will
@@ -145,17 +156,94 @@ class Renderer:
            considered different and tied elements like headers and footers will
            correctly be imported into the master document. The "do... pod"
            statement automatically sets this parameter to True.
+
+         - If p_streaming is True, the template is not unzipped on disk:
+           content.xml and styles.xml are rendered in memory and written,
+           together with the unchanged template files (copied without being
+           recompressed), straight into the result. A temp folder is only
+           created if really needed (imported images or documents, call to
+           LibreOffice). In this mode, p_result may also be an open binary file
+           object, the result being of the same type as the template. Streaming
+           is disabled if a p_finalizeFunction is specified, because this
+           function requires the unzipped result on disk.
+
+         - If p_cacheTemplate is True and p_template is a file path, the
+           template content and its parsed styles are kept in a process-wide
+           cache (see appy.pod.template) and reused by the next renderers using
+           the same template, as long as the template file is not modified.
+           For every cached template, its styles.xml and meta.xml files, and
+           the styles parsed from it, stay in memory. The cache keeps at most
+           20 templates: enable it for a set of templates that are rendered
+           often and whose styles are not huge.
+
+         - If a p_converterPool is given (an appy.pod.lo_pool.ConverterPool
+           instance), LibreOffice is called via one of the servers from this
+           pool, instead of connecting to LibreOffice on p_ooPort.
+
+         - If p_asynchronous is True and LibreOffice must be called, m_run
+           returns as soon as the ODT/S result is zipped: the LibreOffice call
+           is performed in the background, by the converter pool's executor
+           or, if no pool is given, by a default executor (see
+           m_getConverterExecutor). m_run then returns a Future instance (see
+           concurrent.futures), whose result will be p_result, or the
+           exception raised by the conversion.
+
+         - p_template may also be an appy.pod.template.Template instance. If it
+           is a CompiledTemplate instance, its content.xml and styles.xml are
+           already parsed: rendering only consists in evaluating them with
+           p_context.
+
+         - If p_metrics is True, timings and counters about the rendering are
+           collected in attribute "metrics", an appy.pod.metrics.Metrics
+           instance, being a dict. p_metrics may also be a logger (ie, a
+           logging.Logger instance): metrics are then also logged, as JSON, at
+           level "info", once the result is produced.
+
+         - If p_xhtmlCache is a positive integer, the ODT chunks produced by
+           POD function "xhtml" are memoized, in a LRU cache of at most this
+           number of entries: converting again the same XHTML chunk, with the
+           same styles mapping and "keepWithNext" value, reuses the ODT chunk
+           produced by the first conversion. The cache is specific to this
+           renderer: the dynamic styles created by the first conversion are
+           already part of the result. XHTML chunks containing tables are not
+           memoized, because every ODT table must get a unique name.
         '''
-        self.template = template
-        self.result = result
-        self.contentXml = None # Content (string) of content.xml
-        self.stylesXml = None # Content (string) of styles.xml
+        # A compiled template, if given
+        self.compiled = isinstance(template, CompiledTemplate) and template \
+                        or None
+        if isinstance(template, Template):
+            self.template = template.open()
+        else:
+            self.template = template
+        # p_result may be a list of results: the first one is the main result,
+        # the others being stored in "otherResults".
+        if isinstance(result, (list, tuple)):
+            self.result = result[0]
+            self.otherResults = list(result[1:])
+        else:
+            self.result = result
+            self.otherResults = []
+        # Content (bytes) of content.xml. It is not kept in memory anymore: it
+        # is parsed by chunks from the unzipped template or, in streaming mode,
+        # from the template zip (see m_getXmlSource).
+        self.contentXml = None
+        self.stylesXml = None # Content (bytes) of styles.xml
         self.stylesManager = None # Manages the styles defined into the ODT
         # template
         self.tempFolder = None
+        # The FileBuffer instances for content.xml and styles.xml
+        self.fileBuffers = {}
+        # The evaluation contexts for content.xml and styles.xml
+        self.contexts = {}
+        # The number of errors dumped into content.xml and styles.xml
+        self.errors = {}
         self.env = None
         self.pyPath = pythonWithUnoPath
         self.ooPort = ooPort
+        self.converterPool = converterPool
+        self.asynchronous = asynchronous
+        # In asynchronous mode, the Future tied to the background conversion
+        self.future = None
         # p_forceOoCall may be forced to True
         self.forceOoCall = forceOoCall or \
                            bool(optimalColumnWidths) or bool(script)
@@ -167,6 +255,7 @@ class Renderer:
         self.optimalColumnWidths = optimalColumnWidths
         self.script = script
         self.renamePageStyles = renamePageStyles
+        self.streaming = streaming and not finalizeFunction
         # Keep trace of the original context given to the renderer
         self.originalContext = context
         # Remember potential files or images that will be included through
@@ -176,14 +265,40 @@ class Renderer:
         # included images (used for avoiding to create multiple copies of a file
         # which is imported several times).
         self.fileNames = {}
-        self.prepareFolders()
-        # Unzip template
-        self.unzipFolder = os.path.join(self.tempFolder, 'unzip')
-        os.mkdir(self.unzipFolder)
-        info = unzip(template, self.unzipFolder, odf=True)
-        self.contentXml = info['content.xml']
+        self.checkResult()
+        # Timings and counters, if collected
+        if metrics:
+            logger = None if metrics is True else metrics
+            self.metrics = Metrics(logger)
+            start = self.metrics.clock()
+        else:
+            self.metrics = None
+        self.unzipFolder = None
+        self.templateZip = None
+        # Get the template from the cache when relevant
+        cached = None
+        if isinstance(template, Template):
+            cached = template
+        elif cacheTemplate and isinstance(template, str):
+            cached = templates.get(template)
+        if cached: template = cached.open()
+        if self.streaming:
+            # Read the template without unzipping it: it will be copied into
+            # the result when finalizing it.
+            self.templateZip = zipfile.ZipFile(template)
+            info = cached and cached.parts or \
+                   readOdf(self.templateZip, skip=('content.xml',))
+        else:
+            # Unzip template
+            self.getTempFolder()
+            info = unzip(template, self.unzipFolder, odf=True,
+                         skip=('content.xml',))
+        self.contentXml = info.get('content.xml')
         self.stylesXml = info['styles.xml']
-        self.stylesManager = StylesManager(self)
+        if metrics:
+            self.metrics.add('unzip', start)
+            start = self.metrics.clock()
+        self.stylesManager = StylesManager(self, cached)
         # From LibreOffice 3.5, it is not possible anymore to dump errors into
         # the resulting ods as annotations. Indeed, annotations can't reside
         # anymore within paragraphs. ODS files generated with pod and containing
@@ -191,21 +306,26 @@ class Renderer:
         # LibreOffice >= 4.1 simply does not show the annotation.
         if info['mimetype'] == utils.mimeTypes['ods']: self.raiseOnError = True
         # Create the parsers for content.xml and styles.xml
-        nso = PodEnvironment.NS_OFFICE
         for name in ('content', 'styles'):
-            styleTag = (name == 'content') and 'automatic-styles' or 'styles'
-            inserts = (
-              OdInsert(POD_FONTS, XmlElement('font-face-decls', nsUri=nso)),
-              OdInsert(POD_STYLES[name], XmlElement(styleTag, nsUri=nso)))
-            parser = self.createPodParser('%s.xml' % name, context, inserts)
+            parser = self.createPodParser('%s.xml' % name, context,
+                                          getInserts(name))
             setattr(self, '%sParser' % name, parser)
         # Store the styles mapping
         self.setStylesMapping(stylesMapping)
+        if metrics: self.metrics.add('stylesManager', start)
         # While working, POD may identify "dynamic styles" to insert either in
         # the "automatic-styles" section of content.xml (ie, the column styles
         # of tables generated from XHTML tables via xhtml2odt.py), or in the
         # "styles" section of styles.xml (ie, bullet styles).
         self.dynamicStyles = {'content': [], 'styles': []}
+        # The XHTML to ODT converters, keyed by the parser of the ODT file
+        # (content.xml or styles.xml) into which their results are inserted.
+        self.xhtmlConverters = {}
+        # Downloads images in parallel (see m_prefetchImages)
+        self.imagePrefetcher = None
+        # The memoized results of POD function "xhtml", if enabled
+        self.xhtmlCache = OrderedDict() if xhtmlCache else None
+        self.xhtmlCacheSize = xhtmlCache
 
     def createPodParser(self, odtFile, context, inserts=None):
         '''Creates the parser with its environment for parsing the given
@@ -221,8 +341,10 @@ class Renderer:
             raise PodError(BAD_CONTEXT)
         # Incorporate the default, unalterable, context
         evalContext.update({'xhtml': self.renderXhtml,
+          'xhtmlMany': self.renderXhtmlMany,
           'test': self.evalIfExpression, 'document': self.importDocument,
-          'pod': self.importPod, 'TableProperties': TableProperties,
+          'pod': self.importPod, 'prefetchImages': self.prefetchImages,
+          'TableProperties': TableProperties,
           'BulletedProperties': BulletedProperties,
           'NumberedProperties': NumberedProperties,
           'pageBreak': self.insertPageBreak,
@@ -231,8 +353,25 @@ class Renderer:
           'PIPE': '|', 'SEMICOLON': ';'})
         # Developer, forget the following line
         if '_ctx_' not in evalContext: evalContext['_ctx_'] = evalContext
-        env = PodEnvironment(evalContext, inserts)
-        fileBuffer = FileBuffer(env, os.path.join(self.tempFolder,odtFile))
+        self.contexts[odtFile[:-4]] = evalContext
+        if self.compiled:
+            # Reuse the parser holding the already parsed p_odtFile. Its
+            # environment is shared: it gets the context, the metrics and the
+            # other rendering-specific parameters at evaluation time.
+            res = self.compiled.getParser(odtFile[:-4])
+            env = res.env
+        else:
+            env = PodEnvironment(evalContext, inserts)
+            # Count evaluated expressions and iterations when collecting metrics
+            env.profiler = self.metrics
+            res = None
+        # In streaming mode, the result is kept in memory
+        path = not self.streaming and os.path.join(self.tempFolder, odtFile) \
+               or None
+        fileBuffer = FileBuffer(env, path)
+        # Keep a link to the FileBuffer the result will be dumped into
+        self.fileBuffers[odtFile[:-4]] = fileBuffer
+        if res: return res
         env.currentBuffer = fileBuffer
         return PodParser(env, self)
 
@@ -240,17 +379,74 @@ class Renderer:
         '''Method that can be used (under the name 'xhtml') into a pod template
            for converting a chunk of XHTML content (p_xhtmlString) into a chunk
            of ODT content.'''
-        stylesMapping = self.stylesManager.checkStylesMapping(stylesMapping)
-        # xhtmlString can only be a chunk of XHTML. So we must surround it with
-        # a tag in order to get a XML-compliant file (we need a root tag). We
-        # also remove special blank chars that produce SAX parsing errors.
-        if s == None: s = ''
-        # if isinstance(s, unicode): s = s.encode('utf-8')
-        s = '<p>%s</p>' % s.replace('\f', '').replace('\v', '')
-        # This also removes problematic chars "\x0c" and "\x0b" which simply are
-        # alternative ways to write (respectively) "\f" and "\v".
-        return Xhtml2OdtConverter(s, encoding, self.stylesManager,
-                                  stylesMapping, keepWithNext, self).run()
+        return self.renderXhtmlMany((s,), encoding, stylesMapping,
+                                    keepWithNext)[0]
+
+    def renderXhtmlMany(self, chunks, encoding='utf-8', stylesMapping={},
+                        keepWithNext=0):
+        '''Method that can be used (under the name 'xhtmlMany') into a pod
+           template for converting a sequence of XHTML p_chunks into a list of
+           ODT chunks. The styles mapping is checked once, and all chunks are
+           converted by the same XHTML parser.'''
+        metrics = self.metrics
+        if metrics: start = metrics.clock()
+        res = []
+        cache = self.xhtmlCache
+        converter = checked = None
+        for s in chunks:
+            # Get the result from the cache when relevant
+            key = self.getXhtmlKey(s, stylesMapping, keepWithNext)
+            if key is not None:
+                odt = cache.get(key)
+                if odt is not None:
+                    cache.move_to_end(key)
+                    res.append(odt)
+                    continue
+            if converter is None:
+                checked = self.stylesManager.checkStylesMapping(stylesMapping)
+                converter = self.getXhtmlConverter()
+            # xhtmlString can only be a chunk of XHTML. So we must surround it
+            # with a tag in order to get a XML-compliant file (we need a root
+            # tag). We also remove special blank chars that produce SAX parsing
+            # errors.
+            if s == None: s = ''
+            # if isinstance(s, unicode): s = s.encode('utf-8')
+            s = '<p>%s</p>' % s.translate(XHTML_BLANKS)
+            # This also removes problematic chars "\x0c" and "\x0b" which
+            # simply are alternative ways to write (respectively) "\f" and
+            # "\v".
+            odt = converter.convert(s, checked, keepWithNext)
+            if (key is not None) and not converter.xhtmlParser.env.tablesCount:
+                cache[key] = odt
+                if len(cache) > self.xhtmlCacheSize: cache.popitem(last=False)
+            res.append(odt)
+        if metrics: metrics.add('xhtml', start)
+        return res
+
+    def getXhtmlConverter(self):
+        '''Returns the XHTML to ODT converter to use for producing a chunk of
+           ODT to insert into the ODT file being currently rendered.'''
+        parser = self.currentParser
+        res = self.xhtmlConverters.get(parser)
+        if res is None:
+            res = XhtmlConverter(self.stylesManager, self)
+            self.xhtmlConverters[parser] = res
+        return res
+
+    def getXhtmlKey(self, s, stylesMapping, keepWithNext):
+        '''Returns the key of the XHTML chunk p_s in self.xhtmlCache, or None
+           if the cache is disabled or if p_stylesMapping can't be part of a
+           key.'''
+        if self.xhtmlCache is None: return
+        if stylesMapping:
+            try:
+                mapping = tuple(sorted(stylesMapping.items()))
+                hash(mapping)
+            except TypeError:
+                return
+        else:
+            mapping = None
+        return s, mapping, bool(keepWithNext), self.currentParser
 
     def evalIfExpression(self, condition, ifTrue, ifFalse):
         '''This method implements the method 'test' which is proposed in the
@@ -353,13 +549,33 @@ class Renderer:
             importer = ConvertImporter
         else:
             raise PodError(DOC_WRONG_FORMAT % format)
+        metrics = self.metrics
+        if metrics: start = metrics.clock()
         imp = importer(content, at, format, self)
         # Initialise image-specific parameters
         if isImage:
             imp.init(anchor, wrapInPara, size, sizeUnit, style, keepRatio,
                      convertOptions)
         elif isOdt: imp.init(pageBreakBefore, pageBreakAfter)
-        return imp.run()
+        res = imp.run()
+        if metrics: metrics.add('document', start)
+        return res
+
+    def prefetchImages(self, urls, workers=8):
+        '''Method that can be used (under the name 'prefetchImages') into a pod
+           template, or called before m_run, for downloading in parallel, with
+           at most p_workers threads, the images at p_urls. These images will
+           then be imported, via function "document" or "img" tags in XHTML
+           content, without waiting for every one of them to be downloaded.
+           For example, a template rendering a table of products may, before
+           the table, insert a field containing expression
+
+                   prefetchImages([p.photoUrl for p in products])
+
+           This function returns None: the field will remain empty.'''
+        if not self.imagePrefetcher:
+            self.imagePrefetcher = ImagePrefetcher(workers)
+        self.imagePrefetcher.add(urls)
 
     def getResolvedNamespaces(self):
         '''Gets a context where mainly used namespaces have been resolved'''
@@ -378,6 +594,8 @@ class Renderer:
         # Appy FileWrapper.
         if content.__class__.__name__ == 'File':
             content = utils.FileWrapper(content)
+        metrics = self.metrics
+        if metrics: start = metrics.clock()
         imp = PodImporter(content, at, format, self)
         self.forceOoCall = True
         # Define the context to use: either the current context of the current
@@ -385,9 +603,11 @@ class Renderer:
         if context:
             ctx = context
         else:
-            ctx = self.contentParser.env.context
+            ctx = self.contexts['content']
         imp.init(ctx, pageBreakBefore, pageBreakAfter)
-        return imp.run()
+        res = imp.run()
+        if metrics: metrics.add('pod', start)
+        return res
 
     def _insertBreak(self, type):
         '''Inserts a page or column break into the result'''
@@ -396,40 +616,76 @@ class Renderer:
     def insertPageBreak(self): return self._insertBreak('page')
     def insertColumnBreak(self): return self._insertBreak('column')
 
-    def prepareFolders(self):
-        # Check if I can write the result
-        if not self.overwriteExisting and os.path.exists(self.result):
-            raise PodError(RESULT_FILE_EXISTS % self.result)
+    def checkResult(self):
+        '''Checks if I can write the result(s)'''
+        # A file object (streaming mode only) is supposed to be writable
+        if isinstance(self.result, str):
+            self.result = self.checkResultPath(self.result)
+        self.otherResults = [self.checkResultPath(result) \
+                             for result in self.otherResults]
+        # LibreOffice produces a single file per result type: every result must
+        # be of a distinct type.
+        if self.otherResults:
+            types = self.getResultTypes()
+            for type in types:
+                if types.count(type) > 1:
+                    raise PodError(DUPLICATE_RESULT_TYPE % type)
+
+    def checkResultPath(self, result):
+        '''Checks if I can write the p_result file. Returns its absolute
+           path.'''
+        if not self.overwriteExisting and os.path.exists(result):
+            raise PodError(RESULT_FILE_EXISTS % result)
         try:
-            f = open(self.result, 'w')
+            f = open(result, 'w')
             f.write('Hello')
             f.close()
         except OSError as oe:
-            raise PodError(CANT_WRITE_RESULT % (self.result, oe))
+            raise PodError(CANT_WRITE_RESULT % (result, oe))
         except IOError as ie:
-            raise PodError(CANT_WRITE_RESULT % (self.result, ie))
-        self.result = os.path.abspath(self.result)
-        os.remove(self.result)
-        # Create a temp folder for storing temporary files
-        absResult = os.path.abspath(self.result)
-        self.tempFolder = '%s.%f' % (absResult, time.time())
-        try:
-            os.mkdir(self.tempFolder)
-        except OSError as oe:
-            raise PodError(CANT_WRITE_TEMP_FOLDER % (self.result, oe))
+            raise PodError(CANT_WRITE_RESULT % (result, ie))
+        res = os.path.abspath(result)
+        os.remove(res)
+        return res
+
+    def getTempFolder(self):
+        '''Returns the temp folder for storing temporary files, and creates it,
+           together with its sub-folder "unzip", if it does not exist yet.'''
+        if self.tempFolder: return self.tempFolder
+        if isinstance(self.result, str):
+            self.tempFolder = '%s.%f' % (self.result, time.time())
+            try:
+                os.mkdir(self.tempFolder)
+            except OSError as oe:
+                raise PodError(CANT_WRITE_TEMP_FOLDER % (self.result, oe))
+        else:
+            self.tempFolder = getOsTempFolder(sub=True)
+        # In streaming mode, the "unzip" folder will only contain files added to
+        # the result, like imported images.
+        self.unzipFolder = os.path.join(self.tempFolder, 'unzip')
+        os.mkdir(self.unzipFolder)
+        return self.tempFolder
+
+    def getManifestEntries(self):
+        '''Returns the entries to add to META-INF/manifest.xml, declaring images
+           or files included via the "do... from document" statements.'''
+        res = ''
+        for fileName in self.fileNames.keys():
+            if fileName.endswith('.svg'):
+                fileName = os.path.splitext(fileName)[0] + '.png'
+            mimeType = mimetypes.guess_type(fileName)[0]
+            res += ' <manifest:file-entry manifest:media-type="%s" ' \
+                   'manifest:full-path="%s"/>\n' % (mimeType, fileName)
+        return res
 
     def patchManifest(self):
         '''Declares, in META-INF/manifest.xml, images or files included via the
            "do... from document" statements if any.'''
         if self.fileNames:
+            metrics = self.metrics
+            if metrics: start = metrics.clock()
             j = os.path.join
-            toInsert = ''
-            for fileName in self.fileNames.keys():
-                if fileName.endswith('.svg'):
-                    fileName = os.path.splitext(fileName)[0] + '.png'
-                mimeType = mimetypes.guess_type(fileName)[0]
-                toInsert += ' <manifest:file-entry manifest:media-type="%s" ' \
-                            'manifest:full-path="%s"/>\n' % (mimeType, fileName)
+            toInsert = self.getManifestEntries()
             manifestName = j(self.unzipFolder, j('META-INF', 'manifest.xml'))
             f = open(manifestName)
             manifestContent = f.read()
@@ -440,24 +696,68 @@ class Renderer:
             f = open(manifestName, 'w')
             f.write(manifestContent)
             f.close()
+            if metrics: metrics.add('manifest', start)
+
+    def getXmlSource(self, name):
+        '''Returns a tuple (xml, source) allowing to parse p_name.xml with
+           appy.xml.XmlParser.parse. If the file is not in memory, it is read
+           by chunks from the unzipped template, or from the template zip.'''
+        xml = getattr(self, '%sXml' % name)
+        if xml is not None: return xml, 'string'
+        fileName = '%s.xml' % name
+        if self.templateZip: return self.templateZip.open(fileName), 'file'
+        return os.path.join(self.unzipFolder, fileName), 'file'
 
     # Public interface
     def run(self):
-        '''Renders the result'''
+        '''Renders the result. In asynchronous mode, returns the Future tied
+           to the background conversion, or None if LibreOffice was not
+           called.'''
+        metrics = self.metrics
         try:
-            # Remember which parser is running
-            self.currentParser = self.contentParser
-            # Create the resulting content.xml
-            self.currentParser.parse(self.contentXml)
-            self.currentParser = self.stylesParser
-            # Create the resulting styles.xml
-            self.currentParser.parse(self.stylesXml)
-            # Patch META-INF/manifest.xml
-            self.patchManifest()
-            # Re-zip the result
-            self.finalize()
+            # Create the resulting content.xml and styles.xml
+            for name in ('content', 'styles'):
+                if metrics: start = metrics.clock()
+                # Remember which parser is running
+                self.currentParser = getattr(self, '%sParser' % name)
+                if self.compiled:
+                    self.errors[name] = self.compiled.evaluate(name,
+                      self.fileBuffers[name], self.contexts[name],
+                      self.raiseOnError, metrics)
+                else:
+                    self.currentParser.parse(*self.getXmlSource(name))
+                    self.errors[name] = self.currentParser.env.errors
+                if metrics: metrics.add(name, start)
+            if self.streaming:
+                # Write the result, manifest included, straight into the zip
+                self.finalizeStreaming()
+            else:
+                # Patch META-INF/manifest.xml
+                self.patchManifest()
+                # Re-zip the result
+                self.finalize()
         finally:
-            FolderDeleter.delete(self.tempFolder)
+            if self.templateZip: self.templateZip.close()
+            if self.imagePrefetcher: self.imagePrefetcher.shutdown()
+            # In asynchronous mode, the background conversion will delete the
+            # temp folder.
+            if self.tempFolder and not self.future:
+                FolderDeleter.delete(self.tempFolder)
+        # In asynchronous mode, metrics will be logged after the conversion
+        if metrics and not self.future: self.logMetrics()
+        return self.future
+
+    def logMetrics(self):
+        '''Completes the metrics with the size of the result and logs them'''
+        result = self.result
+        if isinstance(result, str) and os.path.exists(result):
+            self.metrics['bytes']['result'] = os.path.getsize(result)
+        self.metrics.log()
+
+    def getErrors(self):
+        '''Returns the number of errors that were dumped, as notes, into the
+           result, p_raiseOnError being False.'''
+        return sum(self.errors.values())
 
     def getStyles(self):
         '''Returns a dict of the styles that are defined into the template.'''
@@ -474,38 +774,49 @@ class Renderer:
             if ocw: TableProperties.initStylesMapping(stylesMapping, ocw)
             manager.stylesMapping = manager.checkStylesMapping(stylesMapping)
         except PodError as po:
-            self.contentParser.env.currentBuffer.content.close()
-            self.stylesParser.env.currentBuffer.content.close()
-            if os.path.exists(self.tempFolder):
+            for fileBuffer in self.fileBuffers.values():
+                fileBuffer.content.close()
+            if self.templateZip: self.templateZip.close()
+            if self.tempFolder and os.path.exists(self.tempFolder):
                 FolderDeleter.delete(self.tempFolder)
             raise po
 
     def callLibreOffice(self, resultName, resultType):
-        '''Call LibreOffice in server mode to convert or update the result'''
+        '''Call LibreOffice in server mode to convert or update the result.
+           p_resultType may also be a list of result types: the result is then
+           converted into every type.'''
         loOutput = ''
+        if isinstance(resultType, str):
+            resultTypes = [resultType]
+        else:
+            resultTypes = resultType
         try:
-            if (not isinstance(self.ooPort, int)) and \
-               (not isinstance(self.ooPort, long)):
+            if not isinstance(self.ooPort, int):
                 raise PodError(BAD_OO_PORT % str(self.ooPort))
             try:
                 from appy.pod.converter import Converter, ConverterError
                 try:
-                    Converter(resultName, resultType, self.ooPort,
-                              self.stylesTemplate, self.optimalColumnWidths,
-                              self.script).run()
+                    if self.converterPool:
+                        self.converterPool.convert(resultName, resultType,
+                          self.stylesTemplate, self.optimalColumnWidths,
+                          self.script)
+                    else:
+                        Converter(resultName, resultType, self.ooPort,
+                                  self.stylesTemplate, self.optimalColumnWidths,
+                                  self.script).run()
                 except ConverterError as ce:
                     raise PodError(CONVERT_ERROR % str(ce))
             except ImportError:
                 # I do not have UNO. So try to launch a UNO-enabled Python
                 # interpreter which should be in self.pyPath.
                 if not self.pyPath:
-                    raise PodError(NO_PY_PATH % resultType)
+                    raise PodError(NO_PY_PATH % ','.join(resultTypes))
                 if not os.path.isfile(self.pyPath):
                     raise PodError(PY_PATH_NOT_FILE % self.pyPath)
                 convScript = '%s/converter.py' % \
                             os.path.dirname(appy.pod.__file__)
-                cmd = [self.pyPath, convScript, resultName, resultType,
-                       '-p%d' % self.ooPort]
+                cmd = [self.pyPath, convScript, resultName,
+                       ','.join(resultTypes), '-p%d' % self.ooPort]
                 if self.stylesTemplate:
                     cmd.append('-t%s' % self.stylesTemplate)
                 if self.optimalColumnWidths:
@@ -520,7 +831,8 @@ class Renderer:
             # (=forceOoCall=True), if an error occurs we have nevertheless
             # an ODT or ODS to return to the user. So we produce a warning
             # instead of raising an error.
-            if (resultType in self.templateTypes) and self.forceOoCall:
+            odOnly = not [t for t in resultTypes if t not in self.templateTypes]
+            if odOnly and self.forceOoCall:
                 print(WARNING_INCOMPLETE_OD % str(pe))
             else:
                 raise pe
@@ -534,76 +846,251 @@ class Renderer:
         if isinstance(self.template, str):
             res = os.path.splitext(self.template)[1][1:]
         else:
-            # A StringIO instance
+            # A BytesIO instance
             self.template.seek(0)
             firstBytes = self.template.read(90)
-            firstBytes = firstBytes[firstBytes.index('mimetype')+8:]
-            if firstBytes.startswith(utils.mimeTypes['ods']):
+            firstBytes = firstBytes[firstBytes.index(b'mimetype')+8:]
+            if firstBytes.startswith(utils.mimeTypes['ods'].encode()):
                 res = 'ods'
             else:
                 res = 'odt' # We suppose this is ODT
         return res
 
+    def getPageStyles(self):
+        '''If page styles must be renamed, returns a dict mapping old > new
+           names. Returns None else.'''
+        if not self.renamePageStyles: return
+        res = {}
+        for name in self.stylesManager.stylesParser.env.pageStyleNames:
+            res[name] = 'S%s' % getUuid(removeDots=True)
+        return res
+
+    def patchXml(self, name, content, pageStyles):
+        '''Injects dynamic styles into p_content, being the rendered content of
+           p_name.xml (p_name being "content" or "styles"), and renames its page
+           styles according to p_pageStyles. Returns the patched content.'''
+        # For styles.xml, complete dynamic styles with default styles for
+        # bulleted and numbered lists.
+        ds = self.dynamicStyles[name]
+        if name == 'styles':
+            env = self.stylesParser.env
+            n = {'text': env.ns(env.NS_TEXT), 'style': env.ns(env.NS_STYLE)}
+            ds.insert(0, NumberedProperties().dumpStyle('podNumberedList', n))
+            ds.insert(0, BulletedProperties().dumpStyle('podBulletedList', n))
+        # Inject dynamic styles
+        content = content.replace('<!DYNAMIC_STYLES!>', b''.join(ds).decode())
+        # Rename the page styles
+        if pageStyles:
+            part = PAGE_STYLES_PARTS[name]
+            for old, new in pageStyles.items():
+                content = content.replace(part % old, part % new)
+        return content
+
+    def getResultType(self):
+        '''Gets the type of the result, from its extension. If the result is a
+           file object, it is of the same type as the template.'''
+        if isinstance(self.result, str):
+            return os.path.splitext(self.result)[1].strip('.')
+        return self.getTemplateType()
+
+    def getResultTypes(self):
+        '''Gets the types of all the results'''
+        res = [self.getResultType()]
+        for result in self.otherResults:
+            res.append(os.path.splitext(result)[1].strip('.'))
+        return res
+
+    def mustCallLibreOffice(self):
+        '''Must LibreOffice be called for converting or updating the result(s)
+           ?'''
+        return (self.getResultType() not in self.templateTypes) or \
+               bool(self.otherResults) or self.forceOoCall
+
+    def setResult(self, resultName, result=None):
+        '''Moves the file at p_resultName, produced in the temp folder, to
+           the p_result (defaults to the main result).'''
+        result = result or self.result
+        if isinstance(result, str):
+            os.rename(resultName, result)
+        else:
+            f = open(resultName, 'rb')
+            shutil.copyfileobj(f, result)
+            f.close()
+
     def finalize(self):
         '''Re-zip the result and potentially call LibreOffice if target format
            is not among self.templateTypes or if forceOoCall is True.'''
         j = os.path.join
-        # If page styles must be renamed, create a dict mapping old > new names
-        pageStyles = None
-        if self.renamePageStyles:
-            pageStyles = {}
-            for name in self.stylesManager.stylesParser.env.pageStyleNames:
-                pageStyles[name] = 'S%s' % getUuid(removeDots=True)
+        metrics = self.metrics
+        if metrics: start = metrics.clock()
+        pageStyles = self.getPageStyles()
         for name in ('content', 'styles'):
             # Copy the [content|styles].xml file from the temp to the zip folder
             fn = '%s.xml' % name
             shutil.copy(j(self.tempFolder, fn), j(self.unzipFolder, fn))
-            # For styles.xml, complete dynamic styles with default styles for
-            # bulleted and numbered lists.
-            ds = self.dynamicStyles[name]
-            if name == 'styles':
-                env = self.stylesParser.env
-                n = {'text': env.ns(env.NS_TEXT), 'style': env.ns(env.NS_STYLE)}
-                ds.insert(0,NumberedProperties().dumpStyle('podNumberedList',n))
-                ds.insert(0,BulletedProperties().dumpStyle('podBulletedList',n))
-            # Get the file content and inject dynamic styles into it
+            # Get the file content and patch it
             fn = os.path.join(self.unzipFolder, fn)
             f = open(fn)
-            content = f.read().replace('<!DYNAMIC_STYLES!>',
-                                       b''.join(ds).decode())
-            # Rename the page styles
-            if pageStyles:
-                part = PAGE_STYLES_PARTS[name]
-                for old, new in pageStyles.iteritems():
-                    content = content.replace(part % old, part % new)
+            content = self.patchXml(name, f.read(), pageStyles)
             f.close()
             # Write the updated content to the file
             f = open(fn, 'w')
             f.write(content)
             f.close()
+            if metrics: metrics['bytes'][name] = os.path.getsize(fn)
+        if metrics:
+            metrics.add('patch', start)
+            start = metrics.clock()
         # Call the user-defined "finalize" function when present
         if self.finalizeFunction:
             try:
                 self.finalizeFunction(self.unzipFolder, self)
             except Exception as e:
                 print(WARNING_FINALIZE_ERROR % str(e))
+            if metrics:
+                metrics.add('finalize', start)
+                start = metrics.clock()
         # Re-zip the result, first as an OpenDocument file of the same type as
         # the POD template (odt, ods...)
         resultExt = self.getTemplateType()
         resultName = os.path.join(self.tempFolder, 'result.%s' % resultExt)
         zip(resultName, self.unzipFolder, odf=True)
-        resultType = os.path.splitext(self.result)[1].strip('.')
-        if (resultType in self.templateTypes) and not self.forceOoCall:
+        if metrics: metrics.add('zip', start)
+        if not self.mustCallLibreOffice():
             # Simply move the ODT result to the result
-            os.rename(resultName, self.result)
+            self.setResult(resultName)
         else:
-            if resultType not in FILE_TYPES:
-                raise PodError(BAD_RESULT_TYPE % (
-                    self.result, FILE_TYPES.keys()))
-            # Call LibreOffice to perform the conversion or document update
-            output = self.callLibreOffice(resultName, resultType)
-            # I (should) have the result. Move it to the correct name.
-            resPrefix = os.path.splitext(resultName)[0]
+            self.convertResult(resultName, self.getResultTypes())
+
+    def finalizeStreaming(self):
+        '''Streaming variant of m_finalize: the result is directly zipped from
+           the template and the rendered content.xml and styles.xml. If
+           LibreOffice must be called, the zip is first produced in the temp
+           folder.'''
+        metrics = self.metrics
+        if metrics: start = metrics.clock()
+        # Patch the rendered content.xml and styles.xml
+        pageStyles = self.getPageStyles()
+        contents = {}
+        for name in ('content', 'styles'):
+            content = self.fileBuffers[name].content.getvalue()
+            content = self.patchXml(name, content, pageStyles)
+            if metrics: metrics['bytes'][name] = len(content.encode('utf-8'))
+            contents[name] = content
+        if metrics:
+            metrics.add('patch', start)
+            start = metrics.clock()
+        callLo = self.mustCallLibreOffice()
+        if callLo:
+            resultName = os.path.join(self.getTempFolder(),
+                                      'result.%s' % self.getTemplateType())
+        else:
+            resultName = self.result
+        zipIn = self.templateZip
+        zipOut = zipfile.ZipFile(resultName, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            # Insert first the uncompressed file "mimetype" (see
+            # appy.utils.zip.zip).
+            names = zipIn.namelist()
+            if 'mimetype' in names:
+                mimetype = zipIn.read('mimetype')
+            else:
+                mimetype = utils.mimeTypes[self.getTemplateType()]
+            zipOut.writestr('mimetype', mimetype, zipfile.ZIP_STORED)
+            # Write the rendered content.xml and styles.xml
+            for name in ('content', 'styles'):
+                zipOut.writestr('%s.xml' % name, contents[name])
+            # Copy the other files from the template, patching the manifest if
+            # files were imported.
+            manifest = 'META-INF/manifest.xml'
+            for info in zipIn.infolist():
+                name = info.filename
+                if name in ('mimetype', 'content.xml', 'styles.xml'): continue
+                if (name == manifest) and self.fileNames:
+                    content = zipIn.read(name).decode('utf-8')
+                    hook = '</manifest:manifest>'
+                    content = content.replace(hook,
+                                              self.getManifestEntries() + hook)
+                    zipOut.writestr(zipfile.ZipInfo(name, info.date_time),
+                                    content, compress_type=info.compress_type)
+                else:
+                    copyZipped(zipIn, zipOut, info)
+            # Add the files that were added into the "unzip" folder
+            if self.unzipFolder:
+                folder = self.unzipFolder
+                for dir, dirnames, filenames in os.walk(folder):
+                    for name in filenames:
+                        path = os.path.join(dir, name)
+                        zipName = os.path.relpath(path, folder)
+                        if zipName in names: continue
+                        zipOut.write(path, zipName)
+        finally:
+            zipOut.close()
+        if metrics: metrics.add('zip', start)
+        if callLo: self.convertResult(resultName, self.getResultTypes())
+
+    def convertResult(self, resultName, resultTypes):
+        '''Calls LibreOffice for converting or updating the zipped result in
+           p_resultName into p_resultTypes, and moves the converted files to the
+           results. In asynchronous mode, this is done in the background.'''
+        results = [self.result] + self.otherResults
+        for i in range(len(resultTypes)):
+            if resultTypes[i] not in FILE_TYPES:
+                raise PodError(BAD_RESULT_TYPE % (results[i],
+                                                  FILE_TYPES.keys()))
+        if not self.asynchronous:
+            self.convert(resultName, resultTypes)
+            return
+        # Use the converter pool's executor if a pool is given
+        executor = self.converterPool or self.getConverterExecutor()
+        self.future = executor.submit(self.convertInBackground, resultName,
+                                      resultTypes)
+
+    @classmethod
+    def getConverterExecutor(klass):
+        '''Gets the executor running background conversions for renderers not
+           using a converter pool, creating it if it does not exist yet.'''
+        # The executor is shared by Renderer sub-classes
+        with Renderer.converterLock:
+            res = Renderer.converterExecutor
+            if res is None:
+                res = ThreadPoolExecutor(klass.converterThreads)
+                Renderer.converterExecutor = res
+        return res
+
+    @classmethod
+    def stopConverterExecutor(klass, wait=True):
+        '''Shuts down the executor running background conversions for
+           renderers not using a converter pool, once the pending conversions
+           are complete if p_wait is True. A new executor will be created on
+           next use.'''
+        with Renderer.converterLock:
+            executor = Renderer.converterExecutor
+            Renderer.converterExecutor = None
+        if executor: executor.shutdown(wait=wait)
+
+    def convertInBackground(self, resultName, resultTypes):
+        '''Performs, in the background, the conversion of the result'''
+        try:
+            self.convert(resultName, resultTypes)
+            if self.metrics: self.logMetrics()
+            return self.result
+        finally:
+            FolderDeleter.delete(self.tempFolder)
+
+    def convert(self, resultName, resultTypes):
+        '''Synchronous part of m_convertResult'''
+        # Call LibreOffice to perform the conversion(s) or document update, in
+        # a single call.
+        metrics = self.metrics
+        if metrics: start = metrics.clock()
+        output = self.callLibreOffice(resultName, resultTypes)
+        if metrics: metrics.add('libreoffice', start)
+        # I (should) have the results. Move them to the correct names.
+        resPrefix = os.path.splitext(resultName)[0]
+        results = [self.result] + self.otherResults
+        for i in range(len(resultTypes)):
+            resultType = resultTypes[i]
             if resultType in self.templateTypes:
                 # converter.py has (normally!) created a second file
                 # suffixed .res.[resultType]
@@ -616,5 +1103,5 @@ class Renderer:
                 finalResultName = '%s.%s' % (resPrefix, resultType)
             if not os.path.exists(finalResultName):
                 raise PodError(CONVERT_ERROR % output)
-            os.rename(finalResultName, self.result)
+            self.setResult(finalResultName, results[i])
 # ------------------------------------------------------------------------------
@@ -2,7 +2,7 @@
 # ~license~
 # ------------------------------------------------------------------------------
 import re, os.path
-from collections import UserDict
+from collections import UserDict, OrderedDict
 from appy import utils
 from appy.pod import *
 from appy.pod.odf_parser import OdfEnvironment, OdfParser
@@ -849,7 +849,10 @@ class StylesManager:
     # Valid value types for some keys within style mappings
     mappingValueTypes = {'h*': int, 'table': TableProperties,
                          'ol': NumberedProperties, 'ul': BulletedProperties}
-    def __init__(self, renderer):
+    # The maximum number of styles mappings kept by m_checkStylesMapping
+    checkedMappingsSize = 100
+
+    def __init__(self, renderer, template=None):
         self.renderer = renderer
         self.stylesString = renderer.stylesXml
         # The collected styles, as a list of Style instances
@@ -858,8 +861,15 @@ class StylesManager:
         self.pageLayout = None
         # Global styles mapping
         self.stylesMapping = None
-        self.stylesParser = StylesParser(StylesEnvironment(), self)
-        self.stylesParser.parse(self.stylesString)
+        if template:
+            # Reuse the styles as already parsed from a cached p_template (an
+            # appy.pod.template.Template instance).
+            self.styles = template.styles
+            self.pageLayout = template.pageLayout
+            self.stylesParser = template.stylesParser
+        else:
+            self.stylesParser = StylesParser(StylesEnvironment(), self)
+            self.stylesParser.parse(self.stylesString)
         # Now self.styles contains the styles.
         # Text styles from self.styles
         self.textStyles = self.styles.getStyles('text')
@@ -867,6 +877,17 @@ class StylesManager:
         self.paragraphStyles = self.styles.getStyles('paragraph')
         # The custom styles generator
         self.stylesGenerator = StylesGenerator(self)
+        # The styles found by m_findStyle, keyed by XHTML element signatures
+        # (see m_getSignature), when no local styles mapping is used.
+        self.foundStyles = {}
+        # The styles found by m_findStyle for the last used local styles
+        # mapping.
+        self.localMapping = None
+        self.localFoundStyles = {}
+        # Styles mappings already checked by m_checkStylesMapping, keyed by
+        # their content, in a LRU cache of at most self.checkedMappingsSize
+        # entries.
+        self.checkedMappings = OrderedDict()
 
     def checkStylesAdequation(self, htmlStyle, odtStyle):
         '''Checks that p_odtStyle may be used for style p_htmlStyle'''
@@ -879,7 +900,7 @@ class StylesManager:
                 htmlStyle, odtStyle.displayName))
 
     def addStyleEntry(self, stylesMapping, key, value, cssAttrs):
-        '''Adds, in dict p_stylesMapping (the output of m_checkStylesMapping
+        '''Adds, in dict p_stylesMapping (the output of m_compileStylesMapping
            below), a p_key:p_value entry.'''
         alreadyIn = key in stylesMapping
         if cssAttrs or alreadyIn:
@@ -896,6 +917,30 @@ class StylesManager:
             stylesMapping[key] = value
 
     def checkStylesMapping(self, stylesMapping):
+        '''Returns the internal representation of p_stylesMapping (see
+           m_compileStylesMapping). Because POD function "xhtml" is generally
+           called many times with the same styles mapping, the internal
+           representation of every checked mapping is cached, keyed by the
+           mapping content.'''
+        cache = self.checkedMappings
+        try:
+            key = tuple(sorted(stylesMapping.items()))
+            res = cache.get(key)
+        except (AttributeError, TypeError):
+            # Let m_compileStylesMapping raise the appropriate error, or
+            # compile a mapping containing unhashable values.
+            return self.compileStylesMapping(stylesMapping)
+        if res is None:
+            res = self.compileStylesMapping(stylesMapping)
+            cache[key] = res
+            # TableProperties or BulletedProperties instances are part of the
+            # key: a mapping containing new instances is a new entry.
+            if len(cache) > self.checkedMappingsSize: cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+        return res
+
+    def compileStylesMapping(self, stylesMapping):
         '''Checks that the given p_stylesMapping is correct, and returns the
            internal representation of it. p_stylesMapping is a dict where:
            * every key can be:
@@ -954,7 +999,7 @@ class StylesManager:
            not isinstance(stylesMapping, UserDict):
             raise PodError(MAPPING_NOT_DICT)
         for xhtmlStyleName, odtStyleName in stylesMapping.items():
-            if not isinstance(xhtmlStyleName, basestring):
+            if not isinstance(xhtmlStyleName, str):
                 raise PodError(MAPPING_KEY_NOT_STRING)
             # Separate CSS attributes if any
             cssAttrs = None
@@ -977,7 +1022,7 @@ class StylesManager:
                     raise PodError(MAPPING_WRONG_VALUE_TYPE % \
                                    (xhtmlStyleName, vType.__name__))
             else:
-                if not isinstance(odtStyleName, basestring):
+                if not isinstance(odtStyleName, str):
                     raise PodError(MAPPING_ELEM_NOT_STRING % xhtmlStyleName)
                 if not xhtmlStyleName or not odtStyleName:
                     raise PodError(MAPPING_ELEM_EMPTY)
@@ -1016,10 +1061,10 @@ class StylesManager:
 
     def getMatchingStyle(self, xhtmlElem, styles):
         '''p_styles is a value from a styles mapping as transformed by
-           m_checkStylesMapping above. If it represents a list of styles
-           (see case (ii) in m_checkStylesMapping), this method must return the
-           relevant Style instance from this list, depending on CSS attributes
-           found on p_xhtmlElem.'''
+           m_compileStylesMapping above. If it represents a list of styles
+           (see case (ii) in m_compileStylesMapping), this method must return
+           the relevant Style instance from this list, depending on CSS
+           attributes found on p_xhtmlElem.'''
         if not isinstance(styles, list): return styles
         cssStyles = xhtmlElem.cssStyles
         if not cssStyles:
@@ -1055,8 +1100,45 @@ class StylesManager:
             return self.getStyleFromMapping(stylesMapping, xhtmlElem,
                                             elem=meta, checkMetaElems=False)
 
+    # Elements whose style can't be cached: getting their style updates them
+    unfoundable = ('td', 'th')
+
+    def getSignature(self, xhtmlElem):
+        '''Returns a tuple representing everything the style to apply to
+           p_xhtmlElem depends on: its tag, CSS classes and attributes.'''
+        cssStyles = xhtmlElem.cssStyles
+        if cssStyles is None: return xhtmlElem.elem, None, None
+        attrs = [(name, value.value, value.unit) for name, value in \
+                 cssStyles.get().items() if name != 'classes']
+        attrs.sort()
+        return xhtmlElem.elem, cssStyles.classes, tuple(attrs)
+
+    def getFoundStyles(self, localStylesMapping):
+        '''Returns the dict of styles already found for p_localStylesMapping'''
+        if not localStylesMapping: return self.foundStyles
+        if localStylesMapping is not self.localMapping:
+            self.localMapping = localStylesMapping
+            self.localFoundStyles = {}
+        return self.localFoundStyles
+
     def findStyle(self, xhtmlElem, localStylesMapping):
         '''Finds the ODT style that must be applied to XHTML p_elem (as a
+           xhtml2odt:HtmlElement instance). Most XHTML documents use a few
+           distinct combinations of tags and CSS styles: the style found for
+           a given combination is cached and reused (see m_searchStyle).'''
+        if xhtmlElem.elem in self.unfoundable:
+            return self.searchStyle(xhtmlElem, localStylesMapping)
+        found = self.getFoundStyles(localStylesMapping)
+        signature = self.getSignature(xhtmlElem)
+        try:
+            return found[signature]
+        except KeyError:
+            res = found[signature] = self.searchStyle(xhtmlElem,
+                                                      localStylesMapping)
+            return res
+
+    def searchStyle(self, xhtmlElem, localStylesMapping):
+        '''Searches the ODT style that must be applied to XHTML p_elem (as a
            xhtml2odt:HtmlElement instance).
 
            The global styles mapping is in self.stylesMapping; the local styles
@@ -0,0 +1,192 @@
+# ~license~
+# ------------------------------------------------------------------------------
+import os, os.path, io, zipfile, threading
+from collections import OrderedDict
+import appy.pod
+from appy.xml import XmlElement
+from appy.utils.zip import readOdf
+from appy.pod.buffers import DeferredBuffer
+from appy.pod.pod_parser import PodParser, PodEnvironment, OdInsert
+from appy.pod.styles_manager import StylesParser, StylesEnvironment
+
+# ------------------------------------------------------------------------------
+# Default font added by pod in content.xml and styles.xml
+POD_FONTS = '<style:font-face style:name="PodStarSymbol" ' \
+            'svg:font-family="StarSymbol"/>'
+
+# Default styles added by pod in content.xml and styles.xml
+POD_STYLES = {}
+podFolder = os.path.dirname(appy.pod.__file__)
+for name in ('content', 'styles'):
+    f = open('%s/%s.xmlt' % (podFolder, name))
+    POD_STYLES[name] = f.read()
+    f.close()
+
+def getInserts(name):
+    '''Gets the POD fonts and styles to insert into p_name.xml (p_name being
+       "content" or "styles"), as a tuple of OdInsert instances.'''
+    nso = PodEnvironment.NS_OFFICE
+    styleTag = (name == 'content') and 'automatic-styles' or 'styles'
+    return (OdInsert(POD_FONTS, XmlElement('font-face-decls', nsUri=nso)),
+            OdInsert(POD_STYLES[name], XmlElement(styleTag, nsUri=nso)))
+
+# ------------------------------------------------------------------------------
+class Template:
+    '''The parts of a POD template that do not depend on the rendering context:
+       the raw zipped template, the content of its main inner files and its
+       parsed styles. A Template instance is shared by all renderers using it
+       and must thus be considered as read-only.'''
+
+    # The ODF inner files not kept in self.parts. content.xml, whose size
+    # depends on the template, is parsed by chunks by every renderer, straight
+    # from the template zip (see appy.pod.renderer.Renderer.getXmlSource).
+    skipParts = ('content.xml',)
+
+    def __init__(self, data, path=None, mtime=None, size=None):
+        # The content of the whole (zipped) template, as bytes. It is only kept
+        # in memory if the template does not come from the file system.
+        self.data = None if path else data
+        # The path to the template file, when it comes from the file system
+        self.path = path
+        # The modification time and size of the template file, when it comes
+        # from the file system.
+        self.mtime = mtime
+        self.size = size
+        # The content of the ODF inner files (styles.xml, meta.xml...)
+        with zipfile.ZipFile(self.open()) as zipFile:
+            self.parts = readOdf(zipFile, skip=self.skipParts)
+        # The styles found in styles.xml, as a Styles instance, and the main
+        # page layout, as a PageLayout instance. They are set by the
+        # StylesParser.
+        self.styles = None
+        self.pageLayout = None
+        self.stylesParser = StylesParser(StylesEnvironment(), self)
+        self.stylesParser.parse(self.parts['styles.xml'])
+
+    @classmethod
+    def fromFile(klass, path, **kwargs):
+        '''Creates an instance of this class from the file at p_path'''
+        stat = os.stat(path)
+        return klass(None, os.path.abspath(path), stat.st_mtime, stat.st_size,
+                     **kwargs)
+
+    def isStale(self, stat):
+        '''Was the template file modified since this instance was created ?
+           p_stat is the result of os.stat on this file.'''
+        return (stat.st_mtime != self.mtime) or (stat.st_size != self.size)
+
+    def open(self):
+        '''Returns the path to the zipped template or, if it is only in
+           memory, a file-like object containing it. Both are readable by
+           zipfile.ZipFile.'''
+        return self.path or io.BytesIO(self.data)
+
+# ------------------------------------------------------------------------------
+class CompiledTemplate(Template):
+    '''A Template whose content.xml and styles.xml are parsed once for all, each
+       one into a tree of buffers and actions, like a PX is parsed into its AST.
+       Rendering a document from a compiled template only consists in
+       evaluating these trees with a given context: SAX parsing is skipped.
+
+       A compiled template can be used by several renderers, concurrently or
+       not. The trees and their environments being shared, their evaluations
+       are serialized.'''
+
+    def __init__(self, data, path=None, mtime=None, size=None,
+                 raiseOnError=False):
+        Template.__init__(self, data, path, mtime, size)
+        # Parsing errors are dumped into the trees, excepted if p_raiseOnError
+        # is True.
+        self.raiseOnError = raiseOnError
+        # The parsers for content.xml and styles.xml, whose environments hold
+        # the trees.
+        self.parsers = {}
+        # The number of parsing errors dumped into every tree
+        self.errors = {}
+        # Only one tree at a time can be evaluated
+        self.lock = threading.Lock()
+        for name in ('content', 'styles'):
+            env = PodEnvironment({}, getInserts(name))
+            env.currentBuffer = DeferredBuffer(env)
+            parser = PodParser(env, self)
+            fileName = '%s.xml' % name
+            if fileName in self.parts:
+                parser.parse(self.parts[fileName])
+            else:
+                # Parse it by chunks: only its tree is kept
+                with zipfile.ZipFile(self.open()) as zipFile:
+                    parser.parse(zipFile.open(fileName), source='file')
+            self.parsers[name] = parser
+            self.errors[name] = env.errors
+
+    def getParser(self, name):
+        '''Gets the parser for p_name.xml (p_name being "content" or
+           "styles"). Its environment is shared by all renderers: it is only
+           set for a given rendering by m_evaluate.'''
+        return self.parsers[name]
+
+    def evaluate(self, name, result, context, raiseOnError, profiler=None):
+        '''Evaluates the tree for p_name.xml with this p_context, and dumps
+           the result into p_result, a FileBuffer. Returns the number of errors
+           dumped into p_result, parsing errors included.'''
+        env = self.parsers[name].env
+        with self.lock:
+            env.context = context
+            env.raiseOnError = raiseOnError
+            env.profiler = profiler
+            # Count the errors of this rendering only, on top of parsing errors
+            env.errors = self.errors[name]
+            try:
+                env.currentBuffer.evaluate(result, context)
+            finally:
+                env.context = None
+                env.profiler = None
+            res = env.errors
+        result.content.close()
+        return res
+
+    def render(self, context, result, **kwargs):
+        '''Renders, from this template and p_context, the document in p_result.
+           p_kwargs are parameters to the appy.pod.renderer.Renderer.'''
+        from appy.pod.renderer import Renderer
+        Renderer(self, context, result, **kwargs).run()
+
+# ------------------------------------------------------------------------------
+class TemplateCache:
+    '''Keeps in memory, in a bounded LRU cache, Template instances keyed by the
+       absolute paths of their files. A cached template is reloaded as soon as
+       its file's modification time or size changes.'''
+
+    def __init__(self, size=20):
+        # The maximum number of templates to keep in the cache
+        self.size = size
+        self.templates = OrderedDict() # ~{s_path: Template}~
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        '''Gets the Template instance corresponding to the file at p_path'''
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            res = self.templates.get(path)
+            if res and not res.isStale(stat):
+                # Mark this template as being the most recently used one
+                self.templates.move_to_end(path)
+                return res
+        # (Re)load the template outside the lock
+        res = Template.fromFile(path)
+        with self.lock:
+            self.templates[path] = res
+            self.templates.move_to_end(path)
+            while len(self.templates) > self.size:
+                self.templates.popitem(last=False)
+        return res
+
+    def clear(self):
+        '''Removes all templates from the cache'''
+        with self.lock:
+            self.templates.clear()
+
+# The process-wide template cache
+templates = TemplateCache()
+# ------------------------------------------------------------------------------
@@ -608,16 +608,26 @@ class XhtmlEnvironment(XmlEnvironment):
         XmlEnvironment.__init__(self)
         self.renderer = renderer
         self.ns = renderer.currentParser.env.namespaces
+        self.textNs = self.ns[OdfEnvironment.NS_TEXT]
+        self.linkNs = self.ns[OdfEnvironment.NS_XLINK]
+        self.tableNs = self.ns[OdfEnvironment.NS_TABLE]
+        self.styleNs = self.ns[OdfEnvironment.NS_STYLE]
+        self.reset()
+
+    def reset(self):
+        '''Resets this environment before converting another chunk of XHTML
+           (see XhtmlConverter.convert).'''
+        self.currentElem = None
         self.res = u''
         self.currentContent = u''
         self.currentElements = [] # Stack of currently walked elements
         self.currentLists = [] # Stack of currently walked lists (ul or ol)
         self.currentTables = [] # Stack of currently walked tables
         self.lastElem = None # Last walked element before the current one
-        self.textNs = self.ns[OdfEnvironment.NS_TEXT]
-        self.linkNs = self.ns[OdfEnvironment.NS_XLINK]
-        self.tableNs = self.ns[OdfEnvironment.NS_TABLE]
-        self.styleNs = self.ns[OdfEnvironment.NS_STYLE]
+        # The number of tables found in the XHTML chunk. Every table gets a
+        # unique name: the ODT chunk produced from XHTML containing tables
+        # can't be reused (see Renderer.renderXhtml).
+        self.tablesCount = 0
         # The following attr will be True when parsing parts of the XHTML that
         # must be ignored.
         self.ignore = False
@@ -873,6 +883,7 @@ class XhtmlEnvironment(XmlEnvironment):
         elif elem == 'table':
             # Update stack of current tables
             self.currentTables.append(HtmlTable(self, attrs))
+            self.tablesCount += 1
         elif elem in TABLE_COL_TAGS:
             # Determine colspan
             colspan = 1
@@ -1124,30 +1135,37 @@ class XhtmlParser(XmlParser):
             ds.append(props.dumpStyle(name, ns))
 
 # ------------------------------------------------------------------------------
-class Xhtml2OdtConverter:
-    '''Converts a chunk of XHTML into a chunk of ODT'''
+class XhtmlConverter:
+    '''Converts chunks of XHTML into chunks of ODT. A converter can be reused
+       for converting several chunks: its XHTML parser and environment are
+       created once and reset before every conversion.'''
     verbose = False
 
-    def __init__(self, xhtmlString, encoding, stylesManager, localStylesMapping,
-                 keepWithNext, renderer):
+    def __init__(self, stylesManager, renderer, encoding='utf-8'):
         self.renderer = renderer
-        self.xhtmlString = xhtmlString
         self.encoding = encoding # Todo: manage encoding that is not utf-8
         self.stylesManager = stylesManager
-        self.localStylesMapping = localStylesMapping
-        self.odtChunk = None
+        self.localStylesMapping = None
         self.xhtmlParser = XhtmlParser(XhtmlEnvironment(renderer), self)
-        if keepWithNext: self.xhtmlString = self.applyKeepWithNext()
         # In verbose mode, we dump a trace of the xhtml2odt algorithm
         self.xhtmlParser.verbose = self.xhtmlParser.env.verbose = self.verbose
 
-    def run(self):
-        '''Parses the input XHTML string and returns the resulting ODF chunk'''
-        self.xhtmlParser.parse(self.xhtmlString)
+    def convert(self, xhtmlString, localStylesMapping, keepWithNext=0):
+        '''Parses p_xhtmlString and returns the resulting ODF chunk'''
+        self.localStylesMapping = localStylesMapping
+        if keepWithNext: xhtmlString = self.applyKeepWithNext(xhtmlString)
+        self.xhtmlParser.env.reset()
+        self.xhtmlParser.parse(xhtmlString)
         return self.xhtmlParser.env.res
 
-    def applyKeepWithNext(self):
-        '''This method is called prior to parsing self.xhtmlString in order to
+    def convertMany(self, xhtmlStrings, localStylesMapping, keepWithNext=0):
+        '''Parses every string from p_xhtmlStrings and returns the list of
+           resulting ODF chunks.'''
+        return [self.convert(s, localStylesMapping, keepWithNext) \
+                for s in xhtmlStrings]
+
+    def applyKeepWithNext(self, xhtmlString):
+        '''This method is called prior to parsing p_xhtmlString in order to
            add specific CSS classes to some XHTML tags, implementing the
            "keep-with-next" functionality. If the last tag is:
            * a paragraph (tag "p"), class "ParaKWN" will be set;
@@ -1158,7 +1176,7 @@ class Xhtml2OdtConverter:
            "podNumberItemKeepWithNext", if the "li" is, respectively, in a "ul"
            or "ol" tag.
         '''
-        res = self.xhtmlString
+        res = xhtmlString
         lastParaIndex = res.rfind('<p')
         lastItemIndex = res.rfind('<li')
         if (lastParaIndex != -1) or (lastItemIndex != -1):
@@ -1178,4 +1196,20 @@ class Xhtml2OdtConverter:
                 res = res[:maxIndex+elemLenght] + (' class="%s" ' % styleName) \
                       + res[maxIndex+elemLenght:]
         return res
+
+class Xhtml2OdtConverter(XhtmlConverter):
+    '''Converts a single chunk of XHTML into a chunk of ODT. Use a
+       XhtmlConverter for converting several chunks.'''
+
+    def __init__(self, xhtmlString, encoding, stylesManager, localStylesMapping,
+                 keepWithNext, renderer):
+        XhtmlConverter.__init__(self, stylesManager, renderer, encoding)
+        self.xhtmlString = xhtmlString
+        self.localStylesMapping = localStylesMapping
+        self.odtChunk = None
+        if keepWithNext: self.xhtmlString = self.applyKeepWithNext(xhtmlString)
+
+    def run(self):
+        '''Parses the input XHTML string and returns the resulting ODF chunk'''
+        return self.convert(self.xhtmlString, self.localStylesMapping)
 # ------------------------------------------------------------------------------
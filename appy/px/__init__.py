@@ -4,9 +4,10 @@
 
 # ~license~
 # ------------------------------------------------------------------------------
-import xml.sax
+import os, xml.sax, threading
 from appy.px.parser import PxParser, PxEnvironment
-from appy.pod.buffers import MemoryBuffer
+from appy.px.cache import PxCache
+from appy.px.compiler import Compiler, CompileError, Sink
 from appy.xml import xmlPrologue, xhtmlPrologue
 
 # Exception class --------------------------------------------------------------
@@ -17,6 +18,23 @@ class Px:
     '''Represents a (chunk of) PX code'''
     xmlPrologue = xmlPrologue
     xhtmlPrologue = xhtmlPrologue
+    # PXs are not parsed when they are created, but the first time they are
+    # rendered (or checked, see m_check). If a PxCache instance is defined
+    # here, their ASTs are loaded from this cache, or parsed and stored in it.
+    # Because most PXs are created when modules are imported, the cache can be
+    # enabled before any import by setting environment variable APPY_PX_CACHE
+    # to the path of the cache folder. Cached ASTs being unpickled, this folder
+    # must not be writable by untrusted users.
+    cache = None
+    if os.environ.get('APPY_PX_CACHE'):
+        cache = PxCache(os.environ['APPY_PX_CACHE'])
+    # Prevents several threads from loading the same PX concurrently
+    loadLock = threading.RLock()
+    # If True, the AST of a PX is compiled, the first time it is rendered, into
+    # a Python function that is called to render it (see appy.px.compiler)
+    # instead of interpreting the AST. A PX containing elements the compiler
+    # does not manage is interpreted anyway.
+    useCompiler = False
 
     def __init__(self, content, isFileName=False, partial=True,
                  template=None, hook=None, prologue=None, unicode=True):
@@ -51,7 +69,12 @@ class Px:
         self.prologue = prologue
         # Will the result be unicode or str?
         self.unicode = unicode
-        self.parse()
+        # The PX parser, whose environment holds the AST. It is created when
+        # the PX is rendered for the first time.
+        self.parser = None
+        # The function rendering this PX, if compiled (see m_compile). It is
+        # False if the PX could not be compiled.
+        self.function = None
         # A PX can be profiled (see m_profile below)
         self.profiler = None
 
@@ -61,15 +84,70 @@ class Px:
         if self.partial:
             # Surround the partial chunk with a root tag: it must be valid XML
             self.content = '<x>%s</x>' % self.content
+            self.partial = False
         # Create a PX parser
-        self.parser = PxParser(PxEnvironment(), self)
-        # Parses self.content (a PX code in a string) with self.parser, to
+        parser = PxParser(PxEnvironment(), self)
+        # Parses self.content (a PX code in a string) with the parser, to
         # produce a tree of memory buffers.
         try:
-            self.parser.parse(self.content)
+            parser.parse(self.content)
         except xml.sax.SAXParseException as spe:
             self.completeErrorMessage(spe)
             raise spe
+        # The AST is complete: prepare it for being evaluated many times
+        parser.env.ast.freeze()
+        self.parser = parser
+
+    def load(self):
+        '''Gets the AST of this PX, by parsing it or, if a cache is defined,
+           by getting it from the cache, or parsing it and storing it in the
+           cache if it is not there yet.'''
+        with self.loadLock:
+            # Another thread may have loaded it in the meanwhile
+            if self.parser: return
+            if not self.cache:
+                self.parse()
+            else:
+                if self.partial:
+                    key = '<x>%s</x>' % self.content
+                else:
+                    key = self.content
+                env = self.cache.get(key)
+                if env:
+                    self.content = key
+                    self.partial = False
+                    self.parser = PxParser(env, self)
+                else:
+                    self.parse()
+                    self.cache.put(key, self.parser.env)
+            self.timeExpressions()
+
+    def timeExpressions(self):
+        '''Makes the AST time the evaluation of its expressions if the
+           profiler requires it. Like the compiled function, the AST is bound
+           to the profiler once for all, and not at every rendering: it is
+           shared by all renderings of this PX, possibly concurrent.'''
+        profiler = self.profiler
+        if profiler and (profiler.exprThreshold is None): profiler = None
+        self.parser.env.profiler = profiler
+
+    def check(self):
+        '''Parses this PX if it has not been done yet. Raises an exception if
+           it contains parsing errors.'''
+        if not self.parser: self.load()
+
+    def compile(self):
+        '''Compiles this PX into a Python function, stored in self.function.
+           If the PX can't be compiled, self.function is False: the PX will be
+           interpreted.'''
+        if not self.parser: self.load()
+        try:
+            self.function = Compiler(self).compile()
+        except (CompileError, SyntaxError, RecursionError, MemoryError):
+            # SyntaxError, RecursionError or MemoryError may be raised by
+            # Python while compiling the generated code, ie, if it contains too
+            # many nested blocks.
+            self.function = False
 
     def completeErrorMessage(self, parsingError):
         '''A p_parsingError occurred. Complete the error message with the
@@ -105,34 +183,70 @@ class Px:
             # Call the template PX, filling the hook with the current PX
             context[self.hook] = self
             return self.template(context)
-        else:
-            # Start profiling when relevant
-            profiler = self.profiler
-            if profiler: profiler.enter(self.name)
-            # Create a Memory buffer for storing the result
-            env = self.parser.env
-            result = MemoryBuffer(env, None)
-            env.ast.evaluate(result, context)
-            res = result.content
-            if self.prologue:
-                res = self.prologue + res
-            if not self.unicode:
-                res = res.encode('utf-8')
+        # Collect the result in a list of chunks
+        chunks = []
+        self.renderInto(context, chunks.append, applyTemplate=False)
+        res = ''.join(chunks)
+        if not self.unicode:
+            res = res.encode('utf-8')
+        return res
+
+    def renderInto(self, context, write, applyTemplate=True):
+        '''Renders the PX, like m___call__, but, instead of returning the
+           result, calls function p_write with every chunk of it, as soon as
+           it is produced. p_write is called with strings, whatever the value
+           of self.unicode: encoding them is up to p_write.
+
+           For example, to send a page via a HTTP connection:
+
+                    px.renderInto(context, lambda s: out.write(s.encode()))
+
+           The whole result never resides in memory, and the first chunks can
+           be sent before the whole PX is rendered.
+        '''
+        # Developer, forget the following line
+        if '_ctx_' not in context: context['_ctx_'] = context
+
+        if self.hook and applyTemplate:
+            # Render the template PX, filling the hook with the current PX
+            context[self.hook] = self
+            self.template.renderInto(context, write)
+            return
+        # Start profiling when relevant
+        profiler = self.profiler
+        if profiler: profiler.enter(self.name)
+        try:
+            # Get the AST if not done yet
+            if not self.parser: self.load()
+            if self.prologue: write(self.prologue)
+            if self.useCompiler and (self.function is None): self.compile()
+            # Only methods "write" and "dumpContent" are called on the result
+            result = Sink(write)
+            if self.function:
+                self.function(result, context)
+            else:
+                self.parser.env.ast.evaluate(result, context)
+        finally:
             # Stop profiling when relevant
             if profiler: profiler.leave()
-            return res
 
     def override(self, content, partial=True):
         '''Overrides the content of this PX with a new p_content (as a
            string).'''
         self.partial = partial
         self.content = content
-        # Parse again, with new content
-        self.parse()
+        # Parse (and compile) again, with new content, at next rendering
+        self.parser = None
+        self.function = None
 
     def profile(self, name, profiler):
         '''Enables profiling of this PX, that will be named p_name in the
-           p_profiler's output.'''
+           p_profiler's output (see appy.px.profiler). If p_profiler is None,
+           profiling is disabled.'''
         self.name = name
         self.profiler = profiler
+        # The AST and the compiled function, if any, may have to time
+        # expressions or not.
+        if self.parser: self.timeExpressions()
+        self.function = None
 # ------------------------------------------------------------------------------
@@ -0,0 +1,73 @@
+'''Disk cache for the ASTs of PXs, avoiding to parse them at every startup'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import os, os.path, types, pickle, marshal, hashlib, copyreg, importlib.util
+
+# ------------------------------------------------------------------------------
+# Increment this number every time the structure of PX ASTs (buffers, actions,
+# expressions...) changes: ASTs cached with another version will be ignored.
+CACHE_VERSION = 1
+
+# Code objects, from compiled Python expressions, are not picklable: they are
+# pickled via the marshal module.
+def reduceCode(code): return marshal.loads, (marshal.dumps(code),)
+
+class Pickler(pickle.Pickler):
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[types.CodeType] = reduceCode
+
+# ------------------------------------------------------------------------------
+class PxCache:
+    '''Stores, in p_folder, the ASTs of PXs, serialized with pickle, in files
+       whose names are hashes of the PXs' source code. The hash also includes
+       the Python bytecode version, because code objects from compiled Python
+       expressions are part of the ASTs.
+
+       Loading a cached AST unpickles it, which may execute arbitrary code:
+       p_folder must not be writable by untrusted users.'''
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(folder): os.makedirs(folder, exist_ok=True)
+
+    def getPath(self, content):
+        '''Gets the path to the file storing the AST of the PX whose source is
+           p_content.'''
+        h = hashlib.sha1(content.encode('utf-8'))
+        h.update(importlib.util.MAGIC_NUMBER)
+        h.update(str(CACHE_VERSION).encode())
+        return os.path.join(self.folder, '%s.px' % h.hexdigest())
+
+    def get(self, content):
+        '''Gets the cached PxEnvironment, containing the AST of the PX whose
+           source is p_content, or None if it is not in the cache.'''
+        path = self.getPath(content)
+        if not os.path.exists(path): return
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            # A corrupted or incompatible file: it will be overwritten
+            return
+
+    def put(self, content, env):
+        '''Stores, in the cache, the PxEnvironment p_env, containing the AST of
+           the PX whose source is p_content.'''
+        path = self.getPath(content)
+        # Write a temp file first: a concurrent process must never read a
+        # partial file.
+        temp = '%s.%d' % (path, os.getpid())
+        try:
+            with open(temp, 'wb') as f:
+                Pickler(f, pickle.HIGHEST_PROTOCOL).dump(env)
+            os.replace(temp, path)
+        except Exception:
+            # The AST could not be cached, but the PX remains usable
+            if os.path.exists(temp): os.remove(temp)
+
+    def clear(self):
+        '''Removes all the cached ASTs'''
+        for name in os.listdir(self.folder):
+            if name.endswith('.px'): os.remove(os.path.join(self.folder, name))
+# ------------------------------------------------------------------------------
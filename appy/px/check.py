@@ -0,0 +1,45 @@
+'''Checks that the PXs defined in some modules can be parsed. Because PXs are
+   parsed the first time they are rendered, a PX containing a syntax error does
+   not prevent its module from being imported: this module allows to detect
+   such errors, ie, in tests.
+
+   Usage: python -m appy.px.check module1 [module2 ...]'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import sys, importlib
+from appy.px import Px
+
+# ------------------------------------------------------------------------------
+def getPxs(module):
+    '''Yields tuples (s_name, px) for every PX defined at the root of p_module
+       or as static attribute of a class defined in p_module.'''
+    for name, value in vars(module).items():
+        if isinstance(value, Px):
+            yield '%s.%s' % (module.__name__, name), value
+        elif isinstance(value, type) and (value.__module__ == module.__name__):
+            for attr, px in vars(value).items():
+                if isinstance(px, Px):
+                    yield '%s.%s.%s' % (module.__name__, name, attr), px
+
+def checkModules(*names):
+    '''Imports the modules whose names are in p_names and checks their PXs.
+       Returns a list of tuples (s_pxName, s_error), one for every PX that
+       could not be parsed.'''
+    res = []
+    for name in names:
+        module = importlib.import_module(name)
+        for pxName, px in getPxs(module):
+            try:
+                px.check()
+            except Exception as e:
+                res.append((pxName, str(e)))
+    return res
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    errors = checkModules(*sys.argv[1:])
+    for name, error in errors:
+        sys.stderr.write('%s: %s\n' % (name, error))
+    sys.exit(errors and 1 or 0)
+# ------------------------------------------------------------------------------
@@ -0,0 +1,328 @@
+'''Compiles the AST of a PX into a Python function rendering it.
+
+   Rendering a PX normally consists in interpreting its AST: the tree of memory
+   buffers, expressions and actions produced by the PX parser. The compiler
+   produces, from this AST, the source code of a Python function made of
+   nested loops, ifs and calls to the "write" method of the result, with the
+   static parts of the PX as string literals. The function is compiled and
+   kept on the PX (see appy.px.Px.useCompiler).
+
+   The generated code implements the same semantics as the interpreter (see
+   appy.pod.buffers.MemoryBuffer.evaluate and appy.pod.actions): the "loop"
+   object, error expressions ("expr|errorExpr"), variables defined in "var" and
+   "var2" attributes and special attributes like "checked" or "selected".
+   Errors are managed by the same AST objects as when interpreting the PX.'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+from appy.xml import escapeXml
+from appy.utils import Traceback
+from appy.pod.buffers import MemoryBuffer, EVAL_EXPR_ERROR
+from appy.pod.elements import Expression, Attribute, Cell
+from appy.pod.actions import EvaluationError, If, For, Variables, \
+                             EVAL_ERROR, WRONG_SEQ_TYPE
+
+# ------------------------------------------------------------------------------
+class CompileError(Exception):
+    '''Raised when a PX contains elements the compiler does not manage: the PX
+       is then interpreted.'''
+
+# ------------------------------------------------------------------------------
+class Sink:
+    '''Buffer-like object receiving the result of a PX, compiled or not, and
+       passing it, chunk by chunk, to a p_write function. Evaluating a PX only
+       requires, from its result, methods "write" and "dumpContent".'''
+
+    def __init__(self, write):
+        self.write = write
+
+    def dumpContent(self, content):
+        self.write(escapeXml(content))
+
+# Functions called by the generated code ---------------------------------------
+def dump(res, context, write, escape):
+    '''Writes, via p_write, p_res, the result of an expression that is not a
+       string, like appy.pod.elements.Expression.evaluate converts it.'''
+    if res.__class__.__name__ == 'Px':
+        # A PX that must be rendered within the current PX. Its result must not
+        # be escaped.
+        res.renderInto(context, write, applyTemplate=False)
+        return
+    res = str(res)
+    write(escape and escapeXml(res) or res)
+
+def expressionError(expr, e):
+    '''Raises the error corresponding to exception p_e, raised while
+       evaluating Expression p_expr (see MemoryBuffer.evaluate).'''
+    raise EvaluationError(e, EVAL_EXPR_ERROR % (expr.expr,
+                                                '\n' + Traceback.get(5)))
+
+def actionError(action, expr, result, context, e):
+    '''Manages exception p_e, raised while evaluating p_expr, the expression
+       of p_action (see Action.evaluateExpression).'''
+    if e.__class__.__name__ == 'MessageException': raise e
+    action.manageError(result, context,
+                       EVAL_ERROR % (expr, action.getExceptionLine(e)), e)
+
+def loopError(action, result, context, e):
+    '''Manages the error raised when the expression of For p_action does not
+       produce an iterable (see For.do).'''
+    action.manageError(result, context, WRONG_SEQ_TYPE % action.expr, e)
+
+# ------------------------------------------------------------------------------
+class Compiler:
+    '''Generates the source code of the function rendering a PX'''
+
+    def __init__(self, px):
+        self.px = px
+        # The lines of the generated source code
+        self.lines = []
+        # Literal chunks not written yet. Consecutive chunks are merged and
+        # written at once.
+        self.chunks = []
+        # Objects referenced by the generated code, by name
+        self.names = {'escape': escapeXml, 'dump': dump,
+                      'expressionError': expressionError,
+                      'actionError': actionError, 'loopError': loopError,
+                      'EvaluationError': EvaluationError}
+        # A counter used to produce unique names
+        self.counter = 0
+        # The profiler timing expressions, if any (see appy.px.profiler)
+        profiler = px.profiler
+        if profiler and (profiler.exprThreshold is not None):
+            self.names['profiler'] = profiler
+            self.names['clock'] = profiler.clock
+            self.timed = True
+        else:
+            self.timed = False
+
+    def getName(self, prefix, o=None):
+        '''Gets a unique name for a local variable or, if p_o is given, for a
+           global variable whose value is p_o.'''
+        self.counter += 1
+        name = '%s%d' % (prefix, self.counter)
+        if o is not None: self.names[name] = o
+        return name
+
+    def write(self, chunk):
+        '''Adds a literal p_chunk to write into the result'''
+        if chunk: self.chunks.append(chunk)
+
+    def flush(self, indent):
+        '''Generates the code writing the pending literal chunks'''
+        if not self.chunks: return
+        self.lines.append('%sw(%r)' % (' ' * indent, ''.join(self.chunks)))
+        self.chunks = []
+
+    def add(self, indent, line):
+        '''Adds a p_line of code, after having flushed the literal chunks'''
+        self.flush(indent)
+        self.lines.append('%s%s' % (' ' * indent, line))
+
+    def addBlock(self, indent, fun, *args):
+        '''Generates, via p_fun(indent, *p_args), a block of code, ensuring it
+           is not empty.'''
+        count = len(self.lines)
+        fun(indent, *args)
+        self.flush(indent)
+        if len(self.lines) == count: self.add(indent, 'pass')
+
+    def addEval(self, indent, var, code):
+        '''Generates the code evaluating p_code, a tuple (code, errorCode), and
+           storing the result in local variable p_var.'''
+        code, errorCode = code
+        code = self.getName('c', code)
+        if errorCode is None:
+            self.add(indent, '%s = eval(%s, context)' % (var, code))
+        else:
+            errorCode = self.getName('c', errorCode)
+            self.add(indent, 'try:')
+            self.add(indent+1, '%s = eval(%s, context)' % (var, code))
+            self.add(indent, 'except Exception:')
+            self.add(indent+1, '%s = eval(%s, context)' % (var, errorCode))
+
+    # Buffers, expressions and attributes --------------------------------------
+    def addBuffer(self, indent, buffer):
+        '''Generates the code evaluating p_buffer'''
+        content = buffer.content
+        current = 0
+        for index, entry in buffer.getEntries():
+            self.write(content[current:index])
+            current = index + 1
+            if isinstance(entry, Expression):
+                self.addExpression(indent, entry)
+            elif isinstance(entry, Attribute):
+                code = self.getName('c', entry.code)
+                self.add(indent, 'if eval(%s, context): w(%r)' % \
+                         (code, ' %s="%s"' % (entry.name, entry.name)))
+            elif isinstance(entry, MemoryBuffer):
+                if entry.action:
+                    self.addAction(indent, entry.action)
+                else:
+                    self.write(entry.content)
+            else:
+                raise CompileError()
+        stop = buffer.getLength()
+        if current < (stop-1): self.write(content[current:stop])
+
+    def addExpression(self, indent, expr):
+        '''Generates the code evaluating p_expr and writing its result'''
+        if expr.metaCode is not None: raise CompileError()
+        escape = expr.escapeXml
+        self.add(indent, 'try:')
+        if self.timed: self.add(indent+1, 't = clock()')
+        self.addEval(indent+1, 'r', (expr.code, expr.errorCode))
+        self.add(indent+1, 'if r.__class__ is str: w(%s)' % \
+                 (escape and 'escape(r)' or 'r'))
+        self.add(indent+1, 'elif r is not None: dump(r, context, w, %s)' % \
+                 escape)
+        if self.timed:
+            self.add(indent+1, 'profiler.expression(%r, clock() - t)' % \
+                     expr.expr)
+        self.add(indent, 'except EvaluationError: raise')
+        self.add(indent, 'except Exception as e: expressionError(%s, e)' % \
+                 self.getName('x', expr))
+
+    # Actions ------------------------------------------------------------------
+    def addAction(self, indent, action):
+        '''Generates the code executing p_action'''
+        if (action.__class__ not in (If, For, Variables)) or action.minus or \
+           (action.source != 'buffer'):
+            raise CompileError()
+        name = self.getName('a', action)
+        if isinstance(action, Variables):
+            self.addVariables(indent, action, name)
+            return
+        # Evaluate the action's expression
+        var = self.getName('v')
+        if action.code:
+            self.add(indent, 'try:')
+            self.addEval(indent+1, var, action.code)
+            self.add(indent, 'except Exception as e:')
+            self.add(indent+1, 'actionError(%s, %r, result, context, e)' % \
+                     (name, action.expr))
+        else:
+            self.add(indent, '%s = None' % var)
+        if isinstance(action, If):
+            self.addIf(indent, action, var)
+        else:
+            self.addFor(indent, action, name, var)
+
+    def addContent(self, indent, action):
+        '''Generates the code executing the sub-action of p_action or, if there
+           is no sub-action, evaluating its buffer.'''
+        if action.subAction:
+            self.addAction(indent, action.subAction)
+        else:
+            self.addBuffer(indent, action.buffer)
+
+    def addIf(self, indent, action, var):
+        '''Generates the code executing If p_action'''
+        # When the condition is False, an empty cell may be dumped, but only in
+        # pod.
+        if action.buffer.isMainElement(Cell.OD): raise CompileError()
+        self.add(indent, 'if %s:' % var)
+        self.addBlock(indent+1, self.addContent, action)
+
+    def addFor(self, indent, action, name, var):
+        '''Generates the code executing For p_action'''
+        add = self.add
+        n = self.counter
+        hidden = 'h%d' % n
+        loop = 'loop%d' % n
+        outer = 'outer%d' % n
+        i = 'i%d' % n
+        item = 'item%d' % n
+        iters = action.iters
+        add(indent, 'try:')
+        add(indent+1, 'iter(%s)' % var)
+        add(indent, 'except TypeError as e:')
+        add(indent+1, 'loopError(%s, result, context, e)' % name)
+        # Remember variables hidden by iterators if any
+        add(indent, '%s = {}' % hidden)
+        for iter in iters:
+            add(indent, 'if %r in context: %s[%r] = context[%r]' % \
+                (iter, hidden, iter, iter))
+        add(indent, '%s, %s = %s.initialiseLoop(context, %s)' % \
+            (loop, outer, name, var))
+        add(indent, '%s = -1' % i)
+        add(indent, 'for %s in %s:' % (item, var))
+        body = indent + 1
+        add(body, '%s += 1' % i)
+        add(body, '%s.nb = %s' % (loop, i))
+        add(body, '%s.first = %s == 0' % (loop, i))
+        add(body, '%s.last = %s == (%s.length-1)' % (loop, i, loop))
+        add(body, '%s.even = (%s%%2) == 0' % (loop, i))
+        add(body, '%s.odd = not %s.even' % (loop, loop))
+        if len(iters) == 1:
+            add(body, 'context[%r] = %s' % (iters[0], item))
+        else:
+            for j in range(len(iters)):
+                add(body, 'context[%r] = %s[%d]' % (iters[j], item, j))
+        self.addBlock(body, self.addContent, action)
+        if self.timed: add(indent, 'profiler.iterations(%s + 1)' % i)
+        # Delete the current loop object and restore the overridden one if any
+        first = iters[0]
+        add(indent, 'try:')
+        add(indent+1, "delattr(context['loop'], %r)" % first)
+        add(indent, 'except AttributeError:')
+        add(indent+1, 'pass')
+        add(indent, "if %s: setattr(context['loop'], %r, %s)" % \
+            (outer, first, outer))
+        # Restore hidden variables and remove iterator variables
+        add(indent, 'context.update(%s)' % hidden)
+        add(indent, 'if %s:' % var)
+        for iter in iters:
+            add(indent+1, 'if (%r not in %s) and (%r in context): ' \
+                'del context[%r]' % (iter, hidden, iter, iter))
+
+    def addVariables(self, indent, action, name):
+        '''Generates the code executing Variables p_action'''
+        add = self.add
+        hidden = self.getName('h')
+        var = self.getName('v')
+        add(indent, '%s = None' % hidden)
+        for vName, expr, code in action.variables:
+            add(indent, 'try:')
+            self.addEval(indent+1, var, code)
+            add(indent, 'except Exception as e:')
+            add(indent+1, 'actionError(%s, %r, result, context, e)' % \
+                (name, expr))
+            if vName.startswith('@'):
+                # Replace the value of a global variable
+                add(indent, 'context[%r] = %s' % (vName[1:], var))
+                continue
+            # Remember the variable previous value if already in the context
+            add(indent, 'if %r in context:' % vName)
+            add(indent+1, 'if not %s: %s = {%r: context[%r]}' % \
+                (hidden, hidden, vName, vName))
+            add(indent+1, 'else: %s[%r] = context[%r]' % \
+                (hidden, vName, vName))
+            add(indent, 'context[%r] = %s' % (vName, var))
+        self.addContent(indent, action)
+        # Restore hidden variables and delete the others
+        add(indent, 'if %s: context.update(%s)' % (hidden, hidden))
+        for vName, expr, code in action.variables:
+            if vName.startswith('@'): continue
+            add(indent, 'if not %s or (%r not in %s): del context[%r]' % \
+                (hidden, vName, hidden, vName))
+
+    # Main method --------------------------------------------------------------
+    def compile(self):
+        '''Returns the function rendering the PX. It accepts 2 args: the
+           result, a Sink instance, and the context. Raises a CompileError if
+           the PX cannot be compiled.'''
+        env = self.px.parser.env
+        # Errors are always raised by PXs
+        if not env.raiseOnError: raise CompileError()
+        self.lines.append('def render(result, context):')
+        self.lines.append(' w = result.write')
+        self.addBlock(1, self.addBuffer, env.ast)
+        source = '\n'.join(self.lines)
+        names = self.names
+        exec(compile(source, '<px>', 'exec'), names)
+        res = names['render']
+        # Keep the source code, for debugging purposes
+        res.source = source
+        return res
+# ------------------------------------------------------------------------------
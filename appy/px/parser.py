@@ -33,6 +33,16 @@ class PxEnvironment(XmlEnvironment):
         self.currentElem = None
         # Exceptions are always raised (for pod, it is not the case)
         self.raiseOnError = True
+        # The profiler timing the evaluation of expressions, if any (see
+        # appy.px.profiler).
+        self.profiler = None
+
+    def __getstate__(self):
+        '''The parser and profiler are not pickled with the AST (see
+           appy.px.cache).'''
+        res = self.__dict__.copy()
+        res['parser'] = res['profiler'] = None
+        return res
 
     def addSubBuffer(self):
         subBuffer = self.currentBuffer.addSubBuffer()
@@ -0,0 +1,202 @@
+'''Profiler for PXs, finding the PXs and expressions that take most of the time
+   to render a page.
+
+   Usage:
+
+     profiler = Profiler(exprThreshold=0.001)
+     px.profile('name', profiler)         # Profile a given PX
+     profiler.profileModule(module)       # Profile all PXs from some module
+     ... render PXs ...
+     print(profiler.getTable())           # Get a report as a text table
+     profiler.dumpSpeedscope('r.json')    # Produce a file for speedscope.app
+
+   For every profiled PX, the profiler counts its calls and measures its
+   inclusive time (the time spent rendering it, sub-PXs included) and its
+   exclusive time (the time spent rendering it, sub-PXs excluded). Times are
+   also aggregated by call path (the profiled PXs being rendered, from the
+   outermost one to the current one), allowing to produce flame graphs.
+
+   If an expression threshold is defined, every expression evaluated by a
+   profiled PX whose evaluation lasts at least this number of seconds is
+   reported. The time of an expression producing a sub-PX includes the time
+   spent rendering this sub-PX.'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import time, json, threading
+
+# ------------------------------------------------------------------------------
+class Profiler:
+    '''Collects timings about the PXs it profiles (see Px.profile)'''
+
+    def __init__(self, exprThreshold=None, clock=time.perf_counter):
+        # The minimum duration, in seconds, for an expression to be reported.
+        # If None, expressions are not timed.
+        self.exprThreshold = exprThreshold
+        # The function returning the current time, in seconds
+        self.clock = clock
+        # PXs can be rendered concurrently by several threads: every thread
+        # has its own stack of PXs being rendered. Every element in the stack
+        # is a list [s_name, t_path, f_start, f_childrenTime].
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''Forgets the data collected so far'''
+        with self.lock:
+            # Stats per PX: ~{s_name: [i_calls, f_inclusive, f_exclusive]}~
+            self.stats = {}
+            # Exclusive time per call path: ~{t_path: f_time}~
+            self.paths = {}
+            # Slow expressions: ~{(s_pxName, s_expr): [i_count, f_total,
+            #                                          f_max]}~
+            self.expressions = {}
+            # The time spent rendering root PXs (=PXs not called by another
+            # profiled PX).
+            self.total = 0.0
+
+    def getStack(self):
+        '''Returns the stack of PXs being rendered by the current thread'''
+        try:
+            return self.local.stack
+        except AttributeError:
+            r = self.local.stack = []
+            return r
+
+    def profileModule(self, module):
+        '''Profiles all PXs defined in p_module (see appy.px.check.getPxs).
+           Each PX is named after its module, class and attribute.'''
+        from appy.px.check import getPxs
+        for name, px in getPxs(module):
+            px.profile(name, self)
+
+    # Methods called while rendering PXs ---------------------------------------
+    def enter(self, name):
+        '''The rendering of PX named p_name starts'''
+        stack = self.getStack()
+        path = stack[-1][1] + (name,) if stack else (name,)
+        stack.append([name, path, self.clock(), 0.0])
+
+    def leave(self):
+        '''The rendering of the PX on top of the stack ends'''
+        end = self.clock()
+        stack = self.getStack()
+        name, path, start, children = stack.pop()
+        elapsed = end - start
+        exclusive = elapsed - children
+        if stack: stack[-1][3] += elapsed
+        # The inclusive time of a PX calling itself, directly or not, must be
+        # counted once.
+        recursive = name in path[:-1]
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            if not recursive: stats[1] += elapsed
+            stats[2] += exclusive
+            self.paths[path] = self.paths.get(path, 0.0) + exclusive
+            if not stack: self.total += elapsed
+
+    def expression(self, expr, elapsed):
+        '''Expression p_expr has been evaluated in p_elapsed seconds'''
+        if elapsed < self.exprThreshold: return
+        stack = self.getStack()
+        key = stack[-1][0] if stack else '?', expr
+        with self.lock:
+            stats = self.expressions.get(key)
+            if stats is None:
+                self.expressions[key] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]: stats[2] = elapsed
+
+    def iterations(self, count):
+        '''Called with the number of iterations of every "for" statement
+           evaluated while timing expressions, be it interpreted (see
+           appy.pod.actions.For.do, shared by PX and POD) or compiled (see
+           appy.px.compiler). Loops are not profiled: override this method to
+           collect their counts.'''
+
+    # Reports ------------------------------------------------------------------
+    def getTable(self, limit=None):
+        '''Returns a text table containing the stats about profiled PXs,
+           sorted by decreasing exclusive time, followed by the slowest
+           expressions. Times are in milliseconds. If p_limit is given, only the
+           p_limit first lines of every table are shown.'''
+        total = self.total or 1.0
+        rows = [('PX', 'Calls', 'Incl. (ms)', 'Excl. (ms)', 'Excl. %',
+                 'Incl./call')]
+        stats = sorted(self.stats.items(), key=lambda e: -e[1][2])
+        for name, (calls, incl, excl) in stats[:limit]:
+            rows.append((name, str(calls), '%.3f' % (incl*1000),
+                         '%.3f' % (excl*1000), '%.1f' % (excl*100/total),
+                         '%.3f' % (incl*1000/calls)))
+        r = [self.formatRows(rows, 1)]
+        if self.expressions:
+            rows = [('PX', 'Expression', 'Count', 'Total (ms)', 'Max (ms)')]
+            exprs = sorted(self.expressions.items(), key=lambda e: -e[1][1])
+            for (name, expr), (count, elapsed, max) in exprs[:limit]:
+                expr = ' '.join(expr.split())
+                rows.append((name, expr, str(count), '%.3f' % (elapsed*1000),
+                             '%.3f' % (max*1000)))
+            r.append(self.formatRows(rows, 2))
+        return '\n\n'.join(r)
+
+    def formatRows(self, rows, texts):
+        '''Formats p_rows as a text table. The first row is the header. The
+           p_texts first columns are left-aligned, the others, containing
+           numbers, are right-aligned.'''
+        widths = [max([len(row[i]) for row in rows]) \
+                  for i in range(len(rows[0]))]
+        r = []
+        for row in rows:
+            cells = [cell.ljust(widths[i]) if i < texts else \
+                     cell.rjust(widths[i]) for i, cell in enumerate(row)]
+            r.append('  '.join(cells).rstrip())
+            if row is rows[0]: r.append('-' * len(r[0]))
+        return '\n'.join(r)
+
+    def getFolded(self):
+        '''Returns the exclusive times per call path in the "folded stacks"
+           format, as accepted by flamegraph.pl or speedscope: one line per
+           path, made of the PX names separated by semicolons, followed by the
+           time, in microseconds.'''
+        r = []
+        for path, elapsed in sorted(self.paths.items()):
+            r.append('%s %d' % (';'.join(path), round(elapsed * 1000000)))
+        return '\n'.join(r)
+
+    def getSpeedscope(self, name='PX profile'):
+        '''Returns the exclusive times per call path as a dict in the
+           speedscope file format (https://www.speedscope.app), as a "sampled"
+           profile whose samples are the call paths, weighted by their times,
+           in milliseconds.'''
+        frames = []
+        indexes = {}
+        samples = []
+        weights = []
+        for path, elapsed in sorted(self.paths.items()):
+            sample = []
+            for pxName in path:
+                index = indexes.get(pxName)
+                if index is None:
+                    index = indexes[pxName] = len(frames)
+                    frames.append({'name': pxName})
+                sample.append(index)
+            samples.append(sample)
+            weights.append(elapsed * 1000)
+        return {'$schema': 'https://www.speedscope.app/file-format-schema.json',
+          'shared': {'frames': frames},
+          'profiles': [{'type': 'sampled', 'name': name,
+            'unit': 'milliseconds', 'startValue': 0, 'endValue': sum(weights),
+            'samples': samples, 'weights': weights}],
+          'name': name, 'exporter': 'appy.px.profiler'}
+
+    def dumpSpeedscope(self, path, name='PX profile'):
+        '''Writes, in the file at p_path, the result of m_getSpeedscope'''
+        with open(path, 'w') as f:
+            json.dump(self.getSpeedscope(name), f)
+# ------------------------------------------------------------------------------
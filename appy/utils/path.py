@@ -1,7 +1,7 @@
 '''Operations on files and folders (=paths)'''
 
 # ------------------------------------------------------------------------------
-import os, os.path, shutil
+import os, os.path, shutil, time
 
 # ------------------------------------------------------------------------------
 class FolderDeleter:
@@ -2,20 +2,24 @@
 
 # ~license~
 # ------------------------------------------------------------------------------
-import os, os.path, zipfile, time
+import os, os.path, zipfile, time, shutil, struct
 from appy.utils import mimeTypes
 
 # ------------------------------------------------------------------------------
 # Interesting sub-files within ODF files
 odfInnerFiles = ('content.xml', 'styles.xml', 'meta.xml', 'mimetype')
 
-def unzip(f, folder, odf=False):
+def unzip(f, folder, odf=False, skip=()):
     '''Unzips file p_f into p_folder. p_f can be any anything accepted by the
        zipfile.ZipFile constructor. p_folder must exist.
        
        If p_odf is True, p_f is considered to be an odt or ods file and this
        function will return a dict containing the content of content.xml,
-       styles.xml, meta.xml and metadata from the zipped file.'''
+       styles.xml, meta.xml and metadata from the zipped file, excepted those
+       whose names are in p_skip: these ones are only extracted.
+
+       Files are extracted by chunks: only the content of the files returned
+       in the dict is completely loaded in memory.'''
     zipFile = zipfile.ZipFile(f)
     if odf: res = {}
     else: res = None
@@ -40,17 +44,80 @@ def unzip(f, folder, odf=False):
         if fileName:
             fullFileName = os.path.join(fullFolderName, fileName)
             f = open(fullFileName, 'wb')
-            fileContent = zipFile.read(zippedFile)
-            if odf and not folderName:
-                # content.xml and others may reside in subfolders. Get only the
-                # one in the root folder.
-                if fileName in odfInnerFiles:
-                    res[fileName] = fileContent
-            f.write(fileContent)
+            # content.xml and others may reside in subfolders. Get only the
+            # one in the root folder.
+            if odf and not folderName and (fileName in odfInnerFiles) and \
+               (fileName not in skip):
+                fileContent = zipFile.read(zippedFile)
+                res[fileName] = fileContent
+                f.write(fileContent)
+            else:
+                member = zipFile.open(zippedFile)
+                shutil.copyfileobj(member, f)
+                member.close()
             f.close()
     zipFile.close()
     return res
 
+def readOdf(zipFile, skip=()):
+    '''Returns a dict containing the content of the ODF inner files (see
+       odfInnerFiles) found at the root of p_zipFile, a zipfile.ZipFile
+       instance, without extracting anything on disk. Files whose names are
+       in p_skip are ignored.'''
+    res = {}
+    names = zipFile.namelist()
+    for name in odfInnerFiles:
+        if (name in names) and (name not in skip):
+            res[name] = zipFile.read(name)
+    return res
+
+# ------------------------------------------------------------------------------
+def copyZipped(source, target, info, chunkSize=65536):
+    '''Copies, from zipfile.ZipFile p_source to zipfile.ZipFile p_target (opened
+       in "w" mode), the member whose zipfile.ZipInfo is p_info. The member is
+       neither decompressed nor recompressed: its compressed bytes are copied
+       as is, by chunks of p_chunkSize bytes.'''
+    # p_info must not be reused as is: p_target would update it
+    zInfo = zipfile.ZipInfo(info.filename, info.date_time)
+    zInfo.compress_type = info.compress_type
+    zInfo.external_attr = info.external_attr
+    zInfo.file_size = info.file_size
+    if info.flag_bits & 0x1:
+        # Encrypted members are decrypted and recompressed: zipfile can't
+        # encrypt them again.
+        with source.open(info) as fIn, target.open(zInfo, 'w') as fOut:
+            shutil.copyfileobj(fIn, fOut)
+        return
+    zInfo.compress_size = info.compress_size
+    zInfo.CRC = info.CRC
+    # Sizes and CRC being known, they are written in the local header: no
+    # data descriptor must follow the data.
+    zInfo.flag_bits = info.flag_bits & ~0x08
+    # Go to the compressed data, after the member's local header in p_source
+    fIn = source.fp
+    fIn.seek(info.header_offset)
+    header = fIn.read(zipfile.sizeFileHeader)
+    if header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile('Bad magic number for file header')
+    nameSize, extraSize = struct.unpack(zipfile.structFileHeader, header)[-2:]
+    fIn.seek(nameSize + extraSize, 1)
+    # Write the member into p_target, like zipfile.ZipFile.writestr does
+    target._writecheck(zInfo)
+    target._didModify = True
+    fOut = target.fp
+    zInfo.header_offset = fOut.tell()
+    fOut.write(zInfo.FileHeader())
+    size = info.compress_size
+    while size:
+        chunk = fIn.read(min(size, chunkSize))
+        if not chunk:
+            raise zipfile.BadZipFile('Truncated file %s' % info.filename)
+        fOut.write(chunk)
+        size -= len(chunk)
+    target.filelist.append(zInfo)
+    target.NameToInfo[zInfo.filename] = zInfo
+    target.start_dir = fOut.tell()
+
 # ------------------------------------------------------------------------------
 def zip(f, folder, odf=False):
     '''Zips the content of p_folder into the zip file whose (preferably)
@@ -1,11 +1,11 @@
 # -*- coding: utf-8 -*-
 # ~license~
 # ------------------------------------------------------------------------------
-import xml.sax, difflib, types, cgi, datetime, io
+import xml.sax, difflib, types, cgi, datetime, io, re
 from xml.parsers.expat import XML_PARAM_ENTITY_PARSING_NEVER
 from xml.sax.handler import ContentHandler, ErrorHandler, feature_external_ges
 from xml.sax.xmlreader import InputSource
-from xml.sax import SAXParseException
+from xml.sax import SAXParseException, make_parser
 from appy.utils import sequenceTypes
 
 # Constants --------------------------------------------------------------------
@@ -50,6 +50,37 @@ for k, v in html.entities.entitydefs.items():
     if k not in HTML_ENTITIES and k not in XML_ENTITIES:
         HTML_ENTITIES[k] = ''
 
+# Replacements performed by escapeXml, keyed by tuples (b_odf, s_nsText,
+# b_escapeApos). Every value is a tuple of (s_char, s_replacement) pairs.
+# Chaining calls to str.replace is faster than str.translate, that is slow as
+# soon as chars are replaced with several chars, and than any char-by-char
+# processing.
+escapeTables = {}
+
+def getReplacements(table):
+    '''Converts dict p_table ~{s_char: s_replacement}~ into a tuple of pairs
+       for m_escapeXml or m_escapeXhtml. "&" must be replaced first: else, the
+       "&"s from the entities produced by the other replacements would be
+       replaced again.'''
+    return tuple(sorted(table.items(), key=lambda pair: pair[0] != '&'))
+
+def getEscapeTable(odf, nsText, escapeApos):
+    '''Gets, from escapeTables, the replacements to perform by m_escapeXml,
+       or creates them if they do not exist yet.'''
+    key = (odf, nsText, escapeApos)
+    if key in escapeTables: return escapeTables[key]
+    table = escapeApos and XML_SPECIAL_CHARS.copy() or \
+            XML_SPECIAL_CHARS_NO_APOS.copy()
+    if odf:
+        # A "tab" is inserted before the "line-break". This way, when text is
+        # justified, the part to the left of the tab does not span the entire
+        # page width, which can be ugly if the text is made of a few words.
+        table['\n'] = '<%s:tab/><%s:line-break/>' % (nsText, nsText)
+        table['\t'] = '<%s:tab/>' % nsText
+        table['\r'] = ''
+    res = escapeTables[key] = getReplacements(table)
+    return res
+
 def escapeXml(s, format='xml', nsText='text', escapeApos=False):
     '''Returns p_s, whose XML special chars have been replaced with escaped XML
        entities. If p_format is "odf", line breaks and tabs are converted to
@@ -59,40 +90,21 @@ def escapeXml(s, format='xml', nsText='text', escapeApos=False):
 
        Most of the time, we do not escape 'apos' (there is no particular need
        for that), excepted if p_escapeApos is True.'''
-    res = ''
     odf = format == 'odf'
-    xmlChars = escapeApos and XML_SPECIAL_CHARS or XML_SPECIAL_CHARS_NO_APOS
-    for c in s:
-        if c in xmlChars:
-            res += xmlChars[c]
-        elif odf and (c == '\n'):
-            # A "tab" is inserted before the "line-break". This way, when text
-            # is justified, the part to the left of the tab does not span the
-            # entire page width, which can be ugly if the text is made of a few
-            # words.
-            res += '<%s:tab/><%s:line-break/>' % (nsText, nsText)
-        elif odf and (c == '\t'):
-            res += '<%s:tab/>' % nsText
-        elif odf and (c == '\r'):
-            pass
-        else:
-            res += c
-    return res
+    for char, replacement in getEscapeTable(odf, nsText, escapeApos):
+        if char in s: s = s.replace(char, replacement)
+    return s
+
+# The replacements performed by m_escapeXhtml
+XHTML_TABLE = getReplacements(dict(XML_SPECIAL_CHARS_NO_APOS,
+                                   **{'\n': '<br/>', '\r': ''}))
 
 def escapeXhtml(s):
     '''Return p_s, whose XHTML special chars and carriage return chars have
        been replaced with corresponding XHTML entities.'''
-    res = ''
-    for c in s:
-        if c in XML_SPECIAL_CHARS_NO_APOS:
-            res += XML_SPECIAL_CHARS_NO_APOS[c]
-        elif c == '\n':
-            res += '<br/>'
-        elif c == '\r':
-            pass
-        else:
-            res += c
-    return res
+    for char, replacement in XHTML_TABLE:
+        if char in s: s = s.replace(char, replacement)
+    return s
 
 # ------------------------------------------------------------------------------
 class UnicodeBuffer:
@@ -250,12 +262,16 @@ class XmlParser(ContentHandler, ErrorHandler):
 
     def parse(self, xml, source='string'):
         '''Parses a XML stream.
-           * If p_source is "string", p_xml must be a string containing
-             valid XML content.
+           * If p_source is "string", p_xml must be a string or bytes
+             containing valid XML content.
            * If p_source is "file": p_xml can be:
              - a string containing the path to the XML file on disk;
-             - a file instance opened for reading. Note that in this case, this
-               method will close it.
+             - a file instance opened for reading, preferably in binary mode,
+               like a member of a zip file opened with zipfile.ZipFile.open.
+               Note that in this case, this method will close it.
+           In all cases, the SAX parser reads the XML content by chunks and
+           feeds it to expat incrementally: a file is never read in memory as
+           a whole.
         '''
         self._xml = xml
         self.parser.setContentHandler(self)
@@ -263,15 +279,24 @@ class XmlParser(ContentHandler, ErrorHandler):
         self.parser.setFeature(feature_external_ges, False)
         inputSource = InputSource()
         if source == 'string':
+            # Bytes are not decoded: expat decodes them chunk by chunk
             if isinstance(xml, bytes):
-                xml = xml.decode()
-            inputSource.setByteStream(io.StringIO(xml))
-        else:
-            if not isinstance(xml, io.IOBase):
-                xml = open(xml)
-            inputSource.setByteStream(xml)
-        self.parser.parse(inputSource)
-        if isinstance(xml, io.IOBase): xml.close()
+                xml = io.BytesIO(xml)
+            else:
+                xml = io.StringIO(xml)
+        elif not isinstance(xml, io.IOBase):
+            xml = open(xml, 'rb')
+        inputSource.setByteStream(xml)
+        try:
+            self.parser.parse(inputSource)
+        except Exception:
+            # After a parsing error, the SAX parser considers it is still
+            # parsing: it would not call m_startDocument on the next parse.
+            # Replace it, for this instance to be reusable.
+            self.parser = make_parser()
+            raise
+        finally:
+            xml.close()
         return self.res
 
 # ------------------------------------------------------------------------------
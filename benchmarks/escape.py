@@ -0,0 +1,83 @@
+'''Micro-benchmark for appy.xml.escapeXml and appy.xml.escapeXhtml.
+
+   Usage: python benchmarks/escape.py [number]
+
+   Compares, on typical strings, the current functions with the previous,
+   char-by-char implementations (after having checked that both produce the
+   same results), and prints the time of p_number calls for every case.'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import sys, timeit
+from appy.xml import escapeXml, escapeXhtml, XML_SPECIAL_CHARS, \
+                     XML_SPECIAL_CHARS_NO_APOS
+
+# ------------------------------------------------------------------------------
+def oldEscapeXml(s, format='xml', nsText='text', escapeApos=False):
+    '''The previous implementation of escapeXml'''
+    res = ''
+    odf = format == 'odf'
+    xmlChars = escapeApos and XML_SPECIAL_CHARS or XML_SPECIAL_CHARS_NO_APOS
+    for c in s:
+        if c in xmlChars:
+            res += xmlChars[c]
+        elif odf and (c == '\n'):
+            res += '<%s:tab/><%s:line-break/>' % (nsText, nsText)
+        elif odf and (c == '\t'):
+            res += '<%s:tab/>' % nsText
+        elif odf and (c == '\r'):
+            pass
+        else:
+            res += c
+    return res
+
+def oldEscapeXhtml(s):
+    '''The previous implementation of escapeXhtml'''
+    res = ''
+    for c in s:
+        if c in XML_SPECIAL_CHARS_NO_APOS:
+            res += XML_SPECIAL_CHARS_NO_APOS[c]
+        elif c == '\n':
+            res += '<br/>'
+        elif c == '\r':
+            pass
+        else:
+            res += c
+    return res
+
+# ------------------------------------------------------------------------------
+# Strings to escape
+strings = {
+  'short':   'Mr Smith',
+  'plain':   'The quick brown fox jumps over the lazy dog. ' * 20,
+  'special': 'Tom & Jerry <"cartoon"> l\'été\r\n\tnext line. ' * 20,
+  'dense':   '<&>"\'\n' * 150,
+}
+
+# The cases to benchmark: (name, new function, old function, kwargs)
+cases = (
+  ('escapeXml', escapeXml, oldEscapeXml, {}),
+  ('escapeXml (odf)', escapeXml, oldEscapeXml,
+   {'format': 'odf', 'nsText': 'text'}),
+  ('escapeXml (apos)', escapeXml, oldEscapeXml, {'escapeApos': True}),
+  ('escapeXhtml', escapeXhtml, oldEscapeXhtml, {}),
+)
+
+def run(number=10000):
+    '''Runs the benchmark'''
+    print('%-18s %-8s %10s %10s %8s' % ('Function', 'String', 'Old (s)',
+                                        'New (s)', 'Speedup'))
+    for name, new, old, kwargs in cases:
+        for sName, s in strings.items():
+            if new(s, **kwargs) != old(s, **kwargs):
+                raise Exception('%s: different results for "%s".' % \
+                                (name, sName))
+            oldTime = timeit.timeit(lambda: old(s, **kwargs), number=number)
+            newTime = timeit.timeit(lambda: new(s, **kwargs), number=number)
+            print('%-18s %-8s %10.4f %10.4f %7.1fx' % (name, sName, oldTime,
+                  newTime, oldTime / newTime))
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    run(len(sys.argv) > 1 and int(sys.argv[1]) or 10000)
+# ------------------------------------------------------------------------------
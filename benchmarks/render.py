@@ -0,0 +1,244 @@
+'''Benchmark for POD and PX rendering.
+
+   Usage: python benchmarks/render.py [options] [case ...]
+
+   Renders the templates from appy/pod/test/templates, and PX pages, with
+   synthetic contexts of increasing sizes (number of rows, of XHTML chunks
+   taken from the Xhtml* contexts in appy/pod/test/contexts...). Templates are
+   rendered as is, or compiled once (see appy.pod.template.CompiledTemplate).
+   For every case and size, it reports the latency percentiles over several
+   runs, the throughput (size units per second) and the peak memory allocated
+   by Python while rendering (measured by tracemalloc, in a separate run).
+
+   Results can be saved as JSON (option -o), and compared with a baseline
+   produced the same way by a previous run (option -b): a case whose median
+   latency is higher than the baseline's by more than a given percentage is
+   reported as a regression, and the script then exits with code 1.
+
+   Cases are named "<case>/<size>". Positional arguments restrict the run to
+   the cases whose names start with one of them, ie "pod", "px" or
+   "pod.ForTable".'''
+
+# ~license~
+# ------------------------------------------------------------------------------
+import os, sys, json, time, math, shutil, platform, tempfile, tracemalloc, \
+       subprocess, importlib
+from optparse import OptionParser
+from appy.px import Px
+from appy.pod.renderer import Renderer
+from appy.pod.template import CompiledTemplate
+from appy.pod.test.contexts import Person
+from appy.pod.test.contexts.ForCell6 import Student
+
+# ------------------------------------------------------------------------------
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(
+                         os.path.abspath(__file__))), 'appy', 'pod', 'test',
+                         'templates')
+USAGE = __doc__.split('\n\n')[1].strip().replace('Usage: ', '')
+
+# Synthetic contexts -----------------------------------------------------------
+def getPersons(size):
+    return {'persons': [Person('P%d' % i) for i in range(size)]}
+
+def getStudents(size):
+    return {'students': [Student(parent_guardian='Parent %d' % i,
+      street='Street %d' % i, city='Flawinne', state='Namur', zip='5020',
+      lname='Name %d' % i, fname='First name %d' % i) for i in range(size)]}
+
+# The Xhtml* contexts whose "xhtmlInput" chunks are used to produce large XHTML
+# content. Contexts containing XHTML tables are not used: converting them fails
+# for now.
+XHTML_CONTEXTS = ('XhtmlComplex', 'XhtmlComplex3', 'XhtmlComplex5',
+  'XhtmlComplex8', 'XhtmlEntities', 'XhtmlListProperties', 'XhtmlPIntoLis',
+  'XhtmlSpan', 'XhtmlWithStyle')
+
+def getXhtmlChunks():
+    '''Returns the "xhtmlInput" chunks from the XHTML_CONTEXTS'''
+    return [importlib.import_module('appy.pod.test.contexts.%s' % name). \
+            xhtmlInput for name in XHTML_CONTEXTS]
+
+def getXhtml(size):
+    chunks = getXhtmlChunks()
+    return {'xhtmlInput': '\n'.join([chunks[i % len(chunks)] \
+                                     for i in range(size)])}
+
+# PX pages ---------------------------------------------------------------------
+PX_ROW = '''<tr class=":loop.p.odd and 'odd' or 'even'" var="name=p.name">
+ <td>:name</td><td>:p.lastName</td><td>:p.firstName</td>
+ <td if="p.address">:p.address</td><td if="not p.address">-</td>
+ <td><input type="checkbox" checked=":loop.p.first"/></td></tr>'''
+
+PX_PAGE = '''<html><head><title>:title</title></head><body>
+ <h1>:title</h1><p>:"%d persons" % len(persons)</p>
+ <table><x for="p in persons">:row</x></table></body></html>'''
+
+def getPxRenderer(compiled):
+    '''Returns a function rendering, with the PX interpreter or compiler, a
+       page listing persons.'''
+    row = Px(PX_ROW)
+    page = Px(PX_PAGE)
+    row.useCompiler = page.useCompiler = compiled
+    def render(context, folder):
+        page(dict(context, row=row, title='Persons'))
+    return render
+
+# POD templates ----------------------------------------------------------------
+def getPodRenderer(template, compiled=False, **kwargs):
+    '''Returns a function rendering p_template as an ODT file. Errors are
+       raised: a benchmark must not measure the dump of errors. If p_compiled
+       is True, p_template is compiled once for all: renderings do not parse
+       it anymore.'''
+    template = os.path.join(TEMPLATES, template)
+    if compiled:
+        template = CompiledTemplate.fromFile(template, raiseOnError=True)
+    def render(context, folder):
+        result = os.path.join(folder, 'result.odt')
+        Renderer(template, context, result, overwriteExisting=True,
+                 raiseOnError=True, **kwargs).run()
+    return render
+
+# The cases to benchmark: (name, renderer, context producer, sizes, unit)
+cases = (
+  ('pod.ForTable', getPodRenderer('ForTable.odt'), getPersons,
+   (1000, 10000, 100000), 'rows'),
+  ('pod.ForTable.streaming', getPodRenderer('ForTable.odt', streaming=True),
+   getPersons, (1000, 10000, 100000), 'rows'),
+  ('pod.ForTable.compiled', getPodRenderer('ForTable.odt', compiled=True),
+   getPersons, (1000, 10000, 100000), 'rows'),
+  ('pod.SimpleForRow', getPodRenderer('SimpleForRow.odt'), getPersons,
+   (1000, 10000), 'rows'),
+  ('pod.ForCell', getPodRenderer('ForCell.odt'), getPersons, (1000, 10000),
+   'cells'),
+  ('pod.ForCell6', getPodRenderer('ForCell6.odt'), getStudents,
+   (1000, 10000), 'cells'),
+  ('pod.ForCell6.compiled', getPodRenderer('ForCell6.odt', compiled=True),
+   getStudents, (1000, 10000), 'cells'),
+  ('pod.Xhtml', getPodRenderer('XhtmlComplex4.odt'), getXhtml,
+   (10, 100, 300), 'chunks'),
+  ('pod.Xhtml.compiled', getPodRenderer('XhtmlComplex4.odt', compiled=True),
+   getXhtml, (10, 100, 300), 'chunks'),
+  ('px.interpreted', getPxRenderer(False), getPersons,
+   (100, 1000, 10000, 100000), 'rows'),
+  ('px.compiled', getPxRenderer(True), getPersons,
+   (100, 1000, 10000, 100000), 'rows'),
+)
+
+# ------------------------------------------------------------------------------
+def percentile(values, p):
+    '''Returns the p_p-th percentile of sorted p_values (nearest rank)'''
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+def measure(render, context, runs, folder):
+    '''Renders p_context p_runs times (after a warm-up run) and returns a dict
+       of stats.'''
+    render(context, folder)
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        render(context, folder)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    # Measure memory in a separate run: tracemalloc slows rendering down
+    tracemalloc.start()
+    try:
+        render(context, folder)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'runs': runs, 'min': times[0], 'mean': sum(times) / runs,
+            'p50': percentile(times, 50), 'p90': percentile(times, 90),
+            'p99': percentile(times, 99), 'max': times[-1],
+            'peakMemory': peak}
+
+def getMeta():
+    '''Returns info about the environment the benchmark runs in'''
+    r = {'python': platform.python_version(), 'platform': platform.platform(),
+         'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+    try:
+        r['commit'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+          cwd=os.path.dirname(os.path.abspath(__file__)),
+          stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        pass
+    return r
+
+def run(names=None, runs=5, scale=1.0, maxSize=None):
+    '''Runs the cases whose names start with one of p_names (all if None).
+       Sizes are multiplied by p_scale; sizes above p_maxSize are skipped.
+       Returns the results as a dict.'''
+    results = {}
+    folder = tempfile.mkdtemp(prefix='appy.bench.')
+    print('%-32s %10s %10s %10s %10s %12s %10s' % ('Case', 'p50 (s)',
+          'p90 (s)', 'p99 (s)', 'Max (s)', 'Throughput', 'Peak (Mb)'))
+    try:
+        for name, render, getContext, sizes, unit in cases:
+            if names and not [n for n in names if name.startswith(n)]:
+                continue
+            for size in sizes:
+                size = max(1, int(size * scale))
+                if maxSize and (size > maxSize): continue
+                stats = measure(render, getContext(size), runs, folder)
+                stats['size'] = size
+                stats['unit'] = unit
+                stats['throughput'] = size / stats['p50']
+                key = '%s/%d' % (name, size)
+                results[key] = stats
+                print('%-32s %10.4f %10.4f %10.4f %10.4f %7d %-4s %10.1f' % \
+                      (key, stats['p50'], stats['p90'], stats['p99'],
+                       stats['max'], stats['throughput'], unit,
+                       stats['peakMemory'] / 1048576.0))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    return {'meta': getMeta(), 'results': results}
+
+def compare(results, baseline, threshold=10.0):
+    '''Compares p_results with a p_baseline and prints, for every case found
+       in both, the change in median latency and peak memory. Returns the
+       names of cases whose median latency increased by more than p_threshold
+       percent.'''
+    regressions = []
+    print('\n%-32s %10s %10s %9s %9s' % ('Case', 'Base (s)', 'Now (s)',
+                                          'Time', 'Memory'))
+    base = baseline['results']
+    for key, stats in results['results'].items():
+        if key not in base: continue
+        old = base[key]
+        delta = (stats['p50'] - old['p50']) * 100.0 / old['p50']
+        mem = (stats['peakMemory'] - old['peakMemory']) * 100.0 / \
+              max(old['peakMemory'], 1)
+        flag = ''
+        if delta > threshold:
+            regressions.append(key)
+            flag = ' REGRESSION'
+        print('%-32s %10.4f %10.4f %+8.1f%% %+8.1f%%%s' % (key, old['p50'],
+              stats['p50'], delta, mem, flag))
+    return regressions
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    optParser = OptionParser(usage=USAGE)
+    add = optParser.add_option
+    add('-n', '--runs', dest='runs', type='int', default=5,
+        help='The number of measured runs per case (default: 5).')
+    add('-s', '--scale', dest='scale', type='float', default=1.0,
+        help='A factor applied to the sizes of all cases (default: 1).')
+    add('-m', '--max-size', dest='maxSize', type='int', default=None,
+        help='Skip the cases whose size is above this one.')
+    add('-o', '--output', dest='output', default=None,
+        help='Save the results, as JSON, in this file.')
+    add('-b', '--baseline', dest='baseline', default=None,
+        help='Compare the results with those saved in this file.')
+    add('-t', '--threshold', dest='threshold', type='float', default=10.0,
+        help='The increase of median latency, in percent, above which a ' \
+             'case is considered as a regression (default: 10).')
+    options, args = optParser.parse_args()
+    results = run(args, options.runs, options.scale, options.maxSize)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, options.threshold): sys.exit(1)
+# ------------------------------------------------------------------------------
@@ -28,3 +28,826 @@ class PackagesTests(unittest.TestCase):
         
 
 
+
+class PxTests(unittest.TestCase):
+
+    def test_px(self):
+        # PXs are parsed lazily: check them explicitly
+        from appy.px.check import checkModules
+        errors = checkModules('appy.ui.layout', 'appy.ui.utils')
+        self.assertEqual(errors, [])
+
+    def test_px_error(self):
+        from appy.px import Px
+        px = Px('<div>:1</span>')
+        self.assertRaises(Exception, px.check)
+
+    def render(self, content, context, compiled):
+        '''Renders PX p_content with p_context, interpreted or p_compiled.
+           Returns the result, or the exception class and message, and the
+           context afterwards.'''
+        from appy.px import Px
+        px = Px(content)
+        px.useCompiler = compiled
+        context = dict(context)
+        try:
+            res = px(context)
+        except Exception as e:
+            res = (e.__class__, str(e).split('\n')[0])
+        if compiled: self.assertTrue(px.function)
+        context.pop('__builtins__', None)
+        loop = context.pop('loop', None)
+        return res, sorted(vars(loop)) if loop else None, \
+               [(k, repr(v)) for k, v in sorted(context.items()) \
+                if k != '_ctx_']
+
+    def test_px_compiler(self):
+        # A compiled PX must produce the same result, and leave the same
+        # context, as an interpreted one.
+        from appy.px import Px
+        inner = Px('<i>:v</i>')
+        pairs = [(1, 2), (3, 4)]
+        cases = (
+         ('<div for="x in l"><b>:x</b><span if="x%2">odd</span></div>',
+          {'l': [1, 2, 3]}),
+         ('<x for="a,b in p"><p>:a+b</p><p>:loop.a.nb</p><p>:loop.a.last</p>'
+          '<p>:loop.a.odd</p></x>', {'p': pairs}),
+         ('<div var="y=3; z=y*2" var2="w=z+1">:w</div><p>:nope|"err"</p>',
+          {'y': 0}),
+         ('<input checked=":c"/><option selected=":not c">o</option>',
+          {'c': True}),
+         ('<p>:"&lt;b&gt;"</p><p>::"&lt;b&gt;"</p><p>:None</p><p>:1.5</p>',
+          {}),
+         ('<x for="v in l">:inner</x>', {'l': ['a', 'b'], 'inner': inner}),
+         ('<div for="r in rows"><div for="r in r">:r</div>:loop.r.nb</div>',
+          {'rows': [[1, 2], [3]], 'r': 'kept'}),
+         ('<x var="a=1; a=2">:a</x><x var="@g=5"></x><x if="">no</x>', {}),
+         ('<x for="e in []">:e</x><x for="e in iter([1])">:loop.e.length</x>',
+          {}),
+         ('<p for="x in 3">:x</p>', {}),
+         ('<p>:1/0</p>', {}),
+        )
+        for content, context in cases:
+            self.assertEqual(self.render(content, context, False),
+                             self.render(content, context, True))
+
+    def test_px_compiler_fallback(self):
+        # A PX whose generated code can't be compiled by Python (too many
+        # nested blocks) is interpreted.
+        from appy.px import Px
+        depth = 25
+        content = ''.join(['<x for="i%d in l">' % i for i in range(depth)]) + \
+                  ':i0' + '</x>' * depth
+        px = Px(content)
+        px.useCompiler = True
+        self.assertEqual(px({'l': [1]}), Px(content)({'l': [1]}))
+        self.assertIs(px.function, False)
+
+    def test_px_render_into(self):
+        from appy.px import Px
+        tpl = Px('<html>:content</html>', prologue='<!DOCTYPE html>',
+                 unicode=False)
+        page = Px('<p for="v in l">:v</p>', template=tpl, hook='content')
+        for compiled in (False, True):
+            page.useCompiler = tpl.useCompiler = compiled
+            chunks = []
+            page.renderInto({'l': 'ab'}, chunks.append)
+            self.assertTrue(len(chunks) > 1)
+            self.assertEqual(''.join(chunks).encode('utf-8'), page({'l':'ab'}))
+
+    def test_px_profiler(self):
+        from appy.px import Px
+        from appy.px.profiler import Profiler
+        class Counter(Profiler):
+            counted = 0
+            def iterations(self, count): self.counted += count
+        for compiled in (False, True):
+            profiler = Counter(exprThreshold=0)
+            cell = Px('<td>:v</td>')
+            row = Px('<tr for="v in r">:cell</tr>')
+            row.profile('row', profiler)
+            cell.profile('cell', profiler)
+            row.useCompiler = cell.useCompiler = compiled
+            row({'r': [1, 2], 'cell': cell})
+            self.assertEqual(profiler.stats['row'][0], 1)
+            self.assertEqual(profiler.stats['cell'][0], 2)
+            self.assertEqual(sorted(profiler.paths),
+                             [('row',), ('row', 'cell')])
+            self.assertEqual(profiler.expressions[('cell', 'v')][0], 2)
+            self.assertTrue('row;cell ' in profiler.getFolded())
+            # Interpreted and compiled "for" statements count iterations
+            self.assertEqual(profiler.counted, 2)
+        # The AST of an interpreted PX is bound to the profiler when profiling
+        # is enabled or disabled, not at every rendering.
+        px = Px('<p>:v</p>')
+        px.useCompiler = False
+        px({'v': 1})
+        self.assertIsNone(px.parser.env.profiler)
+        profiler = Profiler(exprThreshold=0)
+        px.profile('p', profiler)
+        self.assertIs(px.parser.env.profiler, profiler)
+        px({'v': 1})
+        self.assertEqual(profiler.expressions[('p', 'v')][0], 1)
+        px.profile('p', Profiler())
+        self.assertIsNone(px.parser.env.profiler)
+        px.profile('p', None)
+        self.assertIsNone(px.parser.env.profiler)
+
+    def test_px_escape(self):
+        from appy.xml import escapeXml, escapeXhtml
+        s = 'a&b <"c">\'\r\n\td'
+        escaped = 'a&amp;b &lt;&quot;c&quot;&gt;'
+        self.assertEqual(escapeXml(s), escaped + '\'\r\n\td')
+        self.assertEqual(escapeXml(s, escapeApos=True),
+                         escaped + '&apos;\r\n\td')
+        self.assertEqual(escapeXml(s, format='odf', nsText='t'),
+                         escaped + '\'<t:tab/><t:line-break/><t:tab/>d')
+        self.assertEqual(escapeXhtml(s), escaped + '\'<br/>\td')
+        # Strings without any char to escape are returned as is
+        s = 'plain text'
+        self.assertIs(escapeXml(s), s)
+        self.assertIs(escapeXhtml(s), s)
+
+
+    def test_px_cache(self):
+        import os, tempfile, shutil
+        import appy.px.cache
+        from appy.px import Px
+        from appy.px.cache import PxCache
+        content = '<div for="x in l"><b if="x%2">:x</b>:loop.x.nb</div>'
+        context = {'l': [1, 2, 3]}
+        expected = Px(content)(context)
+        folder = tempfile.mkdtemp()
+        cache = Px.cache
+        try:
+            Px.cache = PxCache(folder)
+            # A first PX is parsed and cached
+            self.assertEqual(Px(content)(context), expected)
+            key = '<x>%s</x>' % content
+            path = Px.cache.getPath(key)
+            self.assertTrue(os.path.exists(path))
+            # Another one with the same source is loaded from the cache
+            px = Px(content)
+            px.parse = None
+            self.assertEqual(px(context), expected)
+            # A source or cache version change invalidates the cached AST
+            self.assertNotEqual(Px.cache.getPath(key + ' '), path)
+            version = appy.px.cache.CACHE_VERSION
+            appy.px.cache.CACHE_VERSION += 1
+            try:
+                self.assertNotEqual(Px.cache.getPath(key), path)
+            finally:
+                appy.px.cache.CACHE_VERSION = version
+            # A corrupted or truncated file is ignored and replaced
+            with open(path, 'rb') as f: data = f.read()
+            for corrupted in (b'garbage', data[:len(data) // 2]):
+                with open(path, 'wb') as f: f.write(corrupted)
+                self.assertIsNone(Px.cache.get(key))
+                self.assertEqual(Px(content)(context), expected)
+                self.assertIsNotNone(Px.cache.get(key))
+        finally:
+            Px.cache = cache
+            shutil.rmtree(folder)
+
+
+class PodTests(unittest.TestCase):
+
+    def getTemplate(self, name):
+        import os.path
+        import appy.pod
+        return os.path.join(os.path.dirname(appy.pod.__file__), 'test',
+                            'templates', name)
+
+    def render(self, template, context, prepare=None, **kwargs):
+        '''Renders p_template (a file name from appy/pod/test/templates or a
+           Template instance) with p_context. If given, p_prepare is called
+           with the renderer before running it. Returns the renderer and the
+           files from the result, as a dict ~{s_name: bytes}~.'''
+        import os, zipfile, tempfile, shutil
+        from appy.pod.renderer import Renderer
+        if isinstance(template, str): template = self.getTemplate(template)
+        folder = tempfile.mkdtemp()
+        try:
+            result = os.path.join(folder, 'result.odt')
+            renderer = Renderer(template, context, result, **kwargs)
+            if prepare: prepare(renderer)
+            renderer.run()
+            with zipfile.ZipFile(result) as z:
+                files = {name: z.read(name) for name in z.namelist()}
+        finally:
+            shutil.rmtree(folder)
+        return renderer, files
+
+    def getContext(self, name):
+        '''Gets the context for template p_name from appy/pod/test/contexts'''
+        import importlib
+        module = importlib.import_module('appy.pod.test.contexts.%s' % name)
+        return {k: v for k, v in vars(module).items() if k[0] != '_'}
+
+    def test_pod_buffer_entries(self):
+        from appy.px.parser import PxEnvironment
+        from appy.pod.buffers import MemoryBuffer
+        from appy.pod.elements import Expression
+        env = PxEnvironment()
+        root = MemoryBuffer(env, None)
+        # Interleave text, expressions and a sub-buffer
+        root.write('<p>a')
+        root.addExpression('x')
+        root.write('b')
+        sub = root.addSubBuffer()
+        sub.write('S')
+        root.write('c')
+        root.addExpression('y')
+        root.write('</p>')
+        # Put an expression at the same index as the sub-buffer: like in the
+        # original buffer iterator, the sub-buffer comes first.
+        index = list(root.subBuffers)[0]
+        z = Expression('z', False)
+        root.elements[index] = z
+        entries = root.getEntries()
+        x, y = root.elements[4], root.elements[8]
+        self.assertEqual(entries, [(4, x), (index, sub), (index, z), (8, y)])
+        root.freeze()
+        self.assertEqual(root.entries, tuple(entries))
+        self.assertEqual(sub.entries, ())
+        self.assertIs(root.getEntries(), root.entries)
+        result = MemoryBuffer(env, None)
+        root.evaluate(result, {'x': 1, 'y': 2, 'z': 3})
+        self.assertEqual(result.content, '<p>a1bS3c2</p>')
+
+    def test_pod_compile_expr(self):
+        from appy.pod.elements import compileExpr, compileExprs, _compile
+        # Compiled expressions are cached, whitespace being ignored
+        _compile.cache_clear()
+        code = compileExpr('a + 1')
+        self.assertEqual(eval(code, {'a': 1}), 2)
+        self.assertIs(compileExpr(' a + 1\n'), code)
+        info = _compile.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+        self.assertEqual(compileExprs('a|b')[1], compileExpr('b'))
+        # Uncompilable expressions are returned as is, and fail when eval'ed
+        for source, error in (('a +', SyntaxError),
+                              ('a\x00', (SyntaxError, ValueError))):
+            self.assertEqual(compileExpr(source), source)
+            with self.assertRaises(error): eval(compileExpr(source), {'a': 1})
+
+    def test_pod_compiled_meta_if(self):
+        import io, zipfile
+        from appy.pod.template import CompiledTemplate
+        # Make the "meta-if False" statements depend on the context
+        statement = b'meta-if metaCondition'
+        data = io.BytesIO()
+        with zipfile.ZipFile(self.getTemplate('IfAndFors1.odt')) as zin, \
+             zipfile.ZipFile(data, 'w') as zout:
+            for info in zin.infolist():
+                content = zin.read(info.filename)
+                if info.filename == 'content.xml':
+                    content = content.replace(b'meta-if False', statement)
+                zout.writestr(info, content)
+        template = CompiledTemplate(data.getvalue())
+        context = self.getContext('IfAndFors1')
+        # The meta-if notes are dumped as-is when their condition is False...
+        context['metaCondition'] = False
+        content = self.render(template, context)[1]['content.xml']
+        self.assertEqual(content.count(statement), 5)
+        # ... but not anymore when the same template is rendered again, with
+        # a True condition.
+        context['metaCondition'] = True
+        content = self.render(template, context)[1]['content.xml']
+        self.assertEqual(content.count(statement), 0)
+
+    def test_pod_meta_if_note_index(self):
+        from appy.pod.actions import MetaIf
+        index = MetaIf.getNoteIndex
+        # Other elements whose name starts with "text:p" are skipped
+        content = '<table:table-cell><text:page-number>1</text:page-number>' \
+                  '<text:p/><text:p text:style-name="P1">a</text:p>' \
+                  '</table:table-cell>'
+        i = index(content)
+        self.assertTrue(content[:i].endswith('<text:p text:style-name="P1">'))
+        self.assertEqual(index('<text:p>a</text:p>'), 8)
+        # Without paragraph, the note goes into the main element
+        content = '<table:table-cell><text:page-number>1</text:page-number>' \
+                  '</table:table-cell>'
+        self.assertEqual(index(content), len('<table:table-cell>'))
+        # Without any element, it is dumped first
+        self.assertEqual(index('text'), 0)
+
+    def test_pod_streaming(self):
+        import re
+        name = 'IfAndFors1.odt'
+        context = self.getContext('IfAndFors1')
+        # Ignore the dates of notes. Empty folders are zipped with a leading
+        # slash by appy.utils.zip.zip.
+        dates = re.compile(rb'<dc:date>.*?</dc:date>')
+        clean = lambda files: {n.lstrip('/'): dates.sub(b'', content) \
+                               for n, content in files.items()}
+        default = self.render(name, context)[1]
+        streamed = self.render(name, context, streaming=True)[1]
+        # The streamed result contains the same files, with the same content
+        self.assertEqual(clean(streamed), clean(default))
+
+    def test_pod_copy_zipped(self):
+        import io, zipfile
+        from appy.utils.zip import copyZipped
+        class Stream(io.BytesIO):
+            # An unseekable stream: zipfile writes data descriptors
+            def seekable(self): return False
+            def seek(self, *args): raise OSError()
+            def tell(self): raise OSError()
+        source = Stream()
+        text = b'abc' * 10000
+        binary = bytes(range(256)) * 10
+        with zipfile.ZipFile(source, 'w', zipfile.ZIP_DEFLATED) as z:
+            with z.open('a.txt', 'w') as f: f.write(text)
+            z.writestr('b.bin', binary, compress_type=zipfile.ZIP_STORED)
+        source = zipfile.ZipFile(io.BytesIO(source.getvalue()))
+        target = io.BytesIO()
+        with zipfile.ZipFile(target, 'w') as z:
+            for info in source.infolist(): copyZipped(source, z, info)
+        target = zipfile.ZipFile(target)
+        self.assertIsNone(target.testzip())
+        self.assertEqual(target.read('a.txt'), text)
+        self.assertEqual(target.read('b.bin'), binary)
+        # Compressed data was copied as is
+        for info in source.infolist():
+            copied = target.getinfo(info.filename)
+            self.assertEqual(copied.compress_type, info.compress_type)
+            self.assertEqual(copied.compress_size, info.compress_size)
+            self.assertEqual(copied.CRC, info.CRC)
+
+    def test_pod_template_cache(self):
+        from appy.pod.template import templates
+        name = 'IfAndFors1.odt'
+        context = self.getContext('IfAndFors1')
+        path = self.getTemplate(name)
+        templates.clear()
+        # Templates are not cached by default
+        self.render(name, context)
+        self.assertEqual(len(templates.templates), 0)
+        self.render(name, context, cacheTemplate=True)
+        cached = templates.get(path)
+        self.assertEqual(list(templates.templates.values()), [cached])
+        # The next renderer reuses the cached template
+        renderer = self.render(name, context, cacheTemplate=True)[0]
+        self.assertIs(renderer.stylesManager.styles, cached.styles)
+        templates.clear()
+
+    def test_pod_result_types(self):
+        import os, tempfile, shutil
+        from appy.pod import PodError
+        from appy.pod.renderer import Renderer
+        template = self.getTemplate('IfAndFors1.odt')
+        folder = tempfile.mkdtemp()
+        try:
+            results = [os.path.join(folder, name) \
+                       for name in ('a.pdf', 'b.odt', 'c.pdf')]
+            # Every result must be of a distinct type
+            self.assertRaises(PodError, Renderer, template, {}, results)
+            Renderer(template, {}, results[:2])
+        finally:
+            shutil.rmtree(folder)
+
+    def test_pod_errors(self):
+        from appy.pod.template import CompiledTemplate
+        name = 'XhtmlSimple.odt'
+        compiled = CompiledTemplate.fromFile(self.getTemplate(name))
+        # Variable "xhtmlInput" is missing: an error is dumped as a note
+        for name in (name, compiled):
+            renderer, files = self.render(name, {})
+            self.assertEqual(renderer.getErrors(), 1)
+            self.assertIn(b'<office:annotation>', files['content.xml'])
+            renderer = self.render(name, {'xhtmlInput': '<p>Text</p>'})[0]
+            self.assertEqual(renderer.getErrors(), 0)
+
+    def test_pod_compiled_output(self):
+        import re
+        from appy.pod.template import CompiledTemplate
+        # Error notes are dated: ignore dates, that may differ by a second
+        date = re.compile(rb'<dc:date>[^<]*</dc:date>')
+        for name in ('SimpleTest', 'OnlyExpressions', 'FieldExpressions',
+                     'IfAndFors1', 'SimpleForRow', 'SimpleIfIsFalse',
+                     'ForCell6', 'XhtmlNominal', 'Chart1'):
+            template = self.getTemplate(name + '.odt')
+            compiled = CompiledTemplate.fromFile(template)
+            files = self.render(template, self.getContext(name))[1]
+            cFiles = self.render(compiled, self.getContext(name))[1]
+            for part in ('content.xml', 'styles.xml'):
+                self.assertEqual(date.sub(b'', files[part]),
+                                 date.sub(b'', cFiles[part]), name)
+
+    def test_pod_compiled_concurrency(self):
+        import threading
+        from appy.pod.template import CompiledTemplate
+        compiled = CompiledTemplate.fromFile(self.getTemplate('ForCell6.odt'))
+        students = self.getContext('ForCell6')['students']
+        failures = []
+        def render(count):
+            # With count=0, variable "students" is missing
+            context = count and {'students': students[:count]} or {}
+            for i in range(5):
+                renderer, files = self.render(compiled, context)
+                content = files['content.xml']
+                last = b'First name %d' % count
+                next = b'First name %d' % (count + 1)
+                if (count and last not in content) or next in content or \
+                   renderer.getErrors() != (not count and 1 or 0):
+                    failures.append(count)
+        threads = [threading.Thread(target=render, args=(count,)) \
+                   for count in range(len(students))]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(failures, [])
+
+    def test_pod_styles_mapping_cache(self):
+        renderer = self.render('XhtmlComplex4.odt', {'xhtmlInput': ''})[0]
+        manager = renderer.stylesManager
+        compiled = []
+        compile = manager.compileStylesMapping
+        def compileStylesMapping(mapping):
+            compiled.append(compile(mapping))
+            return compiled[-1]
+        manager.compileStylesMapping = compileStylesMapping
+        xhtml = '<p>Text</p>'
+        expected = '<text:p text:style-name="Text_20_body">Text</text:p>'
+        # An equal mapping is compiled only once
+        for i in range(2):
+            self.assertEqual(renderer.renderXhtml(xhtml,
+                             stylesMapping={'p': 'Text body'}), expected)
+        self.assertEqual(len(compiled), 1)
+        key = (('p', 'Text body'),)
+        self.assertIs(manager.checkedMappings[key], compiled[0])
+        # The cache is bounded: the least recently used mapping is removed
+        manager.checkedMappingsSize = 2
+        for name in ('Heading', 'Text body', 'Heading 1'):
+            renderer.renderXhtml(xhtml, stylesMapping={'p': name})
+        self.assertEqual(len(compiled), 3)
+        self.assertEqual(list(manager.checkedMappings),
+                         [key, (('p', 'Heading 1'),)])
+
+    def test_pod_template_parts(self):
+        import re
+        from appy.pod.template import Template
+        name = 'IfAndFors1.odt'
+        context = self.getContext('IfAndFors1')
+        template = Template.fromFile(self.getTemplate(name))
+        # Neither the zipped template nor its content.xml is kept in memory
+        self.assertIsNone(template.data)
+        self.assertNotIn('content.xml', template.parts)
+        # Notes are dated: ignore their dates
+        dates = re.compile(rb'<dc:date>.*?</dc:date>')
+        getContent = lambda files: dates.sub(b'', files['content.xml'])
+        expected = getContent(self.render(name, context)[1])
+        for streaming in (False, True):
+            files = self.render(template, context, streaming=streaming)[1]
+            self.assertEqual(getContent(files), expected)
+
+    def test_pod_lo_server_command(self):
+        import os, sys, json, tempfile, shutil
+        from appy.pod.lo_pool import LoServer
+        # Use a fake "soffice" executable, in a folder whose name contains a
+        # space, that dumps its arguments.
+        folder = tempfile.mkdtemp(suffix=' lo')
+        try:
+            soffice = os.path.join(folder, 'soffice')
+            out = os.path.join(folder, 'args.json')
+            with open(soffice, 'w') as f:
+                f.write('#!%s\nimport sys, json\njson.dump(sys.argv[1:], ' \
+                        'open(%r, "w"))\n' % (sys.executable, out))
+            os.chmod(soffice, 0o755)
+            server = LoServer(2099, soffice)
+            server.start()
+            server.process.wait(10)
+            with open(out) as f: args = json.load(f)
+            self.assertEqual(args, server.getCommand()[1:])
+            self.assertEqual(args[-2],
+                             '--accept=socket,host=localhost,port=2099;urp;')
+            self.assertTrue(args[-1].startswith('-env:UserInstallation=file:'))
+        finally:
+            shutil.rmtree(folder)
+
+    def test_pod_prefetch_images(self):
+        import threading, http.server
+        from appy.pod.doc_importers import ImageImporter
+        with open(ImageImporter.imageNotFound, 'rb') as f: jpg = f.read()
+        hits = []
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits.append(self.path)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(jpg)))
+                self.end_headers()
+                self.wfile.write(jpg)
+            def log_message(self, *args): pass
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            urls = ['http://127.0.0.1:%d/%d.jpg' % (server.server_port, i) \
+                    for i in range(3)]
+            xhtml = ''.join(['<p><img src="%s"/></p>' % u for u in urls])
+            prefetch = lambda renderer: renderer.prefetchImages(urls, 2)
+            renderer, files = self.render('XhtmlComplex4.odt',
+              {'xhtmlInput': xhtml}, prefetch, raiseOnError=True)
+        finally:
+            server.shutdown()
+            server.server_close()
+        # Every image was downloaded once, by the prefetcher, and imported
+        self.assertEqual(sorted(hits), ['/0.jpg', '/1.jpg', '/2.jpg'])
+        pictures = [n for n in files if n.startswith('Pictures/')]
+        self.assertEqual(len(pictures), 3)
+        self.assertEqual(files['content.xml'].count(b'<draw:image '), 3)
+        self.assertEqual(renderer.imagePrefetcher.downloads, {})
+
+    def test_pod_render_many(self):
+        import os, zipfile, tempfile, shutil
+        from appy.pod.batch import renderMany
+        template = self.getTemplate('ForCell6.odt')
+        good = self.getContext('ForCell6')
+        # The second context lacks variable "students": its document fails
+        contexts = [good, {}, good]
+        folder = tempfile.mkdtemp()
+        try:
+            pattern = os.path.join(folder, 'result%d.odt')
+            for workers in (1, 2):
+                results = renderMany(template, contexts, pattern,
+                                     workers=workers, chunkSize=1,
+                                     raiseOnError=True)
+                self.assertEqual([r.index for r in results], [0, 1, 2])
+                self.assertEqual([r.result for r in results],
+                                 [pattern % i for i in range(3)])
+                self.assertIsNone(results[0].error)
+                self.assertIn('students', results[1].error)
+                self.assertIsNone(results[2].error)
+                for i in (0, 2):
+                    with zipfile.ZipFile(pattern % i) as z:
+                        content = z.read('content.xml')
+                    self.assertIn(b'First name 5', content)
+                for i in range(3):
+                    if os.path.exists(pattern % i): os.remove(pattern % i)
+        finally:
+            shutil.rmtree(folder)
+
+    def test_pod_metrics(self):
+        students = self.getContext('ForCell6')['students']
+        renderer, files = self.render('ForCell6.odt', {'students': students})
+        self.assertIsNone(renderer.metrics)
+        counts = []
+        for count in (1, len(students)):
+            context = {'students': students[:count]}
+            # Calling a finalize function disables streaming
+            finalize = lambda folder, renderer: None
+            for streaming in (False, True):
+                renderer, files = self.render('ForCell6.odt', context,
+                  metrics=True, streaming=streaming,
+                  finalizeFunction=None if streaming else finalize)
+                self.assertEqual(renderer.streaming, streaming)
+                metrics = renderer.metrics
+                self.assertEqual('finalize' in metrics['phases'],
+                                 not streaming)
+                # A single "for" statement iterates over the students
+                self.assertEqual(metrics['iterations'], count)
+                for name in ('unzip', 'stylesManager', 'content', 'styles',
+                             'patch', 'zip'):
+                    self.assertEqual(metrics['phases'][name]['count'], 1)
+                self.assertEqual(metrics['bytes']['content'],
+                                 len(files['content.xml']))
+            counts.append(metrics['expressions'])
+        # Every student cell evaluates the same 7 expressions
+        self.assertEqual(counts[1] - counts[0], 7 * (len(students) - 1))
+
+    # XHTML chunks converted by tests about POD function "xhtml"
+    xhtmlChunks = (
+      '<p style="text-align: center">Hello <b>you</b></p>',
+      '<ul><li>One</li><li class="Quote">Two</li></ul>',
+      '<p>Hello <i>again</i></p><ol><li>Three</li></ol>',
+      '<p style="text-align: center">Hello <b>you</b></p>')
+
+    def renderXhtml(self, convert, chunks=None, prepare=None, **kwargs):
+        '''Renders XhtmlComplex4.odt, whose POD function "xhtml" is replaced
+           by p_convert(renderer, xhtmlInput), xhtmlInput being p_chunks or
+           self.xhtmlChunks. If given, p_prepare is called with the renderer
+           before running it. Returns the renderer and content.xml.'''
+        def prepareXhtml(renderer):
+            renderer.contentParser.env.context['xhtml'] = \
+                lambda s: convert(renderer, s)
+            if prepare: prepare(renderer)
+        context = {'xhtmlInput': chunks or self.xhtmlChunks}
+        renderer, files = self.render('XhtmlComplex4.odt', context,
+          prepareXhtml, raiseOnError=True, **kwargs)
+        return renderer, files['content.xml']
+
+    def test_pod_xhtml_cache(self):
+        results = []
+        def convert(renderer, chunks):
+            res = [renderer.renderXhtml(s) for s in chunks]
+            results.append(res)
+            return ''.join(res)
+        renderer, cached = self.renderXhtml(convert, xhtmlCache=3)
+        # Identical chunks produced identical results, got from the cache
+        res = results[0]
+        self.assertIs(res[3], res[0])
+        self.assertEqual(len(renderer.xhtmlCache), 3)
+        # With a smaller cache, the first chunk was evicted before being reused
+        renderer, content = self.renderXhtml(convert, xhtmlCache=2)
+        self.assertIsNot(results[1][3], results[1][0])
+        self.assertEqual(len(renderer.xhtmlCache), 2)
+        self.assertEqual(content, cached)
+        # Results are the same without cache
+        renderer, content = self.renderXhtml(convert)
+        self.assertIsNone(renderer.xhtmlCache)
+        self.assertEqual(results[2], res)
+        self.assertEqual(content, cached)
+
+    def test_pod_xhtml_many(self):
+        results = []
+        def convertMany(renderer, chunks):
+            res = renderer.renderXhtmlMany(chunks)
+            results.append(res)
+            return ''.join(res)
+        def convert(renderer, chunks):
+            res = [renderer.renderXhtml(s) for s in chunks]
+            results.append(res)
+            return ''.join(res)
+        many = self.renderXhtml(convertMany)[1]
+        one = self.renderXhtml(convert)[1]
+        self.assertEqual(len(results[0]), len(self.xhtmlChunks))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(many, one)
+
+    def test_pod_find_style_cache(self):
+        searched = []
+        def count(renderer):
+            # Count the searches performed by the styles manager
+            manager = renderer.stylesManager
+            search = manager.searchStyle
+            def searchStyle(xhtmlElem, localStylesMapping):
+                searched.append(manager.getSignature(xhtmlElem))
+                return search(xhtmlElem, localStylesMapping)
+            manager.searchStyle = searchStyle
+        def uncached(renderer):
+            # Search the style of every element
+            manager = renderer.stylesManager
+            manager.findStyle = manager.searchStyle
+        convert = lambda renderer, chunks: ''.join(
+          [renderer.renderXhtml(s) for s in chunks])
+        chunks = self.xhtmlChunks * 3
+        cached = self.renderXhtml(convert, chunks, count)[1]
+        # Every signature was searched once
+        self.assertTrue(searched)
+        self.assertEqual(len(searched), len(set(searched)))
+        content = self.renderXhtml(convert, chunks, uncached)[1]
+        self.assertEqual(content, cached)
+
+    def test_pod_asynchronous(self):
+        import os, threading, tempfile, shutil
+        from concurrent.futures import ThreadPoolExecutor
+        from appy.pod.renderer import Renderer
+        release = threading.Event()
+        class FakeRenderer(Renderer):
+            # Simulates a conversion to PDF that waits for "release"
+            def callLibreOffice(self, resultName, resultType):
+                release.wait(10)
+                with open('%s.pdf' % os.path.splitext(resultName)[0],
+                          'w') as f:
+                    f.write('PDF')
+                return ''
+        folder = tempfile.mkdtemp()
+        try:
+            result = os.path.join(folder, 'result.pdf')
+            renderer = FakeRenderer(self.getTemplate('ForCell6.odt'),
+                                    self.getContext('ForCell6'), result,
+                                    asynchronous=True)
+            future = renderer.run()
+            # The conversion runs in the background
+            self.assertFalse(future.done())
+            self.assertFalse(os.path.exists(result))
+            release.set()
+            self.assertEqual(future.result(10), result)
+            with open(result) as f: self.assertEqual(f.read(), 'PDF')
+            self.assertFalse(os.path.exists(renderer.tempFolder))
+            # Without conversion, the result is produced synchronously
+            result = os.path.join(folder, 'result.odt')
+            renderer = FakeRenderer(self.getTemplate('ForCell6.odt'),
+                                    self.getContext('ForCell6'), result,
+                                    asynchronous=True)
+            self.assertIsNone(renderer.run())
+            self.assertTrue(os.path.exists(result))
+            # The default executor is created on first use, and is not used
+            # when a converter pool is given.
+            self.assertIsNotNone(Renderer.converterExecutor)
+            Renderer.stopConverterExecutor()
+            self.assertIsNone(Renderer.converterExecutor)
+            class Pool:
+                submitted = 0
+                def submit(self, fun, *args):
+                    self.submitted += 1
+                    return executor.submit(fun, *args)
+            pool = Pool()
+            result = os.path.join(folder, 'result2.pdf')
+            executor = ThreadPoolExecutor(1)
+            try:
+                renderer = FakeRenderer(self.getTemplate('ForCell6.odt'),
+                                        self.getContext('ForCell6'), result,
+                                        asynchronous=True, converterPool=pool)
+                self.assertEqual(renderer.run().result(10), result)
+            finally:
+                executor.shutdown()
+            self.assertEqual(pool.submitted, 1)
+            self.assertIsNone(Renderer.converterExecutor)
+            FakeRenderer.converterThreads = 2
+            self.assertEqual(renderer.getConverterExecutor()._max_workers, 2)
+            self.assertIs(Renderer.getConverterExecutor(),
+                          Renderer.converterExecutor)
+        finally:
+            release.set()
+            Renderer.stopConverterExecutor()
+            shutil.rmtree(folder)
+
+    def test_pod_xhtml_converter(self):
+        from appy.pod.xhtml2odt import XhtmlConverter, Xhtml2OdtConverter
+        results = []
+        def convert(renderer, chunks):
+            manager = renderer.stylesManager
+            mapping = manager.checkStylesMapping({})
+            chunks = ['<p>%s</p>' % s for s in chunks]
+            # A converter per chunk, created with the original signature
+            single = [Xhtml2OdtConverter(s, 'utf-8', manager, mapping, True,
+                                         renderer).run() for s in chunks]
+            many = XhtmlConverter(manager, renderer).convertMany(chunks,
+                                                                 mapping, True)
+            results.append((single, many))
+            return ''.join(many)
+        self.renderXhtml(convert)
+        single, many = results[0]
+        self.assertEqual(len(single), len(self.xhtmlChunks))
+        self.assertEqual(single, many)
+        self.assertIn('KeepWithNext', many[2])
+
+    def test_pod_result_cache(self):
+        import os, time, tempfile, shutil
+        from appy.model.utils import Object as O
+        from appy.pod.cache import ResultCache
+        folder = tempfile.mkdtemp()
+        try:
+            cache = ResultCache(os.path.join(folder, 'cache'), maxSize=25)
+            field = O(name='doc')
+            template = os.path.join(folder, 'template.odt')
+            with open(template, 'w') as f: f.write('v1')
+            result = os.path.join(folder, 'result.odt')
+            with open(result, 'w') as f: f.write('0123456789')
+            copy = os.path.join(folder, 'copy.odt')
+            obj = O(id='o1', modified=1)
+            path = cache.getPath(obj, field, template, 'odt', 'k')
+            self.assertEqual(cache.getPath(obj, field, template, 'odt', 'k'),
+                             path)
+            # The key changes with the object, cache key, format or template
+            self.assertNotEqual(cache.getPath(obj, field, template, 'odt',
+                                              'k2'), path)
+            self.assertNotEqual(cache.getPath(obj, field, template, 'pdf',
+                                              'k'), path)
+            obj.modified = 2
+            modified = cache.getPath(obj, field, template, 'odt', 'k')
+            self.assertNotEqual(modified, path)
+            obj.modified = 1
+            with open(template, 'w') as f: f.write('v2')
+            # Ensure the template hash is recomputed
+            os.utime(template, (time.time() + 10, time.time() + 10))
+            self.assertNotEqual(cache.getPath(obj, field, template, 'odt',
+                                              'k'), path)
+            # Get / put
+            self.assertFalse(cache.get(path, copy))
+            self.assertTrue(cache.put(path, result))
+            self.assertTrue(cache.get(path, copy))
+            with open(copy) as f: self.assertEqual(f.read(), '0123456789')
+            # A result containing errors is not cached
+            errored = cache.getPath(O(id='o2'), field, template, 'odt', 'k')
+            self.assertFalse(cache.put(errored, result, errors=1))
+            self.assertFalse(os.path.exists(errored))
+            # Exceeding the maximum size evicts the least recently used entries
+            paths = [path]
+            for i in range(2):
+                other = cache.getPath(O(id='o%d' % (i + 3)), field, template,
+                                      'odt', 'k')
+                # Make mtimes, on which LRU is based, distinct
+                time.sleep(0.01)
+                cache.put(other, result)
+                paths.append(other)
+            self.assertFalse(os.path.exists(paths[0]))
+            self.assertTrue(os.path.exists(paths[1]))
+            self.assertTrue(os.path.exists(paths[2]))
+            self.assertEqual(cache.size, 20)
+            # Getting an entry marks it as recently used
+            time.sleep(0.01)
+            self.assertTrue(cache.get(paths[1], copy))
+            cache.put(path, result)
+            self.assertTrue(os.path.exists(paths[1]))
+            self.assertFalse(os.path.exists(paths[2]))
+            # Invalidation removes all the entries of an object
+            cache.invalidate(O(id='o4'))
+            self.assertFalse(os.path.exists(os.path.dirname(paths[2])))
+            cache.invalidate(O(id='o3'))
+            self.assertFalse(cache.get(paths[1], copy))
+            self.assertIsNone(cache.size)
+        finally:
+            shutil.rmtree(folder)